@@ -0,0 +1,224 @@
+"""
+Expired routes kept as compressed, day-partitioned Parquet files for history queries
+"""
+import json
+import logging
+import math
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from geo import to_point
+
+# Routes per Parquet file and per Mongo delete
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_COMPRESSION = 'zstd'
+DEFAULT_QUERY_LIMIT = 1000
+MAX_QUERY_LIMIT = 100000
+# Equality filters a query may push down to the files
+FILTER_COLUMNS = ('routeId', 'userID', 'socketId', 'source_zone', 'destination_zone', 'path_hash')
+# Returned when a query names no columns; 'document' holds the full route as JSON
+SUMMARY_COLUMNS = (
+    'routeId', 'userID', 'timestamp', 'source_lat', 'source_lng',
+    'destination_lat', 'destination_lng', 'source_zone', 'destination_zone',
+    'path_points', 'date'
+)
+
+
+def _load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:  # pyarrow is optional; without it expired routes are deleted
+        return None
+    return pyarrow
+
+
+def parse_timestamp(value):
+    """Naive UTC datetime from a stored route timestamp, or None"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def _row(route, archived_at):
+    fingerprint = route.get('fingerprint') or {}
+    source = to_point(route.get('source')) or (None, None)
+    destination = to_point(route.get('destination')) or (None, None)
+    path = route.get('path')
+    return {
+        'routeId': route.get('routeId'),
+        'userID': str(route['userID']) if route.get('userID') is not None else None,
+        'socketId': route.get('socketId'),
+        'timestamp': parse_timestamp(route.get('timestamp')),
+        'source_lat': source[0],
+        'source_lng': source[1],
+        'destination_lat': destination[0],
+        'destination_lng': destination[1],
+        'source_zone': fingerprint.get('source_zone'),
+        'destination_zone': fingerprint.get('destination_zone'),
+        'path_hash': fingerprint.get('path_hash'),
+        'path_points': len(path) if isinstance(path, list) else 0,
+        'archived_at': archived_at,
+        'document': json.dumps(route, separators=(',', ':'), default=str)
+    }
+
+
+class RouteArchive:
+    """Writes route batches under directory/date=YYYY-MM-DD/ and scans them back
+
+    Each batch becomes one file per day it spans, so a query bounded in time
+    opens only the matching day directories, and Parquet row-group statistics
+    skip the rest. Files are written under a dot-prefixed name and renamed, so
+    readers never see a partial file.
+    """
+
+    def __init__(self, directory, pyarrow_module=None):
+        self.pa = pyarrow_module or _load_pyarrow()
+        if self.pa is None:
+            raise RuntimeError('pyarrow is not installed')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.schema = self.pa.schema([
+            ('routeId', self.pa.string()),
+            ('userID', self.pa.string()),
+            ('socketId', self.pa.string()),
+            ('timestamp', self.pa.timestamp('us')),
+            ('source_lat', self.pa.float64()),
+            ('source_lng', self.pa.float64()),
+            ('destination_lat', self.pa.float64()),
+            ('destination_lng', self.pa.float64()),
+            ('source_zone', self.pa.string()),
+            ('destination_zone', self.pa.string()),
+            ('path_hash', self.pa.string()),
+            ('path_points', self.pa.int32()),
+            ('archived_at', self.pa.timestamp('us')),
+            ('document', self.pa.string())
+        ])
+        self.partitioning = self.pa.dataset.partitioning(
+            self.pa.schema([('date', self.pa.string())]), flavor='hive'
+        )
+
+    @classmethod
+    def create(cls, directory):
+        """A RouteArchive, or None when pyarrow is unavailable"""
+        pyarrow_module = _load_pyarrow()
+        if pyarrow_module is None:
+            logging.warning("⚠️ pyarrow not installed; expired routes will be deleted, not archived")
+            return None
+        return cls(directory, pyarrow_module)
+
+    def write(self, routes):
+        """Append routes to the archive; returns the number written
+
+        Raises on failure so the caller keeps the routes in Mongo.
+        """
+        archived_at = datetime.utcnow()
+        by_day = {}
+        for route in routes:
+            row = _row(route, archived_at)
+            day = (row['timestamp'] or archived_at).date().isoformat()
+            by_day.setdefault(day, []).append(row)
+
+        for day, rows in by_day.items():
+            table = self.pa.Table.from_pylist(rows, schema=self.schema)
+            partition = os.path.join(self.directory, f'date={day}')
+            os.makedirs(partition, exist_ok=True)
+            name = f"routes-{archived_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+            temp_path = os.path.join(partition, f'.{name}')
+            self.pa.parquet.write_table(table, temp_path, compression=ARCHIVE_COMPRESSION)
+            os.replace(temp_path, os.path.join(partition, name))
+        return len(routes)
+
+    def _filter(self, start=None, end=None, filters=None):
+        field = self.pa.dataset.field
+        expression = None
+
+        def both(condition):
+            return condition if expression is None else expression & condition
+
+        # The date bounds prune partitions; the timestamp bounds use row-group stats
+        if start:
+            expression = both(field('date') >= start.date().isoformat())
+            expression = both(field('timestamp') >= self.pa.scalar(start, self.pa.timestamp('us')))
+        if end:
+            expression = both(field('date') <= end.date().isoformat())
+            expression = both(field('timestamp') < self.pa.scalar(end, self.pa.timestamp('us')))
+        for column, value in (filters or {}).items():
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f'Cannot filter on {column}')
+            expression = both(field(column) == str(value))
+        return expression
+
+    def _dataset(self):
+        return self.pa.dataset.dataset(
+            self.directory, schema=self.schema.append(self.pa.field('date', self.pa.string())),
+            format='parquet', partitioning=self.partitioning
+        )
+
+    def query(self, start=None, end=None, filters=None, columns=None, limit=DEFAULT_QUERY_LIMIT):
+        """Archived routes matching the time range and equality filters
+
+        Only the requested columns are read. Requesting 'document' returns
+        each full route as it was stored.
+        """
+        if limit < 1:
+            raise ValueError('limit must be a positive integer')
+        columns = list(columns or SUMMARY_COLUMNS)
+        unknown = set(columns) - set(self.schema.names) - {'date'}
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(sorted(unknown))}")
+
+        scanner = self._dataset().scanner(columns=columns, filter=self._filter(start, end, filters))
+        rows = scanner.head(min(limit, MAX_QUERY_LIMIT)).to_pylist()
+        for row in rows:
+            for column, value in row.items():
+                if isinstance(value, datetime):
+                    row[column] = value.isoformat()
+            if row.get('document'):
+                row['document'] = json.loads(row['document'])
+        return rows
+
+    def count(self, start=None, end=None, filters=None):
+        """Archived routes matching the filters, counted without materializing rows"""
+        return self._dataset().count_rows(filter=self._filter(start, end, filters))
+
+    def stats(self):
+        """Files and bytes on disk per day partition"""
+        days = {}
+        for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+            if not entry.is_dir() or not entry.name.startswith('date='):
+                continue
+            files = [f for f in os.scandir(entry.path) if f.name.endswith('.parquet')
+                     and not f.name.startswith('.')]
+            days[entry.name[len('date='):]] = {
+                'files': len(files),
+                'bytes': sum(f.stat().st_size for f in files)
+            }
+        return days
+
+
+def parse_range(start=None, end=None, days=None):
+    """Datetimes for a query range from ISO strings, or the last `days` days"""
+    start_time = parse_timestamp(start) if start else None
+    end_time = parse_timestamp(end) if end else None
+    if (start and start_time is None) or (end and end_time is None):
+        raise ValueError('start and end must be ISO timestamps')
+    if days and not start_time:
+        days = float(days)
+        if not math.isfinite(days) or days <= 0:
+            raise ValueError('days must be a positive number')
+        try:
+            start_time = (end_time or datetime.utcnow()) - timedelta(days=days)
+        except OverflowError:
+            raise ValueError('days is out of range') from None
+    return start_time, end_time
@@ -1,15 +1,41 @@
 import logging
-import json
 import time
 from datetime import datetime
 from flask_socketio import SocketIO, emit
 
+from fingerprint import apply_fingerprint
+from ownership import scoped_route_id
+from matching import MatchQuery, TopKMatches, parse_match_options
+from route_index import RouteIndex
+from state_store import ShardedStore
+from subscriptions import SubscriptionRegistry
+from tiles import DensityTiles
+from validation import apply_route_patch, normalize_route, parse_payload, validate_batch
+
 class BroadcastHandler:
-    def __init__(self, socketio=None, storage_handler=None):
+    def __init__(self, socketio=None, storage_handler=None, expiry_scheduler=None,
+                 route_expiry_hours=24, client_timeout_hours=24, journal=None,
+                 match_cache=None, shard_coordinator=None, recorder=None,
+                 compute_pool=None):
         self.socketio = socketio
         self.storage_handler = storage_handler
-        self.connected_clients = {}
-        self.active_routes = {}
+        self.expiry_scheduler = expiry_scheduler
+        self.journal = journal
+        self.match_cache = match_cache
+        # Optional worker processes holding route state partitioned by region
+        self.shards = shard_coordinator
+        # Optional TrafficRecorder capturing inbound socket events for replay
+        self.recorder = recorder
+        # Optional ComputePool running fingerprinting in worker processes
+        self.compute_pool = compute_pool
+        self.route_expiry_hours = route_expiry_hours
+        self.client_timeout_hours = client_timeout_hours
+        # Shared with REST handlers and scheduler threads; see state_store
+        self.connected_clients = ShardedStore()
+        self.active_routes = ShardedStore()
+        self.route_index = RouteIndex()
+        self.density_tiles = DensityTiles()
+        self.subscriptions = SubscriptionRegistry()
     
     def init_socketio(self, socketio):
         """Initialize with SocketIO instance"""
@@ -20,26 +46,58 @@ class BroadcastHandler:
         """Setup SocketIO event handlers"""
         @self.socketio.on('connect')
         def handle_connect():
+            self._record_event('connect')
             return self.handle_client_connect()
         
         @self.socketio.on('disconnect')
         def handle_disconnect():
+            self._record_event('disconnect')
             return self.handle_client_disconnect()
         
         @self.socketio.on('message')
         def handle_message(message_data):
+            self._record_event('message', message_data)
             return self.handle_route_message(message_data)
+        
+        @self.socketio.on('bulk-message')
+        def handle_bulk(batch_data):
+            self._record_event('bulk-message', batch_data)
+            return self.handle_bulk_message(batch_data)
+        
+        @self.socketio.on('subscribe-matches')
+        def handle_subscribe(subscription_data):
+            self._record_event('subscribe-matches', subscription_data)
+            return self.handle_subscribe_matches(subscription_data)
+        
+        @self.socketio.on('unsubscribe-matches')
+        def handle_unsubscribe():
+            self._record_event('unsubscribe-matches')
+            return self.handle_unsubscribe_matches()
+    
+    def _record_event(self, event, data=None):
+        """Capture an inbound socket event when traffic recording is on"""
+        if self.recorder:
+            from flask import request
+            self.recorder.record('socket', event, data, sid=request.sid)
     
     def handle_client_connect(self):
         """Handle new client connection"""
         from flask import request
         
         client_sid = request.sid
+        connected_at = time.time()
         self.connected_clients[client_sid] = {
-            'connected_at': time.time(),
+            'connected_at': connected_at,
             'routes': []
         }
         
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.schedule(
+                ('client', client_sid),
+                connected_at + self.client_timeout_hours * 3600,
+                lambda: self.expire_client(client_sid)
+            )
+        
         logging.info(f"✅ New Socket.io client connected: {client_sid}")
         
         # Emit current client count to all clients
@@ -63,13 +121,21 @@ class BroadcastHandler:
         client_sid = request.sid
         
         # Remove from connected clients
-        if client_sid in self.connected_clients:
-            del self.connected_clients[client_sid]
+        self.connected_clients.pop(client_sid, None)
         
         # Remove from active routes and notify others
-        if client_sid in self.active_routes:
+        removed_route = self.active_routes.pop(client_sid, None)
+        if removed_route is not None:
+            self._invalidate_matches(removed_route)
             self.socketio.emit('user-disconnected', {'socketId': client_sid}, include_self=False)
-            del self.active_routes[client_sid]
+            self._unindex_route(client_sid)
+            self._journal_delete(client_sid)
+        
+        self.subscriptions.unsubscribe(client_sid)
+        
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.cancel(('client', client_sid))
+            self.expiry_scheduler.cancel(('route', client_sid))
             
         logging.info(f"❌ Client disconnected: {client_sid}")
         self.socketio.emit('clientCount', len(self.connected_clients))
@@ -80,50 +146,42 @@ class BroadcastHandler:
         
         try:
             # Ensure message_data is a dict
-            route_data = message_data if isinstance(message_data, dict) else json.loads(message_data)
+            try:
+                route_data = parse_payload(message_data)
+            except ValueError:
+                emit('error', {'message': 'Invalid JSON payload'})
+                return
             
-            # Validate required fields
-            required_fields = ['userID', 'source', 'destination']
-            if not all(field in route_data for field in required_fields):
-                logging.error(f"❌ Missing required fields in route data: {route_data}")
-                emit('error', {'message': 'Missing required route data'})
+            # Validate fields and coordinates before any state or broadcast work
+            error = normalize_route(route_data)
+            if error:
+                user_id = route_data.get('userID') if isinstance(route_data, dict) else None
+                logging.warning(f"⚠️ Rejected route from {user_id}: {error}")
+                emit('error', {'message': error})
                 return
             
-            # Add socket ID and timestamp
+            # Add socket ID and timestamp; a socket has one active route
             client_sid = request.sid
             route_data['socketId'] = client_sid
+            route_data['routeId'] = client_sid
             route_data['timestamp'] = datetime.utcnow().isoformat()
             
-            # Validate via points if provided
-            if 'via' in route_data and route_data['via']:
-                if not isinstance(route_data['via'], list):
-                    route_data['via'] = []
-                else:
-                    # Validate each via point
-                    valid_via = []
-                    for via_point in route_data['via']:
-                        if isinstance(via_point, list) and len(via_point) >= 2:
-                            try:
-                                lat, lng = float(via_point[0]), float(via_point[1])
-                                valid_via.append([lat, lng])
-                            except (ValueError, TypeError):
-                                continue
-                    route_data['via'] = valid_via
-            else:
-                route_data['via'] = []
-            
-            # Store in active routes
-            self.active_routes[client_sid] = route_data
+            self._store_route(client_sid, route_data)
             
             # Update client's routes in connected_clients
-            if client_sid in self.connected_clients:
-                self.connected_clients[client_sid]['routes'].append(route_data)
+            self.connected_clients.update_item(
+                client_sid,
+                lambda client: client and dict(client, routes=client['routes'] + [route_data])
+            )
             
             logging.info(f"📢 Broadcasting new route from {client_sid}")
             
             # Broadcast to all other clients
             self.socketio.emit('route-update', {'data': route_data}, include_self=False)
             
+            # Push to standing subscriptions the new route matches
+            self.notify_subscribers(route_data)
+            
             # Save the route to storage if available
             if self.storage_handler:
                 success, message = self.storage_handler.save_route(route_data)
@@ -135,6 +193,204 @@ class BroadcastHandler:
             logging.error(f"Message data: {message_data}")
             emit('error', {'message': 'Failed to process route data'})
 
+    def _store_route(self, route_key, route_data):
+        """Fingerprint a validated route and make it active under route_key"""
+        # Fingerprint once at ingest so matching is a hash lookup
+        if 'fingerprint' not in route_data:
+            self._fingerprint(route_data)
+        
+        previous_route = self.active_routes.get(route_key)
+        self.active_routes[route_key] = route_data
+        self._index_route(route_key, route_data)
+        self._schedule_route_expiry(route_key)
+        self._journal_put(route_key, route_data)
+        self._invalidate_matches(previous_route, route_data)
+    
+    def _fingerprint(self, route_data):
+        if self.compute_pool:
+            return self.compute_pool.fingerprint_route(route_data)
+        return apply_fingerprint(route_data)
+    
+    def _index_route(self, route_key, route_data):
+        """Add a route to the match index and the density tiles"""
+        self.route_index.add(route_key, route_data)
+        self.density_tiles.add(route_key, route_data)
+        if self.shards:
+            self.shards.put(route_key, route_data)
+    
+    def _unindex_route(self, route_key):
+        self.route_index.remove(route_key)
+        self.density_tiles.remove(route_key)
+        if self.shards:
+            self.shards.remove(route_key)
+    
+    def shards_available(self):
+        """True when matching can be spread across the shard worker processes"""
+        return bool(self.shards and self.shards.healthy)
+    
+    def update_route(self, route_id, fields, unset=(), append_path=()):
+        """Apply a validated partial update to an active route"""
+        def patch(route_data):
+            if route_data is None:
+                return None
+            updated = apply_route_patch(route_data, fields, unset, append_path)
+            updated['updated_at'] = datetime.utcnow().isoformat()
+            apply_fingerprint(updated)
+            return updated
+        
+        previous_route = self.active_routes.get(route_id)
+        updated = self.active_routes.update_item(route_id, patch)
+        if updated is None:
+            return None
+        self._invalidate_matches(previous_route, updated)
+        self._index_route(route_id, updated)
+        self._journal_put(route_id, updated)
+        self.notify_subscribers(updated)
+        return updated
+    
+    def remove_route(self, route_id):
+        """Remove an active route, returning True if it existed"""
+        removed_route = self.active_routes.pop(route_id, None)
+        if removed_route is None:
+            return False
+        self._invalidate_matches(removed_route)
+        self._unindex_route(route_id)
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.cancel(('route', route_id))
+        self._journal_delete(route_id)
+        return True
+    
+    def handle_bulk_message(self, batch_data):
+        """Handle a batch of routes sent over the socket by a fleet producer"""
+        from flask import request
+        
+        try:
+            items = parse_payload(batch_data)
+            if isinstance(items, dict):
+                items = items.get('routes')
+            if not isinstance(items, list):
+                emit('error', {'message': 'Expected an array of routes'})
+                return
+            
+            # Socket producers own the routes they send for as long as they are connected
+            result = self.ingest_routes(items, owner=request.sid, origin_sid=request.sid)
+            emit('bulk-ack', result)
+            
+        except ValueError as e:
+            emit('error', {'message': str(e)})
+        except Exception as e:
+            logging.error(f"❌ Error processing bulk socket message: {e}")
+            emit('error', {'message': 'Failed to process route batch'})
+    
+    def ingest_routes(self, items, owner, origin_sid=None):
+        """Validate and activate a batch of routes with one write and one broadcast
+
+        Routes are keyed by '<owner>:<routeId or userID>', so each vehicle
+        keeps a single active route like a socket client does, and no
+        producer can replace a route in another's namespace. Raises
+        ValueError when the batch itself is unusable.
+        """
+        valid_routes, errors = validate_batch(items)
+        
+        timestamp = datetime.utcnow().isoformat()
+        for route_data in valid_routes:
+            route_data['routeId'] = scoped_route_id(owner, route_data.get('routeId') or route_data['userID'])
+            route_data['socketId'] = origin_sid or 'rest'
+            route_data['timestamp'] = timestamp
+        if self.compute_pool:
+            # One pass over the batch so long paths are spread across workers
+            self.compute_pool.fingerprint_routes(valid_routes)
+        for route_data in valid_routes:
+            self._store_route(route_data['routeId'], route_data)
+        
+        stored = 0
+        if valid_routes:
+            # One coalesced broadcast for the whole batch
+            if origin_sid:
+                self.socketio.emit('routes-update', {'data': valid_routes}, skip_sid=origin_sid)
+            else:
+                self.socketio.emit('routes-update', {'data': valid_routes})
+            
+            for route_data in valid_routes:
+                self.notify_subscribers(route_data)
+            
+            if self.storage_handler:
+                success, result = self.storage_handler.save_routes(valid_routes)
+                if success:
+                    stored = result
+                else:
+                    logging.warning(f"⚠️ Bulk broadcast continued despite storage failure: {result}")
+        
+        logging.info(f"📦 Ingested {len(valid_routes)} routes in bulk ({len(errors)} rejected)")
+        return {
+            'accepted': len(valid_routes),
+            'rejected': len(errors),
+            'stored': stored,
+            'errors': errors[:100]
+        }
+    
+    def handle_subscribe_matches(self, subscription_data):
+        """Register a standing match query for the calling socket"""
+        from flask import request
+        
+        try:
+            try:
+                data = parse_payload(subscription_data)
+            except ValueError:
+                emit('error', {'message': 'Invalid JSON payload'})
+                return
+            if not isinstance(data, dict):
+                emit('error', {'message': 'Invalid subscription parameters'})
+                return
+            user_id = data.get('userID')
+            path = data.get('path')
+            if not user_id or not path:
+                emit('error', {'message': 'Invalid subscription parameters'})
+                return
+            
+            limit, match_options = parse_match_options(data)
+            query = MatchQuery(user_id, data.get('source'), data.get('destination'), path, **match_options)
+            self.subscriptions.subscribe(request.sid, query)
+            
+            # Seed the subscriber with current matches; later ones are pushed
+            matching_routes = []
+            if self.storage_handler:
+                success, routes = self.storage_handler.find_matching_routes(
+                    user_id, data.get('source'), data.get('destination'), path,
+                    limit=limit, **match_options
+                )
+                if success:
+                    matching_routes = routes
+            if not matching_routes:
+                matching_routes = self.get_fallback_matching_routes(
+                    user_id, data.get('source'), data.get('destination'), path,
+                    limit=limit, **match_options
+                )
+            
+            logging.info(f"🔔 Client {request.sid} subscribed to matches")
+            emit('subscribed', {'data': matching_routes, 'count': len(matching_routes)})
+            
+        except ValueError as e:
+            emit('error', {'message': str(e)})
+        except Exception as e:
+            logging.error(f"❌ Error subscribing to matches: {e}")
+            emit('error', {'message': 'Failed to subscribe to matches'})
+    
+    def handle_unsubscribe_matches(self):
+        """Drop the calling socket's standing match query"""
+        from flask import request
+        
+        self.subscriptions.unsubscribe(request.sid)
+        emit('unsubscribed', {})
+    
+    def notify_subscribers(self, route_data):
+        """Send match-found to every subscriber the new route matches"""
+        try:
+            for client_sid, match in self.subscriptions.matches_for(route_data):
+                self.broadcast_to_client(client_sid, 'match-found', {'data': dict(route_data, **match)})
+        except Exception as e:
+            logging.error(f"❌ Error notifying match subscribers: {e}")
+    
     def get_existing_routes(self):
         """Get existing routes from storage or fallback to in-memory"""
         if self.storage_handler:
@@ -177,6 +433,89 @@ class BroadcastHandler:
         except Exception as e:
             logging.error(f"❌ Error sending {event_name} to {client_sid}: {e}")
     
+    def _schedule_route_expiry(self, route_key, deadline=None):
+        """Evict the route under route_key once its TTL passes"""
+        if self.expiry_scheduler is not None:
+            if deadline is None:
+                deadline = time.time() + self.route_expiry_hours * 3600
+            self.expiry_scheduler.schedule(
+                ('route', route_key),
+                deadline,
+                lambda: self.expire_route(route_key)
+            )
+    
+    def _invalidate_matches(self, *routes):
+        """Drop cached match results the given routes could appear in"""
+        if self.match_cache is not None:
+            for route_data in routes:
+                if route_data:
+                    self.match_cache.invalidate_route(route_data)
+    
+    def _journal_put(self, route_key, route_data):
+        if self.journal:
+            self.journal.put(route_key, route_data)
+            if self.journal.needs_compaction():
+                self.snapshot_state()
+    
+    def _journal_delete(self, route_key):
+        if self.journal:
+            self.journal.delete(route_key)
+    
+    def snapshot_state(self):
+        """Compact the journal into a snapshot of the active routes"""
+        if not self.journal:
+            return 0
+        try:
+            count = self.journal.snapshot(self.active_routes.snapshot)
+            logging.info(f"💾 Snapshotted {count} active routes")
+            return count
+        except Exception as e:
+            logging.error(f"❌ Error snapshotting route state: {e}")
+            return 0
+    
+    def restore_routes(self, routes):
+        """Reload journaled routes after a restart, dropping expired ones"""
+        restored = 0
+        now = time.time()
+        for route_key, route_data in routes.items():
+            try:
+                ingested_at = datetime.fromisoformat(route_data['timestamp'])
+                deadline = (ingested_at - datetime(1970, 1, 1)).total_seconds() + self.route_expiry_hours * 3600
+            except (KeyError, TypeError, ValueError):
+                continue
+            if deadline <= now:
+                continue
+            self.active_routes[route_key] = route_data
+            self._index_route(route_key, route_data)
+            self._schedule_route_expiry(route_key, deadline)
+            restored += 1
+        return restored
+    
+    def expire_route(self, route_key):
+        """Evict an expired route and tell clients it is gone"""
+        expired_route = self.active_routes.pop(route_key, None)
+        if expired_route is None:
+            return
+        self._invalidate_matches(expired_route)
+        self._unindex_route(route_key)
+        self._journal_delete(route_key)
+        logging.info(f"⏰ Route {route_key} expired")
+        self.broadcast_to_all('route-expired', {'socketId': route_key})
+    
+    def expire_client(self, client_sid):
+        """Drop a client whose session outlived the client timeout"""
+        if self.connected_clients.pop(client_sid, None) is None:
+            return
+        self.subscriptions.unsubscribe(client_sid)
+        if self.expiry_scheduler is not None:
+            self.expiry_scheduler.cancel(('route', client_sid))
+        expired_route = self.active_routes.pop(client_sid, None)
+        if expired_route is not None:
+            self._invalidate_matches(expired_route)
+            self._unindex_route(client_sid)
+            self._journal_delete(client_sid)
+        logging.info(f"⏰ Client {client_sid} timed out")
+    
     def cleanup_inactive_clients(self, max_age_hours=24):
         """Remove clients that have been inactive for too long"""
         try:
@@ -189,10 +528,13 @@ class BroadcastHandler:
                     inactive_clients.append(client_sid)
             
             for client_sid in inactive_clients:
-                if client_sid in self.connected_clients:
-                    del self.connected_clients[client_sid]
-                if client_sid in self.active_routes:
-                    del self.active_routes[client_sid]
+                self.connected_clients.pop(client_sid, None)
+                removed_route = self.active_routes.pop(client_sid, None)
+                if removed_route is not None:
+                    self._invalidate_matches(removed_route)
+                    self._journal_delete(client_sid)
+                self._unindex_route(client_sid)
+                self.subscriptions.unsubscribe(client_sid)
                     
             if inactive_clients:
                 logging.info(f"🗑️ Cleaned up {len(inactive_clients)} inactive clients")
@@ -203,27 +545,32 @@ class BroadcastHandler:
             logging.error(f"❌ Error cleaning inactive clients: {e}")
             return 0
     
-    def get_fallback_matching_routes(self, user_id, source, destination, path):
-        """Get matching routes from in-memory storage (fallback)"""
+    def get_fallback_matching_routes(self, user_id, source, destination, path,
+                                     limit=None, query=None, **match_options):
+        """Get the best matching routes from in-memory storage (fallback)"""
         try:
-            matching_routes = []
-            for route_data in self.active_routes.values():
-                if (route_data.get('userID') != user_id and 
-                    route_data.get('path') == path):
-                    route_data['match_type'] = 'exact_path'
-                    route_data['match_score'] = 100
-                    matching_routes.append(route_data)
-                elif (route_data.get('userID') != user_id and 
-                      source and destination and
-                      route_data.get('source') == source and 
-                      route_data.get('destination') == destination):
-                    route_data['match_type'] = 'same_endpoints'
-                    route_data['match_score'] = 80
-                    matching_routes.append(route_data)
-            
-            # Sort by match score
-            matching_routes.sort(key=lambda x: x.get('match_score', 0), reverse=True)
-            return matching_routes
+            query = query or MatchQuery(user_id, source, destination, path, **match_options)
+            if self.shards_available():
+                # Shards exist only once main has loaded the sharding module
+                from sharding import ShardUnavailable
+                try:
+                    return self.shards.find_matching(query, limit)
+                except ShardUnavailable as e:
+                    logging.warning(f"⚠️ Shard matching failed, matching in process: {e}")
+            
+            keys = self.route_index.match_candidates(query)
+            
+            top_matches = TopKMatches(limit)
+            for key in keys:
+                route_data = self.active_routes.get(key)
+                if not route_data:
+                    continue
+                match = query.evaluate(route_data)
+                if match:
+                    top_matches.push(dict(route_data, **match))
+            
+            # Highest score first, newest first among equal scores
+            return top_matches.results()
             
         except Exception as e:
             logging.error(f"❌ Error in fallback matching routes: {e}")
@@ -234,10 +581,20 @@ class BroadcastHandler:
         try:
             cleared_count = len(self.active_routes)
             self.active_routes.clear()
+            self.route_index.clear()
+            self.density_tiles.clear()
+            if self.shards:
+                self.shards.clear()
+            if self.match_cache is not None:
+                self.match_cache.clear()
+            if self.journal:
+                self.journal.clear()
             
             # Clear routes from connected clients
-            for client_data in self.connected_clients.values():
-                client_data['routes'] = []
+            for client_sid in list(self.connected_clients.keys()):
+                self.connected_clients.update_item(
+                    client_sid, lambda client: client and dict(client, routes=[])
+                )
             
             logging.info(f"🗑️ Cleared {cleared_count} active routes")
             return cleared_count
@@ -0,0 +1,225 @@
+"""
+Process pool for CPU-heavy route geometry, kept off the request threads
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from array import array
+from concurrent.futures import (
+    Future, InvalidStateError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+)
+from multiprocessing import shared_memory
+
+from fingerprint import compute_fingerprint
+from geo import to_path
+
+# Paths shorter than this are cheaper to fingerprint inline than to ship to a worker
+OFFLOAD_MIN_POINTS = 500
+# Single-route jobs arriving within this window are sent as one batch
+BATCH_WINDOW_SECONDS = 0.002
+BATCH_SIZE = 256
+# Guards against hung workers; per batch, counted from when a worker could first pick it up
+JOB_TIMEOUT_SECONDS = 30
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block again; pool workers
+        # share the parent's resource tracker, so that is a no-op and the
+        # parent's unlink still unregisters it
+        return shared_memory.SharedMemory(name=name)
+
+
+def _fingerprint_batch(buffer_name, jobs):
+    """Worker: fingerprint routes whose paths live in a shared coordinate buffer
+
+    Each job is (fields, start, count): the route without its path, and the
+    slice of [lat, lng, lat, lng, ...] doubles that holds it.
+    """
+    block = _attach(buffer_name) if buffer_name else None
+    try:
+        coords = block.buf.cast('d') if block else None
+        fingerprints = []
+        for fields, start, count in jobs:
+            route_data = dict(fields)
+            if coords is not None and count:
+                # tolist() copies out, so no view of the block outlives this job
+                flat = coords[start * 2:(start + count) * 2].tolist()
+                route_data['path'] = list(zip(flat[0::2], flat[1::2]))
+            fingerprints.append(compute_fingerprint(route_data))
+        if coords is not None:
+            coords.release()
+        return fingerprints
+    finally:
+        if block:
+            block.close()
+
+
+def _pack(routes):
+    """Split routes into picklable fields plus one shared buffer of path coordinates"""
+    coords = array('d')
+    jobs = []
+    for route_data in routes:
+        fields = {key: value for key, value in route_data.items() if key not in ('path', 'fingerprint')}
+        path = to_path(route_data.get('path'))
+        start = len(coords) // 2
+        for lat, lng in path:
+            coords.append(lat)
+            coords.append(lng)
+        jobs.append((fields, start, len(path)))
+    if not coords:
+        return None, jobs
+    block = shared_memory.SharedMemory(create=True, size=coords.itemsize * len(coords))
+    block.buf[:len(coords) * coords.itemsize] = coords.tobytes()
+    return block, jobs
+
+
+def _settle(result, value=None, exception=None):
+    """Complete a caller's Future unless it was already cancelled on timeout"""
+    try:
+        if exception is not None:
+            result.set_exception(exception)
+        else:
+            result.set_result(value)
+    except InvalidStateError:
+        pass
+
+
+def _path_length(route_data):
+    path = route_data.get('path')
+    return len(path) if isinstance(path, list) else 0
+
+
+class ComputePool:
+    """Managed worker processes for route fingerprinting
+
+    With workers=0 everything runs inline, so callers never need to check
+    whether offloading is configured. A job that fails or times out is
+    cancelled and recomputed inline, so callers always get a result.
+    """
+
+    def __init__(self, workers=0, timeout=JOB_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+
+    def start(self):
+        if self.workers and not self._executor:
+            # Spawned, not forked: the parent runs socket and scheduler threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            logging.info(f"⚙️ Started compute pool with {self.workers} workers")
+
+    def stop(self):
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit_fingerprints(self, routes):
+        """Fingerprint routes in one worker task; returns a Future of the fingerprint list"""
+        block, jobs = _pack(routes)
+        try:
+            future = self._executor.submit(_fingerprint_batch, block.name if block else None, jobs)
+        except Exception:
+            self._release(block)
+            raise
+        future.add_done_callback(lambda _: self._release(block))
+        return future
+
+    @staticmethod
+    def _release(block):
+        if block:
+            block.close()
+            block.unlink()
+
+    def _wait(self, future, routes, timeout=None):
+        """Result of a fingerprint job, recomputed inline if it fails or times out"""
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            logging.warning("⚠️ Fingerprint job timed out; computing inline")
+        except Exception as e:
+            logging.warning(f"⚠️ Fingerprint job failed ({e}); computing inline")
+        return [compute_fingerprint(route_data) for route_data in routes]
+
+    def fingerprint_routes(self, routes):
+        """Attach fingerprints to routes, spreading large batches over the workers"""
+        if not self._executor or sum(_path_length(route) for route in routes) < OFFLOAD_MIN_POINTS:
+            for route_data in routes:
+                route_data['fingerprint'] = compute_fingerprint(route_data)
+            return routes
+
+        chunks = [routes[i:i + BATCH_SIZE] for i in range(0, len(routes), BATCH_SIZE)]
+        submitted_at = time.monotonic()
+        futures = []
+        for chunk in chunks:
+            future = Future()
+            try:
+                future = self.submit_fingerprints(chunk)
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        for index, (chunk, future) in enumerate(zip(chunks, futures)):
+            # Later chunks queue behind earlier ones, so their deadlines are later
+            deadline = submitted_at + self.timeout * (index // self.workers + 1)
+            timeout = max(0.0, deadline - time.monotonic())
+            for route_data, fingerprint in zip(chunk, self._wait(future, chunk, timeout)):
+                route_data['fingerprint'] = fingerprint
+        return routes
+
+    def fingerprint_route(self, route_data):
+        """Attach a fingerprint to one route; long paths are batched with concurrent callers"""
+        if not self._executor or _path_length(route_data) < OFFLOAD_MIN_POINTS:
+            route_data['fingerprint'] = compute_fingerprint(route_data)
+            return route_data['fingerprint']
+
+        result = Future()
+        with self._pending_lock:
+            self._pending.append((route_data, result))
+            if len(self._pending) >= BATCH_SIZE:
+                self._flush_locked()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(BATCH_WINDOW_SECONDS, self._flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        route_data['fingerprint'] = self._wait(result, [route_data])[0]
+        return route_data['fingerprint']
+
+    def _flush(self):
+        with self._pending_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            batch = self.submit_fingerprints([route_data for route_data, _ in pending])
+        except Exception as e:
+            for _, result in pending:
+                result.set_exception(e)
+            return
+
+        def fan_out(done):
+            # Each caller waits on its own Future holding a one-item result
+            try:
+                fingerprints = done.result()
+            except BaseException as e:
+                for _, result in pending:
+                    _settle(result, exception=e)
+                return
+            for (_, result), fingerprint in zip(pending, fingerprints):
+                _settle(result, value=[fingerprint])
+
+        batch.add_done_callback(fan_out)
@@ -22,12 +22,13 @@ class Config:
     STATIC_FOLDER = os.environ.get('STATIC_FOLDER') or None
     
     # Route Configuration
-    ROUTE_EXPIRY_HOURS = int(os.environ.get('ROUTE_EXPIRY_HOURS') or 24)
+    ROUTE_EXPIRY_HOURS = float(os.environ.get('ROUTE_EXPIRY_HOURS') or 24)
     MAX_ROUTES_PER_REQUEST = int(os.environ.get('MAX_ROUTES_PER_REQUEST') or 1000)
     
     # Cleanup Configuration
-    CLEANUP_INTERVAL_HOURS = int(os.environ.get('CLEANUP_INTERVAL_HOURS') or 1)
-    CLIENT_TIMEOUT_HOURS = int(os.environ.get('CLIENT_TIMEOUT_HOURS') or 24)
+    # Fractional hours are allowed
+    CLEANUP_INTERVAL_HOURS = float(os.environ.get('CLEANUP_INTERVAL_HOURS') or 1)
+    CLIENT_TIMEOUT_HOURS = float(os.environ.get('CLIENT_TIMEOUT_HOURS') or 24)
     
     # Admin Configuration
     ADMIN_SECRET_KEY = os.environ.get('ADMIN_SECRET_KEY') or 'admin-secret-key'
@@ -116,7 +117,7 @@ def validate_config(config_dict):
     
     # Validate expiry hours
     expiry_hours = config_dict.get('route_expiry_hours')
-    if expiry_hours and (not isinstance(expiry_hours, int) or expiry_hours < 1):
+    if expiry_hours and (not isinstance(expiry_hours, (int, float)) or expiry_hours <= 0):
         errors.append(f"Invalid route expiry hours: {expiry_hours}")
     
     # Validate max routes
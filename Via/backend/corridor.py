@@ -0,0 +1,77 @@
+"""
+Corridor (partial overlap) matching along a requester's path
+"""
+from collections import defaultdict
+
+from fingerprint import zone_key, zone_keys_in_bbox
+from geo import buffer_degrees, haversine_m, project_onto_segment, to_path, to_point
+
+DEFAULT_BUFFER_M = 500
+MAX_BUFFER_M = 5000
+CORRIDOR_MATCH_SCORE = 60
+
+
+class PathProjector:
+    """Segment index over one path, bucketed by corridor zone"""
+
+    def __init__(self, path, buffer_m=DEFAULT_BUFFER_M):
+        self.path = to_path(path)
+        self.buffer_m = buffer_m
+        self.cumulative_m = [0.0]
+        self.segments_by_zone = defaultdict(list)
+
+        for index, (a, b) in enumerate(zip(self.path, self.path[1:])):
+            self.cumulative_m.append(self.cumulative_m[-1] + haversine_m(a, b))
+            dlat, dlng = buffer_degrees(max(abs(a[0]), abs(b[0])), buffer_m)
+            zones = zone_keys_in_bbox(
+                min(a[0], b[0]) - dlat, min(a[1], b[1]) - dlng,
+                max(a[0], b[0]) + dlat, max(a[1], b[1]) + dlng
+            )
+            for zone in zones:
+                self.segments_by_zone[zone].append(index)
+
+    def zones(self):
+        """Corridor zones within the buffer of any segment"""
+        return set(self.segments_by_zone)
+
+    def project(self, point):
+        """Project a point onto the nearest segment within the buffer"""
+        point = to_point(point)
+        if point is None:
+            return None
+
+        best = None
+        for index in self.segments_by_zone.get(zone_key(point), ()):
+            projected, offset_m, along_m = project_onto_segment(
+                point, self.path[index], self.path[index + 1]
+            )
+            if offset_m > self.buffer_m:
+                continue
+            if best is None or offset_m < best['offset_m']:
+                best = {
+                    'point': [projected[0], projected[1]],
+                    'offset_m': round(offset_m, 1),
+                    'along_m': round(self.cumulative_m[index] + along_m, 1)
+                }
+        return best
+
+    def match(self, route_data):
+        """Match a route whose source and destination lie on the corridor in order"""
+        pickup = self.project(route_data.get('source'))
+        if pickup is None:
+            return None
+        dropoff = self.project(route_data.get('destination'))
+        if dropoff is None or dropoff['along_m'] <= pickup['along_m']:
+            return None
+
+        # The requester leaves the path to each endpoint and comes back
+        detour_m = round(2 * (pickup['offset_m'] + dropoff['offset_m']), 1)
+        penalty = 20 * min(1.0, detour_m / (4 * self.buffer_m)) if self.buffer_m else 0
+        return {
+            'match_type': 'corridor',
+            'match_score': round(CORRIDOR_MATCH_SCORE - penalty),
+            'pickup': pickup,
+            'dropoff': dropoff,
+            'shared_distance_m': round(dropoff['along_m'] - pickup['along_m'], 1),
+            'detour_m': detour_m
+        }
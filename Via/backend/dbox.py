@@ -3,11 +3,49 @@ import json
 from datetime import datetime, timedelta
 from flask_pymongo import PyMongo
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+
+from fingerprint import FINGERPRINT_FIELDS, apply_fingerprint, compute_fingerprint
+from matching import MatchQuery, TopKMatches, endpoint_key
+from replica import RouteReplica
+from validation import apply_route_patch
+
+# expires_at and synced_at are BSON dates for the TTL index and the local
+# replica, and are not sent to clients
+ROUTE_PROJECTION = {'expires_at': 0, 'synced_at': 0}
+# Attempts at a read-patch-write update before giving up on a busy route
+UPDATE_RETRIES = 3
+# Routes re-fingerprinted per bulk_write when backfilling legacy documents
+BACKFILL_BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+# Duplicate routeIds named in the log when the unique index cannot be built
+DUPLICATE_ID_LOG_LIMIT = 20
+# With an archive the TTL index is only a backstop; it must outlast this many
+# storage sweeps plus a margin so expired routes are archived before Mongo drops them
+ARCHIVE_TTL_SWEEPS = 2
+ARCHIVE_TTL_MARGIN_SECONDS = 3600
+
+
+def archive_ttl_grace_seconds(cleanup_interval_hours):
+    """Seconds the TTL index waits past expires_at when expired routes are archived"""
+    return int(ARCHIVE_TTL_SWEEPS * cleanup_interval_hours * 3600 + ARCHIVE_TTL_MARGIN_SECONDS)
+
 
 class StorageHandler:
-    def __init__(self, app=None):
+    def __init__(self, app=None, route_expiry_hours=24, compute_pool=None, archive=None,
+                 cleanup_interval_hours=1, match_cache=None):
         self.mongo = None
         self.app = app
+        self.route_expiry_hours = route_expiry_hours
+        self.cleanup_interval_hours = cleanup_interval_hours
+        self.replica = None
+        # Optional ComputePool running fingerprinting in worker processes
+        self.compute_pool = compute_pool
+        # Optional RouteArchive; without one expired routes are deleted
+        self.archive = archive
+        # Optional MatchCache, invalidated once a write is visible to matching
+        self.match_cache = match_cache
         if app:
             self.init_app(app)
     
@@ -29,22 +67,180 @@ class StorageHandler:
     def test_connection(self):
         """Test MongoDB connection"""
         try:
-            self.mongo.db.routes.count_documents({})
+            self.mongo.db.command('ping')
             return True, "Connected"
         except Exception as e:
             return False, str(e)
     
+    def start_replica(self, window_hours=None):
+        """Mirror recent routes locally so reads and matching skip the DB round trip"""
+        if self.replica is not None:
+            return self.replica
+        self.replica = RouteReplica(
+            self.mongo.db.routes,
+            ROUTE_PROJECTION,
+            window_hours=window_hours or self.route_expiry_hours,
+            match_cache=self.match_cache
+        )
+        self.replica.start()
+        return self.replica
+    
+    def stop_replica(self):
+        if self.replica is not None:
+            self.replica.stop()
+    
+    def _replica_for(self, hours_back):
+        """The local replica if it is in sync and covers hours_back, else None"""
+        replica = self.replica
+        if replica is not None and replica.covers(hours_back):
+            return replica
+        return None
+    
+    def _ensure_ttl_index(self, expire_after_seconds):
+        try:
+            self.mongo.db.routes.create_index('expires_at', expireAfterSeconds=expire_after_seconds)
+        except OperationFailure:
+            # The index exists with another expiry (archiving was toggled)
+            self.mongo.db.command('collMod', 'routes', index={
+                'keyPattern': {'expires_at': 1},
+                'expireAfterSeconds': expire_after_seconds
+            })
+    
+    def _ensure_unique_route_ids(self):
+        """One document per routeId, so an upsert can never land on another owner's route"""
+        routes = self.mongo.db.routes
+        options = {'unique': True, 'partialFilterExpression': {'routeId': {'$type': 'string'}}}
+        try:
+            try:
+                routes.create_index('routeId', **options)
+            except OperationFailure as e:
+                if e.code == DUPLICATE_KEY_ERROR:
+                    raise
+                # Replace the earlier non-unique index of the same name
+                routes.drop_index('routeId_1')
+                routes.create_index('routeId', **options)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY_ERROR:
+                raise
+            # Older data already holds duplicates; keep lookups indexed until they are cleaned up
+            duplicates = self._duplicate_route_ids()
+            logging.error(f"❌ routeId index left non-unique; duplicated ids: {', '.join(duplicates)}")
+            routes.create_index('routeId')
+    
+    def _duplicate_route_ids(self, limit=DUPLICATE_ID_LOG_LIMIT):
+        pipeline = [
+            {'$match': {'routeId': {'$type': 'string'}}},
+            {'$group': {'_id': '$routeId', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+            {'$limit': limit}
+        ]
+        return [group['_id'] for group in self.mongo.db.routes.aggregate(pipeline)]
+    
+    def ensure_indexes(self):
+        """Create the fingerprint indexes used by route matching"""
+        try:
+            routes = self.mongo.db.routes
+            # MongoDB removes each route once its expires_at passes
+            grace_seconds = archive_ttl_grace_seconds(self.cleanup_interval_hours) if self.archive else 0
+            self._ensure_ttl_index(grace_seconds)
+            self._ensure_unique_route_ids()
+            # Stats, the expiry sweep and recent-route reads all filter on timestamp
+            routes.create_index('timestamp')
+            # The replica polls for changed routes where change streams are unavailable
+            routes.create_index('synced_at')
+            routes.create_index('fingerprint.path_hash')
+            routes.create_index([
+                ('fingerprint.source_cell', 1),
+                ('fingerprint.destination_cell', 1)
+            ])
+            routes.create_index([
+                ('fingerprint.source_zone', 1),
+                ('fingerprint.destination_zone', 1)
+            ])
+            routes.create_index('fingerprint.route_zones')
+            routes.create_index([
+                ('fingerprint.time_buckets', 1),
+                ('fingerprint.source_cell', 1),
+                ('fingerprint.destination_cell', 1)
+            ])
+            routes.create_index([
+                ('fingerprint.time_buckets', 1),
+                ('fingerprint.source_zone', 1)
+            ])
+            return True, "Indexes ready"
+        except Exception as e:
+            logging.error(f"❌ Error creating route indexes: {e}")
+            return False, str(e)
+    
+    def backfill_fingerprints(self):
+        """Fingerprint routes stored before fingerprints, or one of their fields, existed
+        
+        Matching looks routes up by fingerprint fields, so without this
+        legacy documents would never match.
+        """
+        try:
+            routes = self.mongo.db.routes
+            stale = {'$or': [{f'fingerprint.{field}': {'$exists': False}} for field in FINGERPRINT_FIELDS]}
+            updated = 0
+            operations = []
+            for route in routes.find(stale, ROUTE_PROJECTION).batch_size(BACKFILL_BATCH_SIZE):
+                operations.append(UpdateOne(
+                    {'_id': route['_id']},
+                    # synced_at lets the local replica pick up the new fingerprint
+                    {'$set': {'fingerprint': compute_fingerprint(route), 'synced_at': datetime.utcnow()}}
+                ))
+                if len(operations) >= BACKFILL_BATCH_SIZE:
+                    updated += routes.bulk_write(operations, ordered=False).modified_count
+                    operations = []
+            if operations:
+                updated += routes.bulk_write(operations, ordered=False).modified_count
+            if updated:
+                logging.info(f"🧬 Backfilled fingerprints for {updated} routes")
+            return True, updated
+        except Exception as e:
+            logging.error(f"❌ Error backfilling route fingerprints: {e}")
+            return False, str(e)
+    
+    def _invalidate_matches(self, *routes):
+        """Drop cached results computed before a write to these routes landed"""
+        if self.match_cache is not None:
+            for route_data in routes:
+                if route_data:
+                    self.match_cache.invalidate_route(route_data)
+    
+    def _fingerprint(self, route_data):
+        if self.compute_pool:
+            return self.compute_pool.fingerprint_route(route_data)
+        return apply_fingerprint(route_data)
+    
+    def _fingerprint_many(self, routes):
+        if self.compute_pool:
+            self.compute_pool.fingerprint_routes(routes)
+        else:
+            for route_data in routes:
+                apply_fingerprint(route_data)
+    
     def save_route(self, route_data):
         """Save route to MongoDB with error handling"""
         try:
-            # Use upsert to avoid race conditions
-            filter_query = {
-                'userID': route_data['userID'],
-                'socketId': route_data['socketId']
-            }
+            if 'fingerprint' not in route_data:
+                self._fingerprint(route_data)
+            
+            # Use upsert to avoid race conditions; routeId is unique
+            if route_data.get('routeId'):
+                filter_query = {'routeId': route_data['routeId']}
+            else:
+                filter_query = {
+                    'userID': route_data['userID'],
+                    'socketId': route_data['socketId']
+                }
             
             update_data = {
-                '$set': route_data,
+                '$set': {
+                    **route_data,
+                    'expires_at': datetime.utcnow() + timedelta(hours=self.route_expiry_hours),
+                    'synced_at': datetime.utcnow()
+                },
                 '$setOnInsert': {'created_at': datetime.utcnow().isoformat()}
             }
             
@@ -53,6 +249,7 @@ class StorageHandler:
                 update_data,
                 upsert=True
             )
+            self._invalidate_matches(route_data)
             
             if result.upserted_id:
                 logging.info(f"✅ New route inserted for user: {route_data['userID']}")
@@ -65,9 +262,97 @@ class StorageHandler:
             logging.error(f"❌ Error saving to MongoDB: {e}")
             return False, str(e)
     
+    def save_routes(self, routes):
+        """Upsert a batch of routes keyed by routeId in a single bulk_write"""
+        try:
+            now = datetime.utcnow()
+            expires_at = now + timedelta(hours=self.route_expiry_hours)
+            unfingerprinted = [route_data for route_data in routes if 'fingerprint' not in route_data]
+            if unfingerprinted:
+                self._fingerprint_many(unfingerprinted)
+            operations = []
+            for route_data in routes:
+                operations.append(UpdateOne(
+                    {'routeId': route_data['routeId']},
+                    {
+                        '$set': {**route_data, 'expires_at': expires_at, 'synced_at': now},
+                        '$setOnInsert': {'created_at': now.isoformat()}
+                    },
+                    upsert=True
+                ))
+            if not operations:
+                return True, 0
+            
+            result = self.mongo.db.routes.bulk_write(operations, ordered=False)
+            self._invalidate_matches(*routes)
+            count = result.upserted_count + result.modified_count
+            logging.info(f"✅ Bulk saved {count} routes")
+            return True, count
+            
+        except Exception as e:
+            logging.error(f"❌ Error bulk saving to MongoDB: {e}")
+            return False, str(e)
+    
+    def update_route(self, route_id, fields, unset=(), append_path=()):
+        """Apply a partial update to a route, writing only the changed fields
+        
+        Every mutable field feeds the matching fingerprint, so the patched
+        route is fingerprinted first and written with it in one update. The
+        write only lands if synced_at (bumped by every write) is unchanged
+        since the read; otherwise it is retried on the newer document.
+        """
+        try:
+            routes = self.mongo.db.routes
+            for _ in range(UPDATE_RETRIES):
+                current = routes.find_one({'routeId': route_id}, {'expires_at': 0})
+                if current is None:
+                    return False, "Route not found"
+                fingerprint = self._fingerprint(apply_route_patch(current, fields, unset, append_path))
+                
+                now = datetime.utcnow()
+                update_data = {'$set': {
+                    **fields, 'fingerprint': fingerprint, 'updated_at': now.isoformat(), 'synced_at': now
+                }}
+                if unset:
+                    update_data['$unset'] = {field: '' for field in unset}
+                if append_path:
+                    update_data['$push'] = {'path': {'$each': list(append_path)}}
+                
+                route = routes.find_one_and_update(
+                    {'_id': current['_id'], 'synced_at': current.get('synced_at')},
+                    update_data,
+                    projection=ROUTE_PROJECTION,
+                    return_document=ReturnDocument.AFTER
+                )
+                if route is not None:
+                    route['_id'] = str(route['_id'])
+                    self._invalidate_matches(current, route)
+                    return True, route
+            return False, "Route was modified concurrently, try again"
+            
+        except Exception as e:
+            logging.error(f"❌ Error updating route {route_id}: {e}")
+            return False, str(e)
+    
+    def delete_route(self, route_id):
+        """Delete a route by its routeId"""
+        try:
+            route = self.mongo.db.routes.find_one_and_delete({'routeId': route_id}, {'fingerprint': 1})
+            if route is None:
+                return False, "Route not found"
+            self._invalidate_matches(route)
+            return True, "Route deleted"
+        except Exception as e:
+            logging.error(f"❌ Error deleting route {route_id}: {e}")
+            return False, str(e)
+    
     def get_routes(self, user_id=None, limit=100, hours_back=24):
         """Get routes from database with filtering"""
         try:
+            replica = self._replica_for(hours_back)
+            if replica is not None:
+                return True, replica.get_routes(user_id, limit, hours_back)
+            
             # Build query
             query = {}
             if user_id:
@@ -77,7 +362,7 @@ class StorageHandler:
             since_time = datetime.utcnow() - timedelta(hours=hours_back)
             query['timestamp'] = {'$gte': since_time.isoformat()}
             
-            routes_cursor = self.mongo.db.routes.find(query).sort('timestamp', -1).limit(limit)
+            routes_cursor = self.mongo.db.routes.find(query, ROUTE_PROJECTION).sort('timestamp', -1).limit(limit)
             routes_array = []
             
             for route in routes_cursor:
@@ -90,50 +375,126 @@ class StorageHandler:
             logging.error(f"❌ Database error in get_routes: {e}")
             return False, str(e)
     
-    def find_matching_routes(self, user_id, source, destination, path, hours_back=24):
-        """Find matching routes for a user"""
+    def find_matching_routes(self, user_id, source, destination, path, hours_back=24,
+                             limit=None, query=None, exclude=None, **match_options):
+        """Find the best matching routes for a user, keeping at most limit results
+        
+        Routes whose routeId is in exclude (scored elsewhere) are skipped unscored.
+        """
         try:
+            query = query or MatchQuery(user_id, source, destination, path, **match_options)
+            
+            replica = self._replica_for(hours_back)
+            if replica is not None:
+                return True, replica.find_matching(query, user_id, hours_back, limit, exclude=exclude)
+            
+            # Exact path and same-endpoint matches are indexed fingerprint lookups
+            clauses = []
+            if query.fingerprint['path_hash']:
+                clauses.append({'fingerprint.path_hash': query.fingerprint['path_hash']})
+            endpoints = endpoint_key(query.fingerprint)
+            if endpoints:
+                clauses.append({
+                    'fingerprint.source_cell': endpoints[0],
+                    'fingerprint.destination_cell': endpoints[1]
+                })
+            # Corridor candidates start and end in zones along the requester's path
+            zones = list(query.corridor_zones())
+            if zones:
+                clauses.append({
+                    'fingerprint.source_zone': {'$in': zones},
+                    'fingerprint.destination_zone': {'$in': zones}
+                })
+            # Routes passing near the requester's via points
+            via_zones = list(query.all_via_zones())
+            if via_zones:
+                clauses.append({'fingerprint.route_zones': {'$in': via_zones}})
+            if not clauses:
+                return True, []
+            
             since_time = datetime.utcnow() - timedelta(hours=hours_back)
-            routes_cursor = self.mongo.db.routes.find({
+            mongo_query = {
                 'timestamp': {'$gte': since_time.isoformat()},
-                'userID': {'$ne': user_id}  # Exclude user's own routes
-            })
+                'userID': {'$ne': user_id},  # Exclude user's own routes
+                '$or': clauses
+            }
+            # Only routes departing in the requester's time buckets (or anytime)
+            if query.time_buckets:
+                mongo_query['fingerprint.time_buckets'] = {'$in': query.time_buckets}
+            routes_cursor = self.mongo.db.routes.find(mongo_query, ROUTE_PROJECTION)
 
-            matching_routes = []
+            top_matches = TopKMatches(limit)
             for route in routes_cursor:
+                if exclude is not None and route.get('routeId') in exclude:
+                    continue
+                match = query.evaluate(route)
+                if not match:
+                    continue
                 route['_id'] = str(route['_id'])  # Convert ObjectId to string
-                
-                # Check if paths match (exact match)
-                if route.get('path') == path:
-                    route['match_type'] = 'exact_path'
-                    route['match_score'] = 100
-                    matching_routes.append(route)
-                # Check if source and destination are the same
-                elif (source and destination and 
-                      route.get('source') == source and 
-                      route.get('destination') == destination):
-                    route['match_type'] = 'same_endpoints'
-                    route['match_score'] = 80
-                    matching_routes.append(route)
+                route.update(match)
+                top_matches.push(route)
 
-            # Sort by match score (highest first)
-            matching_routes.sort(key=lambda x: x.get('match_score', 0), reverse=True)
-            return True, matching_routes
+            # Highest score first, newest first among equal scores
+            return True, top_matches.results()
 
         except Exception as e:
             logging.error(f"❌ Database error in find_matching_routes: {e}")
             return False, str(e)
     
+    def _remove_expired(self, expiry_time):
+        """Move routes older than expiry_time to the archive, or delete them without one"""
+        expired = {'timestamp': {'$lt': expiry_time.isoformat()}}
+        if not self.archive:
+            return self.mongo.db.routes.delete_many(expired).deleted_count
+        
+        from archive import ARCHIVE_BATCH_SIZE
+        # Streamed in batches; each batch is deleted only after its file is written
+        removed = 0
+        batch = []
+        cursor = self.mongo.db.routes.find(expired, {'synced_at': 0}).batch_size(ARCHIVE_BATCH_SIZE)
+        for route in cursor:
+            batch.append(route)
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                removed += self._archive_batch(batch)
+                batch = []
+        if batch:
+            removed += self._archive_batch(batch)
+        return removed
+    
+    def _archive_batch(self, routes):
+        self.archive.write(routes)
+        ids = [route['_id'] for route in routes]
+        deleted = self.mongo.db.routes.delete_many({'_id': {'$in': ids}}).deleted_count
+        logging.info(f"🗄️ Archived {len(routes)} expired routes")
+        return deleted
+    
+    def query_archive(self, start=None, end=None, filters=None, columns=None, limit=None):
+        """Scan archived routes without touching the live collection"""
+        if not self.archive:
+            return False, "Route archive not configured"
+        try:
+            kwargs = {'limit': limit} if limit is not None else {}
+            routes = self.archive.query(start, end, filters, columns, **kwargs)
+            return True, {
+                'routes': routes,
+                'count': len(routes),
+                'matched': self.archive.count(start, end, filters)
+            }
+        except ValueError:
+            # Bad filters or columns are reported to the client as such
+            raise
+        except Exception as e:
+            logging.error(f"❌ Error querying route archive: {e}")
+            return False, str(e)
+    
     def cleanup_expired_routes(self, hours_back=24):
         """Remove routes older than specified hours"""
         try:
             expiry_time = datetime.utcnow() - timedelta(hours=hours_back)
-            result = self.mongo.db.routes.delete_many({
-                'timestamp': {'$lt': expiry_time.isoformat()}
-            })
-            if result.deleted_count > 0:
-                logging.info(f"🗑️ Cleaned up {result.deleted_count} expired routes")
-            return True, result.deleted_count
+            removed = self._remove_expired(expiry_time)
+            if removed > 0:
+                logging.info(f"🗑️ Cleaned up {removed} expired routes")
+            return True, removed
         except Exception as e:
             logging.error(f"❌ Error cleaning expired routes: {e}")
             return False, str(e)
@@ -141,14 +502,12 @@ class StorageHandler:
     def clean_invalid_routes(self):
         """Remove routes without required fields"""
         try:
-            # Count total routes before cleanup
-            original_count = self.mongo.db.routes.count_documents({})
+            # Count total routes before cleanup (metadata count, no scan)
+            original_count = self.mongo.db.routes.estimated_document_count()
             
             # Remove routes older than 48 hours
             expiry_time = datetime.utcnow() - timedelta(hours=48)
-            expired_result = self.mongo.db.routes.delete_many({
-                'timestamp': {'$lt': expiry_time.isoformat()}
-            })
+            expired_removed = self._remove_expired(expiry_time)
             
             # Remove routes without required fields
             invalid_result = self.mongo.db.routes.delete_many({
@@ -160,13 +519,13 @@ class StorageHandler:
                 ]
             })
             
-            new_count = self.mongo.db.routes.count_documents({})
-            total_removed = expired_result.deleted_count + invalid_result.deleted_count
+            total_removed = expired_removed + invalid_result.deleted_count
+            new_count = max(original_count - total_removed, 0)
             
             return True, {
                 'original_count': original_count,
                 'new_count': new_count,
-                'expired_removed': expired_result.deleted_count,
+                'expired_removed': expired_removed,
                 'invalid_removed': invalid_result.deleted_count,
                 'total_removed': total_removed
             }
@@ -178,8 +537,47 @@ class StorageHandler:
     def get_route_count(self):
         """Get total number of routes"""
         try:
-            count = self.mongo.db.routes.count_documents({})
+            count = self.mongo.db.routes.estimated_document_count()
             return True, count
         except Exception as e:
             logging.error(f"❌ Error getting route count: {e}")
+            return False, str(e)
+    
+    def get_route_stats(self, hours_back=24, top_n=20):
+        """Aggregate recent route counts per user, hour and region in one pipeline"""
+        try:
+            since_time = datetime.utcnow() - timedelta(hours=hours_back)
+            top_groups = [{'$sort': {'count': -1}}, {'$limit': top_n}]
+            pipeline = [
+                {'$match': {'timestamp': {'$gte': since_time.isoformat()}}},
+                {'$facet': {
+                    'routes': [{'$count': 'count'}],
+                    'users': [{'$group': {'_id': '$userID'}}, {'$count': 'count'}],
+                    'per_user': [{'$group': {'_id': '$userID', 'count': {'$sum': 1}}}] + top_groups,
+                    # ISO timestamps share their first 13 characters within an hour
+                    'per_hour': [
+                        {'$group': {'_id': {'$substrCP': ['$timestamp', 0, 13]}, 'count': {'$sum': 1}}},
+                        {'$sort': {'_id': 1}}
+                    ],
+                    'per_region': [{'$group': {'_id': '$fingerprint.source_zone', 'count': {'$sum': 1}}}] + top_groups
+                }}
+            ]
+            facets = next(self.mongo.db.routes.aggregate(pipeline), {})
+            
+            def first_count(facet):
+                return (facets.get(facet) or [{}])[0].get('count', 0)
+            
+            def as_counts(groups):
+                return [{'key': group['_id'], 'count': group['count']} for group in groups]
+            
+            return True, {
+                'total_routes': self.mongo.db.routes.estimated_document_count(),
+                'recent_routes': first_count('routes'),
+                'recent_users': first_count('users'),
+                'per_user': as_counts(facets.get('per_user', [])),
+                'per_hour': as_counts(facets.get('per_hour', [])),
+                'per_region': as_counts(facets.get('per_region', []))
+            }
+        except Exception as e:
+            logging.error(f"❌ Error aggregating route stats: {e}")
             return False, str(e)
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Heap-based expiry scheduler that fires each callback when its deadline passes
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# Rebuild the heap once stale entries outnumber live ones by this factor
+COMPACT_RATIO = 2
+# Small heaps are left alone; stale entries there are popped soon enough
+COMPACT_MIN_ENTRIES = 1024
+
+
+class ExpiryScheduler:
+    def __init__(self, name='expiry-scheduler'):
+        self.name = name
+        self._heap = []
+        self._deadlines = {}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        with self._condition:
+            return len(self._deadlines)
+
+    def start(self):
+        """Start the worker thread"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker thread, dropping pending deadlines"""
+        with self._condition:
+            self._running = False
+            self._heap.clear()
+            self._deadlines.clear()
+            self._condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+
+    def schedule(self, key, deadline, callback):
+        """Run callback at wall-clock time deadline, replacing any entry for key"""
+        with self._condition:
+            token = next(self._counter)
+            self._deadlines[key] = token
+            heapq.heappush(self._heap, (deadline, token, key, callback))
+            # Wake the worker only if this is now the earliest deadline
+            if self._heap[0][1] == token:
+                self._condition.notify()
+            self._maybe_compact()
+
+    def schedule_in(self, key, delay_seconds, callback):
+        """Run callback delay_seconds from now"""
+        self.schedule(key, time.time() + delay_seconds, callback)
+
+    def cancel(self, key):
+        """Cancel the pending entry for key; stale heap entries are skipped lazily"""
+        with self._condition:
+            cancelled = self._deadlines.pop(key, None) is not None
+            self._maybe_compact()
+            return cancelled
+
+    def _maybe_compact(self):
+        """Drop stale entries once they dominate the heap (caller holds the lock)
+
+        Rescheduling a key leaves its old entry behind until it reaches the
+        top, so without this the heap grows with update rate times TTL.
+        """
+        if len(self._heap) < COMPACT_MIN_ENTRIES:
+            return
+        if len(self._heap) <= COMPACT_RATIO * (len(self._deadlines) + 1):
+            return
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[1]]
+        heapq.heapify(self._heap)
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                callback = None
+                while self._running and callback is None:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    deadline, token, key, entry_callback = self._heap[0]
+                    if self._deadlines.get(key) != token:
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = deadline - time.time()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    del self._deadlines[key]
+                    callback = entry_callback
+                if not self._running:
+                    return
+
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"❌ Expiry callback for {key} failed: {e}")
@@ -0,0 +1,85 @@
+"""
+Route fingerprints used to turn exact and endpoint matching into hash lookups
+"""
+import hashlib
+import math
+
+from geo import to_point, to_path
+from timewindow import parse_window, time_buckets
+
+# Decimal places kept when snapping coordinates (3 places is roughly 110 m)
+CELL_PRECISION = 3
+# Coarser grid used for corridor lookups (2 places is roughly 1.1 km)
+ZONE_PRECISION = 2
+# Every field compute_fingerprint sets; routes missing any are re-fingerprinted
+FINGERPRINT_FIELDS = (
+    'path_hash', 'source_cell', 'destination_cell', 'source_zone',
+    'destination_zone', 'route_zones', 'time_buckets'
+)
+
+
+def cell_key(point, precision=CELL_PRECISION):
+    """Snap a point to its grid cell and return the cell key"""
+    point = to_point(point)
+    if point is None:
+        return None
+    factor = 10 ** precision
+    # Round first so values like 12.97 * 1000 do not floor to the wrong cell
+    lat = math.floor(round(point[0] * factor, 6))
+    lng = math.floor(round(point[1] * factor, 6))
+    return f"{lat}:{lng}"
+
+
+def zone_key(point):
+    """Return the coarse corridor zone containing a point"""
+    return cell_key(point, ZONE_PRECISION)
+
+
+def zone_keys_in_bbox(min_lat, min_lng, max_lat, max_lng):
+    """Return every corridor zone overlapping a bounding box"""
+    factor = 10 ** ZONE_PRECISION
+    lat_range = range(math.floor(round(min_lat * factor, 6)), math.floor(round(max_lat * factor, 6)) + 1)
+    lng_range = range(math.floor(round(min_lng * factor, 6)), math.floor(round(max_lng * factor, 6)) + 1)
+    return {f"{lat}:{lng}" for lat in lat_range for lng in lng_range}
+
+
+def path_hash(path, precision=CELL_PRECISION):
+    """Hash a path after quantizing it and dropping repeated cells"""
+    cells = []
+    for point in to_path(path):
+        key = cell_key(point, precision)
+        if not cells or cells[-1] != key:
+            cells.append(key)
+    if not cells:
+        return None
+    return hashlib.sha1('|'.join(cells).encode('utf-8')).hexdigest()[:16]
+
+
+def route_zones(route_data):
+    """Zones the route passes through, from its via points and path vertices"""
+    points = to_path(route_data.get('via')) + to_path(route_data.get('path'))
+    return sorted({zone_key(point) for point in points})
+
+
+def compute_fingerprint(route_data):
+    """Compute the fingerprint fields for a route or match query"""
+    return {
+        'path_hash': path_hash(route_data.get('path')),
+        'source_cell': cell_key(route_data.get('source')),
+        'destination_cell': cell_key(route_data.get('destination')),
+        'source_zone': zone_key(route_data.get('source')),
+        'destination_zone': zone_key(route_data.get('destination')),
+        'route_zones': route_zones(route_data),
+        'time_buckets': time_buckets(parse_window(route_data.get('departure')))
+    }
+
+
+def is_current(fingerprint):
+    """True when a stored fingerprint has every field matching relies on"""
+    return bool(fingerprint) and all(field in fingerprint for field in FINGERPRINT_FIELDS)
+
+
+def apply_fingerprint(route_data):
+    """Attach a freshly computed fingerprint to a route"""
+    route_data['fingerprint'] = compute_fingerprint(route_data)
+    return route_data['fingerprint']
@@ -0,0 +1,107 @@
+"""
+Coordinate helpers shared by the route handlers
+"""
+import math
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def to_point(value):
+    """Normalize a [lat, lng] pair or {lat, lng} dict into a float tuple"""
+    try:
+        if isinstance(value, dict):
+            lat = value.get('lat')
+            lng = value.get('lng', value.get('lon'))
+        elif isinstance(value, (list, tuple)) and len(value) >= 2:
+            lat, lng = value[0], value[1]
+        else:
+            return None
+        return float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_path(values):
+    """Normalize a list of points, dropping entries that cannot be parsed"""
+    if not isinstance(values, (list, tuple)):
+        return []
+    points = []
+    for value in values:
+        point = to_point(value)
+        if point is not None:
+            points.append(point)
+    return points
+
+
+def haversine_m(a, b):
+    """Great-circle distance in metres between two (lat, lng) points"""
+    lat1, lng1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lng2 = math.radians(b[0]), math.radians(b[1])
+    dlat = lat2 - lat1
+    dlng = lng2 - lng1
+    h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(h)))
+
+
+def local_xy(point, origin_lat):
+    """Project a point to metres on a plane tangent at origin_lat"""
+    return (
+        math.radians(point[1]) * EARTH_RADIUS_M * math.cos(math.radians(origin_lat)),
+        math.radians(point[0]) * EARTH_RADIUS_M
+    )
+
+
+def project_onto_segment(point, a, b):
+    """Project a point onto segment a-b
+
+    Returns (projected_point, offset_m, along_m) where offset_m is the distance
+    from the point to the segment and along_m the distance from a to the
+    projection.
+    """
+    origin_lat = point[0]
+    px, py = local_xy(point, origin_lat)
+    ax, ay = local_xy(a, origin_lat)
+    bx, by = local_xy(b, origin_lat)
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length_sq))
+    qx, qy = ax + t * dx, ay + t * dy
+    projected = (a[0] + t * (b[0] - a[0]), a[1] + t * (b[1] - a[1]))
+    return projected, math.hypot(px - qx, py - qy), t * math.sqrt(length_sq)
+
+
+def buffer_degrees(lat, buffer_m):
+    """Convert a buffer in metres to (lat, lng) degree deltas at latitude lat"""
+    dlat = math.degrees(buffer_m / EARTH_RADIUS_M)
+    dlng = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return dlat, dlng
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat, lng, precision=5):
+    """Encode a point as a geohash string of the given length"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, longitude first
+        bounds, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        mid = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
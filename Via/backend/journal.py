@@ -0,0 +1,134 @@
+"""
+Append-only journal of in-memory route state with compacted snapshots
+"""
+import json
+import logging
+import os
+import threading
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; fall back to JSON lines
+    msgpack = None
+
+# Compact the log into a snapshot after this many appended records
+COMPACT_EVERY_RECORDS = 10000
+
+
+class RouteJournal:
+    def __init__(self, state_dir, compact_every=COMPACT_EVERY_RECORDS):
+        os.makedirs(state_dir, exist_ok=True)
+        self.codec = 'msgpack' if msgpack else 'jsonl'
+        self.log_path = os.path.join(state_dir, f'routes.log.{self.codec}')
+        self.snapshot_path = os.path.join(state_dir, f'routes.snapshot.{self.codec}')
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._log = None
+        self._records = 0
+        self._corrupt = False
+
+    def _encode(self, record):
+        if msgpack:
+            return msgpack.packb(record, use_bin_type=True)
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _read_records(self, path):
+        """Yield records from a file, stopping at a torn trailing write"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            if msgpack:
+                unpacker = msgpack.Unpacker(f, raw=False)
+                try:
+                    for record in unpacker:
+                        yield record
+                except Exception as e:
+                    self._corrupt = True
+                    logging.warning(f"⚠️ Stopped reading {path} at a corrupt record: {e}")
+                return
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    self._corrupt = True
+                    logging.warning(f"⚠️ Stopped reading {path} at a corrupt record: {e}")
+                    return
+
+    def load(self):
+        """Rebuild the route map from the latest snapshot plus the log"""
+        routes = {}
+        for record in self._read_records(self.snapshot_path):
+            routes = record.get('routes', {})
+
+        replayed = 0
+        for record in self._read_records(self.log_path):
+            op = record.get('op')
+            if op == 'put':
+                routes[record['key']] = record['route']
+            elif op == 'del':
+                routes.pop(record['key'], None)
+            elif op == 'clear':
+                routes.clear()
+            replayed += 1
+        self._records = replayed
+
+        # Appending after a torn record would hide every later write, so
+        # rewrite the recovered state before the log is reopened
+        if self._corrupt:
+            self._corrupt = False
+            self.snapshot(lambda: routes)
+        return routes
+
+    def open(self):
+        """Open the log for appending"""
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_path, 'ab')
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def _append(self, record):
+        with self._lock:
+            if self._log is None:
+                return
+            self._log.write(self._encode(record))
+            self._log.flush()
+            self._records += 1
+
+    def put(self, key, route_data):
+        self._append({'op': 'put', 'key': key, 'route': route_data})
+
+    def delete(self, key):
+        self._append({'op': 'del', 'key': key})
+
+    def clear(self):
+        self._append({'op': 'clear'})
+
+    def needs_compaction(self):
+        return self._records >= self.compact_every
+
+    def snapshot(self, get_routes):
+        """Write a snapshot of get_routes() and truncate the log
+
+        Writers update the in-memory state before appending, so any change
+        racing with the snapshot ends up in the snapshot, the new log, or
+        both; replaying it twice is harmless.
+        """
+        with self._lock:
+            routes = get_routes()
+            tmp_path = self.snapshot_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self._encode({'routes': routes}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            if self._log is not None:
+                self._log.close()
+            self._log = open(self.log_path, 'wb')
+            self._records = 0
+        return len(routes)
@@ -6,15 +6,21 @@ import os
 import logging
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory
 from flask_socketio import SocketIO
 from flask_cors import CORS
 
 # Import our custom handlers
+from config_file import get_config
 from dbox import StorageHandler
 from broadcast import BroadcastHandler
 from trek import RouteHandler
+from expiry import ExpiryScheduler
+from stats import StatsService
+from match_cache import MatchCache
+from static_assets import StaticAssetCache
 
 class RouteServer:
     def __init__(self, config=None):
@@ -24,7 +30,20 @@ class RouteServer:
         self.storage_handler = None
         self.broadcast_handler = None
         self.route_handler = None
-        self.cleanup_thread = None
+        self.expiry_scheduler = None
+        self.maintenance = None
+        self.journal = None
+        self.stats_service = None
+        self.match_cache = None
+        self.shard_coordinator = None
+        self.compute_pool = None
+        self.recorder = None
+        self.memory_inspector = None
+        self.static_assets = None
+        self.db_connected = None
+        self.ready = threading.Event()
+        self._warmup_thread = None
+        self._started_at = time.perf_counter()
         self._setup_logging()
         self._create_app()
         self._initialize_components()
@@ -64,20 +83,90 @@ class RouteServer:
     
     def _initialize_components(self):
         """Initialize all handler components"""
+        route_expiry_hours = self.config.get('route_expiry_hours', 24)
+        
+        # Evicts routes and clients exactly when their TTL passes
+        self.expiry_scheduler = ExpiryScheduler()
+        
+        # Durable route state survives restarts when a state dir is configured
+        state_dir = self.config.get('state_dir')
+        if state_dir:
+            # Imported on demand so nodes without a state dir never load the codec
+            from journal import RouteJournal
+            self.journal = RouteJournal(state_dir)
+        
+        # Shared match-result cache, invalidated by BroadcastHandler route changes
+        self.match_cache = MatchCache(
+            max_entries=self.config.get('match_cache_size', 1024),
+            ttl_seconds=self.config.get('match_cache_ttl_seconds', 30)
+        )
+        
+        # Opt-in capture of inbound traffic for the replay driver
+        capture_path = self.config.get('traffic_capture_path')
+        if capture_path:
+            from traffic import TrafficRecorder
+            self.recorder = TrafficRecorder(capture_path)
+        
+        # Matching spread over worker processes by region when configured
+        match_shards = self.config.get('match_shards', 0)
+        if match_shards:
+            from sharding import ShardCoordinator
+            self.shard_coordinator = ShardCoordinator(match_shards)
+            self.shard_coordinator.start()
+        
+        # Fingerprinting runs inline unless worker processes are configured
+        compute_workers = self.config.get('compute_workers', 0)
+        if compute_workers:
+            from compute import ComputePool
+            self.compute_pool = ComputePool(compute_workers)
+            self.compute_pool.start()
+        
+        # Expired routes go to columnar files when an archive directory is set
+        archive = None
+        archive_dir = self.config.get('archive_dir')
+        if archive_dir:
+            from archive import RouteArchive
+            archive = RouteArchive.create(archive_dir)
+        
         # Initialize storage handler
-        self.storage_handler = StorageHandler(self.app)
+        self.storage_handler = StorageHandler(
+            self.app,
+            route_expiry_hours=route_expiry_hours,
+            compute_pool=self.compute_pool,
+            archive=archive,
+            cleanup_interval_hours=self.config.get('cleanup_interval_hours', 1),
+            match_cache=self.match_cache
+        )
         
         # Initialize broadcast handler
         self.broadcast_handler = BroadcastHandler(
             socketio=self.socketio,
-            storage_handler=self.storage_handler
+            storage_handler=self.storage_handler,
+            expiry_scheduler=self.expiry_scheduler,
+            route_expiry_hours=route_expiry_hours,
+            client_timeout_hours=self.config.get('client_timeout_hours', 24),
+            journal=self.journal,
+            match_cache=self.match_cache,
+            shard_coordinator=self.shard_coordinator,
+            recorder=self.recorder,
+            compute_pool=self.compute_pool
         )
+        self._restore_route_state()
         self.broadcast_handler.init_socketio(self.socketio)
         
+        # Cached stats shared by /health, /routes/stats and get_server_info
+        self.stats_service = StatsService(self.storage_handler, self.broadcast_handler)
+        
         # Initialize route handler
         self.route_handler = RouteHandler(
             storage_handler=self.storage_handler,
-            broadcast_handler=self.broadcast_handler
+            broadcast_handler=self.broadcast_handler,
+            stats_service=self.stats_service,
+            match_cache=self.match_cache,
+            recorder=self.recorder,
+            memory_inspector=self._create_memory_inspector(),
+            admin_key=self.config.get('admin_secret_key', 'admin-secret-key'),
+            compute_pool=self.compute_pool
         )
         
         # Register route blueprint
@@ -86,29 +175,95 @@ class RouteServer:
         # Register static file routes
         self._register_static_routes()
         
+        # Liveness/readiness probes for the orchestrator
+        self._register_probe_routes()
+        
         self.logger.info("3.All components initialized successfully")
     
+    def _create_memory_inspector(self):
+        """Register the long-lived structures whose growth we want to see"""
+        from memory import MemoryInspector
+        inspector = MemoryInspector()
+        broadcast = self.broadcast_handler
+        inspector.register('connected_clients', lambda: broadcast.connected_clients)
+        inspector.register('active_routes', lambda: broadcast.active_routes)
+        inspector.register('route_index', lambda: broadcast.route_index)
+        inspector.register('density_tiles', lambda: broadcast.density_tiles)
+        inspector.register('subscriptions', lambda: broadcast.subscriptions)
+        inspector.register('match_cache', lambda: self.match_cache)
+        inspector.register('stats_cache', lambda: self.stats_service._cache)
+        inspector.register('static_assets', lambda: self.static_assets and self.static_assets.assets)
+        inspector.register('replica_routes', lambda: self.storage_handler.replica.routes
+                           if self.storage_handler.replica is not None else None)
+        self.memory_inspector = inspector
+        return inspector
+    
+    def _restore_route_state(self):
+        """Replay the route journal so a restarted node starts warm"""
+        if not self.journal:
+            return
+        try:
+            started = time.perf_counter()
+            routes = self.journal.load()
+            restored = self.broadcast_handler.restore_routes(routes)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.logger.info(f"💾 Restored {restored} active routes from journal in {elapsed_ms:.1f} ms")
+        except Exception as e:
+            self.logger.error(f"❌ Failed to restore route state: {e}")
+        self.journal.open()
+    
     def _register_static_routes(self):
         """Register static file serving routes"""
+        self.static_assets = StaticAssetCache(
+            self.app.static_folder,
+            max_age=self.config.get('static_max_age', 86400)
+        )
+        
         @self.app.route('/')
         def serve_html():
-            return send_from_directory(self.app.static_folder, 'consolidated-html.html')
+            return serve_file('')
         
         @self.app.route('/<path:filename>')
         def serve_file(filename):
+            response = self.static_assets.response(filename, request)
+            if response is not None:
+                return response
+            # Assets too large to keep in memory are streamed from disk
             full_path = os.path.join(self.app.static_folder, filename)
-            if os.path.exists(full_path):
+            if filename and os.path.isfile(full_path):
                 return send_from_directory(self.app.static_folder, filename)
             return 'File not found', 404
     
+    def _register_probe_routes(self):
+        """Register /livez and /readyz; neither touches MongoDB"""
+        
+        @self.app.route('/livez')
+        def livez():
+            return jsonify({'status': 'alive'}), 200
+        
+        @self.app.route('/readyz')
+        def readyz():
+            if not self.ready.is_set():
+                return jsonify({'status': 'starting', 'database': 'checking'}), 503
+            status = {
+                'status': 'ready',
+                'database': 'connected' if self.db_connected else 'fallback'
+            }
+            if self.storage_handler.replica is not None:
+                status['replica'] = self.storage_handler.replica.status()
+            return jsonify(status), 200
+    
     def _test_database_connection(self):
         """Test database connection and log results"""
         try:
             connected, message = self.storage_handler.test_connection()
             if connected:
                 self.logger.info("4.MongoDB connection successful")
-                # Initial cleanup
-                self.storage_handler.cleanup_expired_routes()
+                self.storage_handler.ensure_indexes()
+                # Before the replica loads, so legacy routes arrive matchable
+                self.storage_handler.backfill_fingerprints()
+                if self.config.get('local_replica', True):
+                    self.storage_handler.start_replica()
                 return True
             else:
                 self.logger.warning(f"⚠️ MongoDB connection failed: {message}")
@@ -118,50 +273,98 @@ class RouteServer:
             self.logger.error(f"❌ Database connection test failed: {e}")
             return False
     
-    def _start_cleanup_thread(self):
-        """Start background thread for periodic cleanup"""
-        def cleanup_worker():
-            while True:
-                try:
-                    time.sleep(3600)  # Run every hour
-                    self.logger.info("🧹 Running periodic cleanup...")
-                    
-                    # Clean expired routes from storage
-                    if self.storage_handler:
-                        success, count = self.storage_handler.cleanup_expired_routes()
-                        if success and count > 0:
-                            self.logger.info(f"🗑️ Cleaned {count} expired routes from storage")
-                    
-                    # Clean inactive clients from broadcast handler
-                    if self.broadcast_handler:
-                        count = self.broadcast_handler.cleanup_inactive_clients()
-                        if count > 0:
-                            self.logger.info(f"🗑️ Cleaned {count} inactive clients")
-                    
-                except Exception as e:
-                    self.logger.error(f"❌ Periodic cleanup error: {e}")
-        
-        self.cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-        self.cleanup_thread.start()
-        self.logger.info("🧹 Cleanup thread started")
+    def _warm_up(self):
+        """Checks that used to block startup; run on a background thread"""
+        try:
+            self.db_connected = self._test_database_connection()
+        finally:
+            # In fallback mode the node still serves from memory, so it is ready either way
+            self.ready.set()
+            elapsed_ms = (time.perf_counter() - self._started_at) * 1000
+            self.logger.info(f"✅ Ready in {elapsed_ms:.0f} ms "
+                             f"(database: {'connected' if self.db_connected else 'fallback'})")
+        
+        if self.db_connected:
+            # Initial cleanup; the TTL index covers new routes, so this is housekeeping only
+            self.storage_handler.cleanup_expired_routes(self.config.get('route_expiry_hours', 24))
+        
+        self.static_assets.compress_all()
+    
+    def start_background_tasks(self):
+        """Start the expiry scheduler and the background warmup (idempotent)"""
+        if self._warmup_thread:
+            return
+        self._start_expiry_scheduler()
+        self._warmup_thread = threading.Thread(target=self._warm_up, name='server-warmup', daemon=True)
+        self._warmup_thread.start()
+    
+    def _schedule_periodic(self, key, interval_seconds, task):
+        """Run task every interval_seconds on the maintenance thread
+        
+        The scheduler thread only hands the task over, so a slow Mongo sweep
+        never delays route and client evictions. The next run is scheduled
+        when this one finishes, so runs of one task never overlap.
+        """
+        def run():
+            try:
+                task()
+            except Exception as e:
+                self.logger.error(f"❌ Periodic task {key} failed: {e}")
+            finally:
+                if self.maintenance:
+                    self.expiry_scheduler.schedule_in(key, interval_seconds, submit)
+        
+        def submit():
+            maintenance = self.maintenance
+            if maintenance:
+                maintenance.submit(run)
+        
+        self.expiry_scheduler.schedule_in(key, interval_seconds, submit)
+    
+    def _start_expiry_scheduler(self):
+        """Start the expiry scheduler and the periodic storage sweep"""
+        interval_seconds = self.config.get('cleanup_interval_hours', 1) * 3600
+        route_expiry_hours = self.config.get('route_expiry_hours', 24)
+        
+        self.expiry_scheduler.start()
+        self.maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix='maintenance')
+        
+        # The TTL index expires new routes; this sweep catches documents
+        # written before expires_at existed, and with an archive it is what
+        # moves expired routes to disk before the TTL backstop fires
+        def sweep_storage():
+            if self.storage_handler:
+                success, count = self.storage_handler.cleanup_expired_routes(route_expiry_hours)
+                if success and count > 0:
+                    self.logger.info(f"🗑️ Cleaned {count} expired routes from storage")
+        
+        self._schedule_periodic('storage-sweep', interval_seconds, sweep_storage)
+        
+        if self.journal:
+            self._schedule_periodic('state-snapshot', self.config.get('snapshot_interval_seconds', 300),
+                                    self.broadcast_handler.snapshot_state)
+        
+        # Periodic memory samples feed the growth trend on /admin/memory; off by default
+        memory_sample_interval = self.config.get('memory_sample_interval_seconds', 0)
+        if memory_sample_interval:
+            self._schedule_periodic('memory-sample', memory_sample_interval,
+                                    self.memory_inspector.sample)
+        self.logger.info("🧹 Expiry scheduler started")
     
     def run(self, host='0.0.0.0', port=3000, debug=False):
         """Run the server"""
         try:
             self.logger.info(f"🚀 Starting Route Sharing Server on {host}:{port}")
             
-            # Test database connection
-            db_connected = self._test_database_connection()
-            
-            # Start cleanup thread
-            self._start_cleanup_thread()
+            # Database checks run in the background; /readyz reports when they finish
+            self.start_background_tasks()
             
             # Log server status
             self.logger.info("=" * 50)
             self.logger.info("🌟 Route Sharing Server Status:")
             self.logger.info(f"   📍 Host: {host}")
             self.logger.info(f"   🔌 Port: {port}")
-            self.logger.info(f"   🗄️ Database: {'Connected' if db_connected else 'Fallback Mode'}")
+            self.logger.info(f"   🗄️ Database: {'Connected' if self.db_connected else 'Checking in background'}")
             self.logger.info(f"   🐛 Debug: {debug}")
             self.logger.info("=" * 50)
             
@@ -184,9 +387,32 @@ class RouteServer:
         """Stop the server gracefully"""
         self.logger.info("🛑 Shutting down server...")
         
-        # Stop cleanup thread
-        if self.cleanup_thread and self.cleanup_thread.is_alive():
-            self.logger.info("🧹 Stopping cleanup thread...")
+        # Stop expiry scheduler
+        if self.expiry_scheduler is not None:
+            self.logger.info("🧹 Stopping expiry scheduler...")
+            self.expiry_scheduler.stop()
+        
+        # Let a running sweep or snapshot finish; queued runs are dropped
+        maintenance, self.maintenance = self.maintenance, None
+        if maintenance:
+            maintenance.shutdown(wait=True, cancel_futures=True)
+        
+        if self.storage_handler:
+            self.storage_handler.stop_replica()
+        
+        # Persist a compacted snapshot for the next start
+        if self.journal:
+            self.broadcast_handler.snapshot_state()
+            self.journal.close()
+        
+        if self.shard_coordinator:
+            self.shard_coordinator.stop()
+        
+        if self.compute_pool:
+            self.compute_pool.stop()
+        
+        if self.recorder:
+            self.recorder.close()
         
         # Disconnect all clients
         if self.broadcast_handler:
@@ -207,8 +433,8 @@ class RouteServer:
         }
         
         # Check database connection
-        if self.storage_handler:
-            connected, _ = self.storage_handler.test_connection()
+        if self.stats_service:
+            connected, _ = self.stats_service.database_status()
             info['database_connected'] = connected
         
         # Get broadcast info
@@ -226,12 +452,28 @@ def create_server(config=None):
 
 def load_config_from_env():
     """Load configuration from environment variables"""
+    settings = get_config()
     config = {
         'mongo_uri': os.environ.get('MONGO_URI', 'mongodb://localhost:27017/Via'),
         'static_folder': os.environ.get('STATIC_FOLDER'),
         'host': os.environ.get('HOST', '0.0.0.0'),
         'port': int(os.environ.get('PORT', 3000)),
-        'debug': os.environ.get('DEBUG', 'false').lower() == 'true'
+        'debug': os.environ.get('DEBUG', 'false').lower() == 'true',
+        'route_expiry_hours': settings.ROUTE_EXPIRY_HOURS,
+        'cleanup_interval_hours': settings.CLEANUP_INTERVAL_HOURS,
+        'client_timeout_hours': settings.CLIENT_TIMEOUT_HOURS,
+        'state_dir': os.environ.get('STATE_DIR'),
+        'snapshot_interval_seconds': float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 300)),
+        'match_cache_size': int(os.environ.get('MATCH_CACHE_SIZE', 1024)),
+        'match_cache_ttl_seconds': float(os.environ.get('MATCH_CACHE_TTL_SECONDS', 30)),
+        'static_max_age': int(os.environ.get('STATIC_MAX_AGE', 86400)),
+        'local_replica': os.environ.get('LOCAL_REPLICA', 'true').lower() == 'true',
+        'match_shards': int(os.environ.get('MATCH_SHARDS', 0)),
+        'compute_workers': int(os.environ.get('COMPUTE_WORKERS', 0)),
+        'archive_dir': os.environ.get('ARCHIVE_DIR'),
+        'traffic_capture_path': os.environ.get('TRAFFIC_CAPTURE_PATH'),
+        'memory_sample_interval_seconds': float(os.environ.get('MEMORY_SAMPLE_INTERVAL_SECONDS', 0)),
+        'admin_secret_key': os.environ.get('ADMIN_SECRET_KEY', 'admin-secret-key')
     }
     return config
 
@@ -0,0 +1,122 @@
+"""
+Bounded LRU/TTL cache of match results with zone-targeted invalidation
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MATCH_CACHE_SIZE = 1024
+MATCH_CACHE_TTL_SECONDS = 30
+
+
+def route_zones_touched(route_data):
+    """Zones whose cached match results a change to this route could affect"""
+    fingerprint = route_data.get('fingerprint') or {}
+    zones = {fingerprint.get('source_zone'), fingerprint.get('destination_zone')}
+    zones.update(fingerprint.get('route_zones') or ())
+    zones.discard(None)
+    return zones
+
+
+class MatchCache:
+    def __init__(self, max_entries=MATCH_CACHE_SIZE, ttl_seconds=MATCH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_zone = {}
+        # When each zone was last invalidated, so results computed before
+        # a concurrent write are not cached after it
+        self._invalidated_at = {}
+        self._cleared_at = float('-inf')
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return cached matches for key, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    @staticmethod
+    def generation():
+        """Stamp to take before computing a result and pass to put()"""
+        return time.monotonic()
+
+    def put(self, key, matches, zones, generation=None):
+        """Cache matches for key, tagged with the zones that invalidate them
+
+        With a generation, the result is dropped if any of its zones was
+        invalidated after that stamp; it may be missing the changed route.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if generation is not None and self._stale(generation, zones, now):
+                return False
+            self._drop(key)
+            self._entries[key] = (time.monotonic(), matches, frozenset(zones))
+            for zone in zones:
+                self._keys_by_zone.setdefault(zone, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+        return True
+
+    def _stale(self, generation, zones, now):
+        # Invalidation stamps older than the TTL are pruned, so older
+        # computations cannot be checked and are not cached
+        if generation <= self._cleared_at or generation < now - self.ttl_seconds:
+            return True
+        return any(self._invalidated_at.get(zone, float('-inf')) >= generation for zone in zones)
+
+    def invalidate_route(self, route_data):
+        """Drop every cached result a change to route_data could affect"""
+        zones = route_zones_touched(route_data)
+        now = time.monotonic()
+        with self._lock:
+            keys = set()
+            for zone in zones:
+                self._invalidated_at[zone] = now
+                keys |= self._keys_by_zone.get(zone, set())
+            if len(self._invalidated_at) > self.max_entries * 4:
+                self._prune_invalidations(now)
+            for key in keys:
+                self._drop(key)
+        return len(keys)
+
+    def clear(self):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_zone.clear()
+            # Every in-flight result predates the clear
+            self._invalidated_at.clear()
+            self._cleared_at = now
+
+    def _prune_invalidations(self, now):
+        # A computation running longer than the TTL is not cached anyway
+        cutoff = now - self.ttl_seconds
+        self._invalidated_at = {
+            zone: stamp for zone, stamp in self._invalidated_at.items() if stamp >= cutoff
+        }
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for zone in entry[2]:
+            keys = self._keys_by_zone.get(zone)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_zone[zone]
@@ -0,0 +1,280 @@
+"""
+Match classification shared by the MongoDB and in-memory matchers
+"""
+import heapq
+import itertools
+import math
+
+from corridor import DEFAULT_BUFFER_M, MAX_BUFFER_M, PathProjector
+from fingerprint import cell_key, compute_fingerprint, zone_key, zone_keys_in_bbox
+from geo import buffer_degrees, haversine_m, to_path, to_point
+from timewindow import ANY_TIME_BUCKET, parse_window, time_buckets, windows_overlap
+
+EXACT_PATH_SCORE = 100
+SAME_ENDPOINTS_SCORE = 80
+SHARED_VIA_SCORE = 40
+# Bonus per requester via point the candidate passes within VIA_RADIUS_M of
+VIA_POINT_BONUS = 5
+VIA_RADIUS_M = 300
+
+DEFAULT_MATCH_LIMIT = 50
+MAX_MATCH_LIMIT = 1000
+# Cached results are shared by everyone asking the same question, so they are
+# computed for no requester and keep spare slots for dropping the asker's own routes
+SHARED_RESULT_MARGIN = 5
+
+
+def endpoint_key(fingerprint):
+    """Return the (source_cell, destination_cell) key or None if incomplete"""
+    if not fingerprint:
+        return None
+    source_cell = fingerprint.get('source_cell')
+    destination_cell = fingerprint.get('destination_cell')
+    if not source_cell or not destination_cell:
+        return None
+    return source_cell, destination_cell
+
+
+def classify_match(query_fp, route_fp):
+    """Classify a candidate route against a query fingerprint"""
+    if not route_fp:
+        return None
+    if query_fp.get('path_hash') and route_fp.get('path_hash') == query_fp['path_hash']:
+        return 'exact_path', EXACT_PATH_SCORE
+    query_endpoints = endpoint_key(query_fp)
+    if query_endpoints and endpoint_key(route_fp) == query_endpoints:
+        return 'same_endpoints', SAME_ENDPOINTS_SCORE
+    return None
+
+
+def endpoint_distance_m(query_points, route_data):
+    """Largest distance in metres between matching endpoints of query and route"""
+    distances = []
+    for field in ('source', 'destination'):
+        query_point = query_points.get(field)
+        route_point = to_point(route_data.get(field))
+        if query_point and route_point:
+            distances.append(haversine_m(query_point, route_point))
+    return max(distances) if distances else 0.0
+
+
+def results_for_requester(shared, user_id, limit, shared_limit):
+    """The requester's matches from a shared result, or None if it cannot supply them
+
+    A shared result cut at shared_limit that loses so many of the requester's
+    own routes that fewer than limit remain may be missing lower-ranked matches.
+    """
+    results = [route for route in shared if route.get('userID') != user_id]
+    if len(results) < limit and len(shared) >= shared_limit:
+        return None
+    return results[:limit]
+
+
+def parse_match_options(data):
+    """Validate match request options, returning (limit, MatchQuery kwargs)
+
+    Raises ValueError with a client-facing message on invalid input.
+    """
+    # 'exact' matches identical paths/endpoints, 'corridor' also finds
+    # routes that start and end along the requester's path
+    mode = data.get('mode', 'exact')
+    if mode not in ('exact', 'corridor'):
+        raise ValueError('Invalid match mode')
+
+    # Bound the response size and optionally drop far-away matches
+    try:
+        limit = int(data.get('limit', data.get('k', DEFAULT_MATCH_LIMIT)))
+        max_distance = data.get('max_distance')
+        max_distance_m = float(max_distance) if max_distance is not None else None
+        buffer_m = float(data.get('buffer', DEFAULT_BUFFER_M))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit, max_distance or buffer')
+    # NaN passes every comparison below and infinity breaks zone lookups
+    if not math.isfinite(buffer_m) or (max_distance_m is not None and not math.isfinite(max_distance_m)):
+        raise ValueError('Invalid limit, max_distance or buffer')
+    if limit < 1 or buffer_m <= 0 or (max_distance_m is not None and max_distance_m < 0):
+        raise ValueError('Invalid limit, max_distance or buffer')
+
+    return min(limit, MAX_MATCH_LIMIT), {
+        'mode': mode,
+        'via': data.get('via') or [],
+        'departure': data.get('departure'),
+        'buffer_m': min(buffer_m, MAX_BUFFER_M),
+        'max_distance_m': max_distance_m
+    }
+
+
+class MatchQuery:
+    """Normalized match request evaluated against candidate routes
+
+    A user_id of None matches every user's routes, for results shared between requesters.
+    """
+
+    def __init__(self, user_id, source, destination, path, mode='exact',
+                 buffer_m=DEFAULT_BUFFER_M, max_distance_m=None, via=None, departure=None,
+                 fingerprint=None):
+        self.user_id = user_id
+        self.mode = mode
+        self.max_distance_m = max_distance_m
+        # Callers may pass a fingerprint already computed off-thread
+        self.fingerprint = fingerprint or compute_fingerprint({
+            'source': source,
+            'destination': destination,
+            'path': path
+        })
+        self.points = {'source': to_point(source), 'destination': to_point(destination)}
+        self.path = path
+        self.buffer_m = buffer_m
+        self._projector = None
+
+        # Without a departure window the query is not time-filtered
+        self.window = parse_window(departure)
+        self.time_buckets = None
+        if self.window:
+            self.time_buckets = time_buckets(self.window) + [ANY_TIME_BUCKET]
+
+        # Zones within VIA_RADIUS_M of each requester via point
+        self.via = to_path(via)
+        self.via_zones = []
+        for lat, lng in self.via:
+            dlat, dlng = buffer_degrees(lat, VIA_RADIUS_M)
+            self.via_zones.append(zone_keys_in_bbox(lat - dlat, lng - dlng, lat + dlat, lng + dlng))
+
+    def __getstate__(self):
+        # Sent to matching shards; the projector is rebuilt there on first use
+        state = dict(self.__dict__)
+        state['_projector'] = None
+        return state
+
+    @property
+    def projector(self):
+        """Segment index over the requester's path, built on first use in corridor mode"""
+        if self.mode != 'corridor':
+            return None
+        if self._projector is None:
+            self._projector = PathProjector(self.path, self.buffer_m)
+        return self._projector
+
+    def cache_key(self, limit=None):
+        """Normalized key identifying queries that must return the same matches"""
+        return (
+            self.mode, limit,
+            self.fingerprint['path_hash'],
+            self.fingerprint['source_cell'],
+            self.fingerprint['destination_cell'],
+            round(self.buffer_m) if self.mode == 'corridor' else None,
+            self.max_distance_m,
+            tuple(cell_key(point) for point in self.via),
+            self.window
+        )
+
+    def invalidation_zones(self):
+        """Zones where a route change could alter this query's result"""
+        zones = {self.fingerprint['source_zone'], self.fingerprint['destination_zone']}
+        zones |= self.corridor_zones()
+        zones |= self.all_via_zones()
+        zones.discard(None)
+        return zones
+
+    def corridor_zones(self):
+        """Zones a corridor candidate's endpoints must fall in"""
+        return self.projector.zones() if self.projector else set()
+
+    def all_via_zones(self):
+        """Zones a candidate must pass through to be near any via point"""
+        return set().union(*self.via_zones) if self.via_zones else set()
+
+    def via_matches(self, route_data):
+        """Count the requester via points the candidate passes near"""
+        if not self.via:
+            return 0
+        candidate_zones = set((route_data.get('fingerprint') or {}).get('route_zones') or ())
+        points = None
+        count = 0
+        for via_point, zones in zip(self.via, self.via_zones):
+            if candidate_zones.isdisjoint(zones):
+                continue
+            if points is None:
+                points = to_path(route_data.get('via')) + to_path(route_data.get('path'))
+            if any(zone_key(point) in zones and haversine_m(via_point, point) <= VIA_RADIUS_M
+                   for point in points):
+                count += 1
+        return count
+
+    def evaluate(self, route_data):
+        """Return the match fields for a candidate, or None if it does not match"""
+        if route_data.get('userID') == self.user_id:
+            return None
+        if self.window and not windows_overlap(self.window, parse_window(route_data.get('departure'))):
+            return None
+
+        match = None
+        classified = classify_match(self.fingerprint, route_data.get('fingerprint'))
+        if classified:
+            match = {'match_type': classified[0], 'match_score': classified[1]}
+        if self.projector:
+            corridor = self.projector.match(route_data)
+            if corridor:
+                # Exact and endpoint matches keep their type and score
+                match = dict(corridor, **match) if match else corridor
+
+        via_count = self.via_matches(route_data)
+        if match is None:
+            if not via_count:
+                return None
+            match = {'match_type': 'shared_via', 'match_score': SHARED_VIA_SCORE}
+        if via_count:
+            match['match_score'] += VIA_POINT_BONUS * via_count
+            match['via_matches'] = via_count
+
+        if self.max_distance_m is not None:
+            if match['match_type'] == 'corridor':
+                distance_m = match['detour_m']
+            else:
+                distance_m = endpoint_distance_m(self.points, route_data)
+            if distance_m > self.max_distance_m:
+                return None
+        return match
+
+
+class TopKMatches:
+    """Bounded min-heap keeping the best matches by score, then recency"""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, route_data):
+        entry = (
+            (route_data.get('match_score', 0), route_data.get('timestamp') or ''),
+            next(self._counter),
+            route_data
+        )
+        if self.limit is None or len(self._heap) < self.limit:
+            heapq.heappush(self._heap, entry)
+        elif entry > self._heap[0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def results(self):
+        """Return the kept matches, best first"""
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+
+def merge_matches(result_lists, limit=None):
+    """Rank several ranked match lists together, keeping each route once
+
+    A route found by more than one source keeps its first copy, so sources
+    should be passed freshest first.
+    """
+    top_matches = TopKMatches(limit)
+    seen = set()
+    for results in result_lists:
+        for route_data in results:
+            key = route_data.get('routeId') or route_data.get('_id')
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            top_matches.push(route_data)
+    return top_matches.results()
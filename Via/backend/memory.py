@@ -0,0 +1,279 @@
+"""
+Deep-size accounting, tracemalloc diffs and growth trends for in-process state
+"""
+import gc
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import Counter, deque
+
+# Containers with more entries than this are measured from a sample and extrapolated
+SAMPLE_ENTRIES = 2000
+# Container levels an estimate looks through for large containers to sample
+ESTIMATE_DEPTH = 4
+LARGEST_ENTRIES = 5
+# Enough for a day of samples at a five-minute interval
+TREND_SAMPLES = 288
+# Leaves: counted but not walked into
+SCALAR_TYPES = (str, bytes, int, float, bool, type(None))
+# Shared code and runtime objects, not owned by any structure
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, threading.Thread)
+
+
+def current_rss_bytes():
+    """Resident set size of this process, or None where it cannot be read"""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+def deep_size(obj, seen=None):
+    """Bytes reachable from obj through containers and instance attributes
+
+    Objects already in seen are not counted again. Each structure is
+    measured with its own seen set, so route dicts shared by two structures
+    count toward both.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, SKIPPED_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        elif isinstance(current, SCALAR_TYPES):
+            continue
+        else:
+            if hasattr(current, '__dict__'):
+                stack.append(current.__dict__)
+            for slot in getattr(type(current), '__slots__', ()):
+                if hasattr(current, slot):
+                    stack.append(getattr(current, slot))
+    return total
+
+
+def estimate_size(obj, seen=None, depth=0):
+    """(bytes, sampled) reachable from obj, sampling large containers
+
+    Like deep_size, but containers with more than SAMPLE_ENTRIES entries are
+    measured from a sample and extrapolated, so indexes holding every route
+    cost a bounded walk. Instance attributes are looked through for such
+    containers; smaller containers, and anything ESTIMATE_DEPTH container
+    levels down, are counted exactly.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+        return 0, False
+    if isinstance(obj, dict):
+        entries = list(obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        entries = [(item,) for item in obj]
+    elif isinstance(obj, SCALAR_TYPES) or not (
+            hasattr(obj, '__dict__') or getattr(type(obj), '__slots__', ())):
+        return deep_size(obj, seen), False
+    else:
+        seen.add(id(obj))
+        total, sampled = sys.getsizeof(obj), False
+        attributes = [getattr(obj, slot) for slot in getattr(type(obj), '__slots__', ())
+                      if hasattr(obj, slot)]
+        if hasattr(obj, '__dict__'):
+            seen.add(id(obj.__dict__))
+            total += sys.getsizeof(obj.__dict__)
+            attributes.extend(obj.__dict__.keys())
+            attributes.extend(obj.__dict__.values())
+        for attribute in attributes:
+            size, attribute_sampled = estimate_size(attribute, seen, depth)
+            total += size
+            sampled = sampled or attribute_sampled
+        return total, sampled
+
+    if depth >= ESTIMATE_DEPTH or len(entries) <= SAMPLE_ENTRIES:
+        return deep_size(obj, seen), False
+    seen.add(id(obj))
+    measured = random.sample(entries, SAMPLE_ENTRIES)
+    total = sum(estimate_size(part, seen, depth + 1)[0] for entry in measured for part in entry)
+    return total * len(entries) // len(measured) + sys.getsizeof(obj), True
+
+
+def _entries(structure):
+    """(key, value) pairs of a mapping-like structure, or None for anything else"""
+    if hasattr(structure, 'items'):
+        return list(structure.items())
+    return None
+
+
+def measure(structure):
+    """Entries, estimated bytes and largest entries of one structure"""
+    entries = _entries(structure)
+    if entries is None:
+        size, sampled = estimate_size(structure)
+        return {'entries': len(structure) if hasattr(structure, '__len__') else None,
+                'bytes': size, 'estimated': sampled, 'largest': []}
+
+    sampled = len(entries) > SAMPLE_ENTRIES
+    measured = random.sample(entries, SAMPLE_ENTRIES) if sampled else entries
+    seen = set()
+    sizes = [(key, deep_size(key, seen) + deep_size(value, seen)) for key, value in measured]
+    total = sum(size for _, size in sizes)
+    if sampled:
+        total = total * len(entries) // len(measured)
+    largest = sorted(sizes, key=lambda item: item[1], reverse=True)[:LARGEST_ENTRIES]
+    return {
+        'entries': len(entries),
+        'bytes': total + sys.getsizeof(structure),
+        'estimated': sampled,
+        'largest': [{'key': str(key), 'bytes': size} for key, size in largest]
+    }
+
+
+def _slope_per_hour(points):
+    """Least-squares slope of (seconds, value) points, in units per hour"""
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_v = sum(v for _, v in points) / n
+    variance = sum((t - mean_t) ** 2 for t, _ in points)
+    if not variance:
+        return 0.0
+    covariance = sum((t - mean_t) * (v - mean_v) for t, v in points)
+    return covariance / variance * 3600
+
+
+class MemoryInspector:
+    """Named structures measured on demand and sampled over time"""
+
+    def __init__(self, max_samples=TREND_SAMPLES):
+        self._lock = threading.Lock()
+        self._structures = {}
+        self._samples = deque(maxlen=max_samples)
+        self._baseline = None
+
+    def register(self, name, getter):
+        """Track the structure returned by getter(); called at measure time"""
+        self._structures[name] = getter
+
+    def structures(self):
+        report = {}
+        for name, getter in self._structures.items():
+            try:
+                structure = getter()
+                report[name] = measure(structure) if structure is not None else None
+            except Exception as e:
+                report[name] = {'error': str(e)}
+        return report
+
+    def sample(self):
+        """Record RSS and per-structure sizes for the growth trend"""
+        structures = self.structures()
+        with self._lock:
+            self._samples.append({
+                'time': time.time(),
+                'rss_bytes': current_rss_bytes(),
+                'structures': {
+                    name: {'entries': stats.get('entries'), 'bytes': stats.get('bytes')}
+                    for name, stats in structures.items() if stats and 'bytes' in stats
+                }
+            })
+        return structures
+
+    def trend(self):
+        """Growth per hour of RSS and each structure over the kept samples"""
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {'samples': 0}
+
+        def series(value_of):
+            points = [(s['time'], value_of(s)) for s in samples]
+            return [(t, v) for t, v in points if v is not None]
+
+        trend = {
+            'samples': len(samples),
+            'since': samples[0]['time'],
+            'rss_bytes_per_hour': round(_slope_per_hour(series(lambda s: s['rss_bytes']))),
+            'structures': {}
+        }
+        for name in samples[-1]['structures']:
+            bytes_series = series(lambda s: (s['structures'].get(name) or {}).get('bytes'))
+            entries_series = series(lambda s: (s['structures'].get(name) or {}).get('entries'))
+            trend['structures'][name] = {
+                'bytes_per_hour': round(_slope_per_hour(bytes_series)),
+                'entries_per_hour': round(_slope_per_hour(entries_series), 1),
+                'bytes_change': bytes_series[-1][1] - bytes_series[0][1] if bytes_series else 0
+            }
+        return trend
+
+    def tracemalloc_diff(self, limit=20):
+        """Top allocation changes since the previous call
+
+        The first call starts tracing and records the baseline.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._baseline = tracemalloc.take_snapshot()
+            return {'status': 'tracing started', 'stats': []}
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        baseline, self._baseline = self._baseline, snapshot
+        if baseline is None:
+            return {'status': 'baseline recorded', 'stats': []}
+        stats = snapshot.compare_to(baseline, 'lineno')[:limit]
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            'status': 'tracing',
+            'traced_bytes': current,
+            'traced_peak_bytes': peak,
+            'stats': [{
+                'location': str(stat.traceback),
+                'size_diff': stat.size_diff,
+                'count_diff': stat.count_diff,
+                'size': stat.size
+            } for stat in stats]
+        }
+
+    def stop_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._baseline = None
+
+    @staticmethod
+    def object_types(limit=20):
+        """Most common live object types (walks every GC-tracked object)"""
+        counts = Counter(type(obj).__name__ for obj in gc.get_objects())
+        return [{'type': name, 'count': count} for name, count in counts.most_common(limit)]
+
+    def report(self, include_types=False):
+        report = {
+            'rss_bytes': current_rss_bytes(),
+            'gc_counts': gc.get_count(),
+            'structures': self.structures(),
+            'trend': self.trend(),
+            'tracemalloc': tracemalloc.is_tracing()
+        }
+        if include_types:
+            report['object_types'] = self.object_types()
+        return report
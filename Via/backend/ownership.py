@@ -0,0 +1,37 @@
+"""
+Route ids scoped to the socket or API token that created them
+"""
+import hashlib
+import secrets
+
+# REST producers send this header; the server issues one when it is missing
+ROUTE_TOKEN_HEADER = 'X-Route-Token'
+# Route ids are '<owner>:<client id>'. The owner part is public (it is in
+# every broadcast); the token it is derived from is not.
+OWNER_SEPARATOR = ':'
+
+
+def new_route_token():
+    return secrets.token_urlsafe(24)
+
+
+def token_owner(token):
+    """Public owner namespace derived from a secret route token"""
+    return 't' + hashlib.sha256(token.encode('utf-8')).hexdigest()[:24]
+
+
+def owns_route(owner, route_id):
+    """True when route_id lies in owner's namespace"""
+    return isinstance(route_id, str) and route_id.startswith(owner + OWNER_SEPARATOR)
+
+
+def scoped_route_id(owner, client_id):
+    """Place a client-chosen id in owner's namespace
+
+    Ids the owner already holds (as returned by an earlier ingest) are kept,
+    so producers can resend routes under the ids they were given.
+    """
+    client_id = str(client_id)
+    if owns_route(owner, client_id):
+        return client_id
+    return f"{owner}{OWNER_SEPARATOR}{client_id}"
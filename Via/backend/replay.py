@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic capture against an in-process server and report latency
+
+    python replay.py capture.jsonl.gz --speed 10 --output build-b.json --baseline build-a.json
+
+Socket events are sent through Flask-SocketIO test clients (one per recorded
+socket id) and REST calls through the Flask test client, so a replay needs
+no network and runs the same handlers production does. Latency is the time
+the handler takes to return.
+
+Route ids and tokens the replayed server issues differ from the recorded
+ones, so later requests are rewritten to use the replayed values, and a REST
+call counts as an error when its status differs from the recorded one.
+"""
+import argparse
+import json
+import logging
+import math
+import re
+import time
+from collections import defaultdict
+
+from ownership import token_owner
+from traffic import REDACTED, issued_values, read_capture
+
+READY_TIMEOUT_SECONDS = 30
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ReplayDriver:
+    def __init__(self, server, speed=1.0, admin_key=None):
+        self.server = server
+        # 0 replays as fast as possible; otherwise recorded gaps are divided by speed
+        self.speed = speed
+        # Sent in place of the redacted admin credential; None drops it
+        self.admin_key = admin_key
+        # Recorded route id, token or owner -> the one the replayed server issued
+        self.issued = {}
+        self._issued_pattern = None
+        self.http = server.app.test_client()
+        self.sockets = {}
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _socket(self, sid):
+        client = self.sockets.get(sid)
+        if client is None:
+            client = self.server.socketio.test_client(self.server.app, flask_test_client=self.http)
+            self.sockets[sid] = client
+        return client
+
+    def _send_socket(self, record):
+        event = record['event']
+        if event == 'connect':
+            self._socket(record['sid'])
+            return True
+        if event == 'disconnect':
+            client = self.sockets.pop(record['sid'], None)
+            if client is not None and client.is_connected():
+                client.disconnect()
+            return True
+        client = self._socket(record['sid'])
+        if record.get('data') is None:
+            client.emit(event)
+        else:
+            client.emit(event, record['data'])
+        # Drain queued emits so memory stays flat over long replays
+        client.get_received()
+        return True
+
+    def _rewrite(self, text):
+        """Replace recorded issued values in text with the replayed ones"""
+        if not text or not self.issued:
+            return text
+        if self._issued_pattern is None:
+            # Longest first, so a full route id wins over its owner prefix
+            self._issued_pattern = re.compile('|'.join(
+                re.escape(value) for value in sorted(self.issued, key=len, reverse=True)
+            ))
+        return self._issued_pattern.sub(lambda m: self.issued[m.group(0)], text)
+
+    def _learn(self, recorded, replayed):
+        for key, old in recorded.items():
+            new = replayed.get(key)
+            if not new or new == old or old in self.issued:
+                continue
+            self.issued[old] = new
+            if key == 'routeToken':
+                # Route ids embed the token's owner namespace
+                self.issued[token_owner(old)] = token_owner(new)
+            self._issued_pattern = None
+
+    def _send_rest(self, record):
+        headers = {}
+        for name, value in (record.get('headers') or {}).items():
+            if value == REDACTED:
+                if self.admin_key is None:
+                    continue
+                value = self.admin_key
+            headers[name] = self._rewrite(value)
+        response = self.http.open(
+            self._rewrite(record['path']),
+            method=record.get('method', 'GET'),
+            data=self._rewrite(record.get('data')),
+            content_type=record.get('content_type'),
+            headers=headers
+        )
+        if record.get('issued'):
+            self._learn(record['issued'], issued_values(response.get_json(silent=True)))
+        if record.get('status') is None:
+            # Captures from before statuses were recorded
+            return response.status_code < 500
+        return response.status_code == record['status']
+
+    def run(self, records):
+        started = time.perf_counter()
+        first_t = None
+        count = 0
+        for record in records:
+            if first_t is None:
+                first_t = record['t']
+            if self.speed:
+                delay = (record['t'] - first_t) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            name = f"{record['kind']}:{record['event']}"
+            sent_at = time.perf_counter()
+            try:
+                ok = self._send_rest(record) if record['kind'] == 'rest' else self._send_socket(record)
+            except Exception as e:
+                logging.error(f"❌ Replay of {name} failed: {e}")
+                ok = False
+            self.latencies[name].append((time.perf_counter() - sent_at) * 1000)
+            if not ok:
+                self.errors[name] += 1
+            count += 1
+
+        for client in self.sockets.values():
+            if client.is_connected():
+                client.disconnect()
+        return self.report(count, time.perf_counter() - started)
+
+    def report(self, count, elapsed_s):
+        events = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            events[name] = {
+                'count': len(values),
+                'errors': self.errors.get(name, 0),
+                'p50_ms': round(percentile(values, 0.50), 3),
+                'p95_ms': round(percentile(values, 0.95), 3),
+                'p99_ms': round(percentile(values, 0.99), 3),
+                'max_ms': round(values[-1], 3)
+            }
+        return {
+            'events': count,
+            'elapsed_s': round(elapsed_s, 3),
+            'throughput_per_s': round(count / elapsed_s, 1) if elapsed_s else 0.0,
+            'speed': self.speed,
+            'by_event': events
+        }
+
+
+def compare(report, baseline):
+    """Percentage change of each metric against a baseline report (negative is faster)"""
+    def change(new, old):
+        return round((new - old) / old * 100, 1) if old else None
+
+    diff = {'throughput_per_s': change(report['throughput_per_s'], baseline['throughput_per_s'])}
+    for name, stats in report['by_event'].items():
+        old = baseline['by_event'].get(name)
+        if old:
+            diff[name] = {
+                metric: change(stats[metric], old[metric])
+                for metric in ('p50_ms', 'p95_ms', 'p99_ms')
+            }
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured Via traffic and report latency')
+    parser.add_argument('capture', help='gzip JSON-lines capture written by TRAFFIC_CAPTURE_PATH')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='playback speed multiplier; 0 replays as fast as possible')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    parser.add_argument('--baseline', help='report from another build to compare against')
+    args = parser.parse_args()
+
+    # The server stack is loaded only when a replay actually runs
+    from main import create_server, load_config_from_env
+    config = load_config_from_env()
+    # Never record the replay itself
+    config['traffic_capture_path'] = None
+    server = create_server(config)
+    server.start_background_tasks()
+    if not server.ready.wait(READY_TIMEOUT_SECONDS):
+        logging.warning("⚠️ Server not ready; replaying anyway")
+
+    try:
+        driver = ReplayDriver(server, speed=args.speed, admin_key=config.get('admin_secret_key'))
+        report = driver.run(read_capture(args.capture))
+    finally:
+        server.stop()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Local in-memory mirror of recent routes, kept current from MongoDB
+"""
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import OperationFailure
+
+from matching import TopKMatches
+from route_index import RouteIndex
+from state_store import ShardedStore
+
+REPLICA_WINDOW_HOURS = 24
+POLL_INTERVAL_SECONDS = 2
+# Writers stamp synced_at with their own clock; re-read this far back to cover skew
+POLL_SKEW_SECONDS = 5
+# Polling cannot observe deletes, so the id set is reconciled this often
+RECONCILE_INTERVAL_SECONDS = 60
+PRUNE_INTERVAL_SECONDS = 60
+RETRY_DELAY_SECONDS = 5
+
+
+class RouteReplica:
+    """Routes from the last window_hours, indexed for local reads and matching
+
+    Bootstrapped with one query, then kept current by a change stream, or by
+    polling synced_at where change streams are unavailable (a standalone
+    mongod). Callers should only read while ready is True.
+    """
+
+    def __init__(self, collection, projection, window_hours=REPLICA_WINDOW_HOURS,
+                 poll_interval=POLL_INTERVAL_SECONDS, match_cache=None):
+        self.collection = collection
+        # Cached match results are computed from this replica, so they are
+        # invalidated when a route change reaches it
+        self.match_cache = match_cache
+        self.projection = projection
+        self.window_hours = window_hours
+        self.poll_interval = poll_interval
+        self.routes = ShardedStore()
+        self.route_index = RouteIndex()
+        self.ready = False
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_synced = None
+        self._last_pruned = 0
+        self._last_reconciled = 0
+
+    def __len__(self):
+        return len(self.routes)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='route-replica', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.ready = False
+        self._stop.set()
+
+    def covers(self, hours_back):
+        """True when a read over hours_back can be served locally"""
+        return self.ready and hours_back <= self.window_hours
+
+    def status(self):
+        return {'ready': self.ready, 'mode': self.mode, 'routes': len(self.routes)}
+
+    def _since(self, hours_back=None):
+        return (datetime.utcnow() - timedelta(hours=hours_back or self.window_hours)).isoformat()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._sync()
+            except Exception as e:
+                self.ready = False
+                logging.warning(f"⚠️ Route replica lost sync, rebuilding: {e}")
+                self._stop.wait(RETRY_DELAY_SECONDS)
+
+    def _sync(self):
+        """Bootstrap, then follow changes until the stream ends or stop() is called"""
+        # Open the stream before the bootstrap read so no change falls between
+        # them; replaying a change the bootstrap already saw is harmless
+        try:
+            stream = self.collection.watch(full_document='updateLookup', max_await_time_ms=1000)
+        except OperationFailure:
+            stream = None
+        try:
+            self._bootstrap()
+            if stream is None:
+                self.mode = 'polling'
+                self._poll()
+            else:
+                self.mode = 'change_stream'
+                self._tail(stream)
+        finally:
+            self.ready = False
+            if stream is not None:
+                stream.close()
+
+    def _bootstrap(self):
+        self.ready = False
+        started = time.perf_counter()
+        self._last_synced = datetime.utcnow()
+        self.routes.clear()
+        self.route_index.clear()
+        for route in self.collection.find({'timestamp': {'$gte': self._since()}}, self.projection):
+            self._apply(route)
+        self._last_pruned = self._last_reconciled = time.monotonic()
+        self.ready = True
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.info(f"🪞 Route replica loaded {len(self.routes)} routes in {elapsed_ms:.1f} ms")
+
+    def _tail(self, stream):
+        while not self._stop.is_set() and stream.alive:
+            change = stream.try_next()
+            if change is None:
+                self._maybe_prune()
+                continue
+            operation = change['operationType']
+            if operation in ('insert', 'update', 'replace'):
+                route = change.get('fullDocument')
+                if route is None:
+                    # Deleted again before the lookup ran
+                    self._remove(str(change['documentKey']['_id']))
+                else:
+                    self._apply(self._project(route))
+            elif operation == 'delete':
+                self._remove(str(change['documentKey']['_id']))
+            elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                return
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            checkpoint = datetime.utcnow()
+            since = self._last_synced - timedelta(seconds=POLL_SKEW_SECONDS)
+            for route in self.collection.find({'synced_at': {'$gte': since}}, self.projection):
+                self._apply(route)
+            self._last_synced = checkpoint
+            if time.monotonic() - self._last_reconciled >= RECONCILE_INTERVAL_SECONDS:
+                self._reconcile()
+            self._maybe_prune()
+
+    def _reconcile(self):
+        """Drop local routes that were deleted from the collection"""
+        live_ids = {
+            str(route['_id'])
+            for route in self.collection.find({'timestamp': {'$gte': self._since()}}, {'_id': 1})
+        }
+        for key in list(self.routes.keys()):
+            if key not in live_ids:
+                self._remove(key)
+        self._last_reconciled = time.monotonic()
+
+    def _maybe_prune(self):
+        """Drop routes that have aged out of the window"""
+        if time.monotonic() - self._last_pruned < PRUNE_INTERVAL_SECONDS:
+            return
+        since = self._since()
+        for key, route in list(self.routes.items()):
+            if route.get('timestamp', '') < since:
+                self._remove(key)
+        self._last_pruned = time.monotonic()
+
+    def _project(self, route):
+        for field, include in self.projection.items():
+            if not include:
+                route.pop(field, None)
+        return route
+
+    def _apply(self, route):
+        key = str(route['_id'])
+        route['_id'] = key
+        if route.get('timestamp', '') < self._since():
+            self._remove(key)
+            return
+        previous = self.routes.get(key)
+        self.routes[key] = route
+        self.route_index.add(key, route)
+        self._invalidate_matches(previous, route)
+
+    def _remove(self, key):
+        removed = self.routes.pop(key, None)
+        self.route_index.remove(key)
+        self._invalidate_matches(removed)
+
+    def _invalidate_matches(self, *routes):
+        if self.match_cache is not None:
+            for route in routes:
+                if route:
+                    self.match_cache.invalidate_route(route)
+
+    def get_routes(self, user_id=None, limit=100, hours_back=24):
+        """Newest routes in the window, like StorageHandler.get_routes"""
+        since = self._since(hours_back)
+        routes = (
+            route for route in self.routes.values()
+            if route.get('timestamp', '') >= since and (not user_id or route.get('userID') == user_id)
+        )
+        newest = heapq.nlargest(limit, routes, key=lambda route: route.get('timestamp', ''))
+        return [dict(route) for route in newest]
+
+    def find_matching(self, query, user_id, hours_back=24, limit=None, exclude=None):
+        """Best matches for query among other users' routes in the window
+
+        Routes whose routeId is in exclude are skipped without being scored.
+        """
+        keys = self.route_index.match_candidates(query)
+
+        since = self._since(hours_back)
+        top_matches = TopKMatches(limit)
+        for key in keys:
+            route = self.routes.get(key)
+            if not route or route.get('userID') == user_id or route.get('timestamp', '') < since:
+                continue
+            if exclude is not None and route.get('routeId') in exclude:
+                continue
+            match = query.evaluate(route)
+            if match:
+                top_matches.push(dict(route, **match))
+        return top_matches.results()
@@ -0,0 +1,119 @@
+"""
+In-memory hash indexes over route fingerprints
+"""
+import threading
+
+from fingerprint import apply_fingerprint, is_current
+from matching import endpoint_key
+from state_store import add_to_bucket, discard_from_bucket
+from timewindow import ANY_TIME_BUCKET
+
+
+class RouteIndex:
+    """Fingerprint indexes over mutable buckets guarded by one lock
+
+    Writers update buckets in place, so indexing costs the same however
+    many routes share a zone. Lookups copy the buckets they need under the
+    lock and return sets the caller owns.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.fingerprints = {}
+        self.by_path = {}
+        self.by_endpoints = {}
+        self.by_source_zone = {}
+        self.by_route_zone = {}
+
+    def add(self, key, route_data):
+        """Index a route under key, replacing any previous entry"""
+        fingerprint = route_data.get('fingerprint')
+        if not is_current(fingerprint):
+            # Routes stored before a fingerprint field existed
+            fingerprint = apply_fingerprint(route_data)
+        with self._lock:
+            self.remove(key)
+            self.fingerprints[key] = fingerprint
+
+            if fingerprint.get('path_hash'):
+                add_to_bucket(self.by_path, fingerprint['path_hash'], key)
+            endpoints = endpoint_key(fingerprint)
+            if endpoints:
+                add_to_bucket(self.by_endpoints, endpoints, key)
+            if fingerprint.get('source_zone'):
+                add_to_bucket(self.by_source_zone, fingerprint['source_zone'], key)
+            for zone in fingerprint.get('route_zones') or ():
+                add_to_bucket(self.by_route_zone, zone, key)
+
+    def remove(self, key):
+        """Drop a route from every index"""
+        with self._lock:
+            fingerprint = self.fingerprints.pop(key, None)
+            if not fingerprint:
+                return
+            discard_from_bucket(self.by_path, fingerprint.get('path_hash'), key)
+            discard_from_bucket(self.by_endpoints, endpoint_key(fingerprint), key)
+            discard_from_bucket(self.by_source_zone, fingerprint.get('source_zone'), key)
+            for zone in fingerprint.get('route_zones') or ():
+                discard_from_bucket(self.by_route_zone, zone, key)
+
+    def clear(self):
+        """Drop all indexed routes"""
+        with self._lock:
+            self._reset()
+
+    def candidates(self, query_fp):
+        """Return keys of routes sharing the query's path hash or endpoints"""
+        keys = set()
+        endpoints = endpoint_key(query_fp)
+        with self._lock:
+            if query_fp.get('path_hash'):
+                keys.update(self.by_path.get(query_fp['path_hash'], ()))
+            if endpoints:
+                keys.update(self.by_endpoints.get(endpoints, ()))
+        return keys
+
+    def corridor_candidates(self, zones):
+        """Return keys of routes whose source and destination zones are both in zones"""
+        keys = set()
+        with self._lock:
+            for zone in zones:
+                for key in self.by_source_zone.get(zone, ()):
+                    fingerprint = self.fingerprints.get(key)
+                    if fingerprint and fingerprint.get('destination_zone') in zones:
+                        keys.add(key)
+        return keys
+
+    def via_candidates(self, zones):
+        """Return keys of routes passing through any of the given zones"""
+        keys = set()
+        with self._lock:
+            for zone in zones:
+                keys.update(self.by_route_zone.get(zone, ()))
+        return keys
+
+    def departs_in(self, key, buckets):
+        """Check whether the route under key departs in any of the given time buckets"""
+        fingerprint = self.fingerprints.get(key)
+        if fingerprint is None:
+            return False
+        return not buckets.isdisjoint(fingerprint.get('time_buckets') or (ANY_TIME_BUCKET,))
+
+    def match_candidates(self, query):
+        """Return keys of routes a MatchQuery could match
+
+        Candidates come from the selective path, endpoint, corridor and via
+        indexes; the departure window is then checked per candidate, since
+        routes without a window (most of them) would make a time index
+        bucket as large as the whole set.
+        """
+        keys = self.candidates(query.fingerprint)
+        keys |= self.corridor_candidates(query.corridor_zones())
+        keys |= self.via_candidates(query.all_via_zones())
+        if query.time_buckets:
+            buckets = set(query.time_buckets)
+            keys = {key for key in keys if self.departs_in(key, buckets)}
+        return keys
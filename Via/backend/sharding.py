@@ -0,0 +1,235 @@
+"""
+Active routes partitioned by region across matching worker processes
+"""
+import logging
+import multiprocessing
+import threading
+import zlib
+from functools import lru_cache
+
+from fingerprint import ZONE_PRECISION
+from geo import geohash
+from matching import TopKMatches
+from route_index import RouteIndex
+
+# Geohash prefix length that names a region (3 characters is roughly 156 km)
+SHARD_GEOHASH_PRECISION = 3
+MATCH_TIMEOUT_SECONDS = 5
+
+
+class ShardUnavailable(RuntimeError):
+    """A worker failed or timed out; callers fall back to in-process matching"""
+
+
+@lru_cache(maxsize=65536)
+def zone_region(zone):
+    """Geohash prefix of the region containing a corridor zone"""
+    lat, lng = (int(part) for part in zone.split(':'))
+    factor = 10 ** ZONE_PRECISION
+    return geohash((lat + 0.5) / factor, (lng + 0.5) / factor, SHARD_GEOHASH_PRECISION)
+
+
+def route_placement_zones(route_data):
+    """Zones a route is stored under: its source zone and every zone it passes through
+
+    A route is found by exact, endpoint and corridor queries through its
+    source zone, and by via queries through the zones along it.
+    """
+    fingerprint = route_data.get('fingerprint') or {}
+    zones = set(fingerprint.get('route_zones') or ())
+    if fingerprint.get('source_zone'):
+        zones.add(fingerprint['source_zone'])
+    return zones
+
+
+def query_zones(query):
+    """Zones in which a route matching query can be stored"""
+    zones = {query.fingerprint.get('source_zone')}
+    zones |= query.corridor_zones()
+    zones |= query.all_via_zones()
+    zones.discard(None)
+    return zones
+
+
+def _match(routes, route_index, query, limit):
+    keys = route_index.match_candidates(query)
+
+    top_matches = TopKMatches(limit)
+    for key in keys:
+        route_data = routes.get(key)
+        if not route_data:
+            continue
+        match = query.evaluate(route_data)
+        if match:
+            top_matches.push(dict(route_data, _shard_key=key, **match))
+    return top_matches.results()
+
+
+def _shard_worker(conn):
+    """Worker loop: holds one shard's routes and answers match requests"""
+    routes = {}
+    route_index = RouteIndex()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        command = message[0]
+        if command == 'put':
+            _, key, route_data = message
+            routes[key] = route_data
+            route_index.add(key, route_data)
+        elif command == 'remove':
+            routes.pop(message[1], None)
+            route_index.remove(message[1])
+        elif command == 'clear':
+            routes.clear()
+            route_index.clear()
+        elif command == 'match':
+            _, query, limit = message
+            try:
+                conn.send((True, _match(routes, route_index, query, limit)))
+            except Exception as e:
+                conn.send((False, str(e)))
+        elif command == 'stop':
+            return
+
+
+class ShardCoordinator:
+    """Routes regions to worker processes and merges their match results
+
+    Writes are fire-and-forget messages; a match request is sent to every
+    touched shard before any reply is awaited, so shards score in parallel.
+    Each shard's pipe is guarded by a lock, and locks are always taken in
+    shard order.
+    """
+
+    def __init__(self, num_shards, match_timeout=MATCH_TIMEOUT_SECONDS):
+        self.num_shards = num_shards
+        self.match_timeout = match_timeout
+        self.healthy = False
+        self._connections = []
+        self._processes = []
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+        self._placement = {}
+        self._placement_lock = threading.Lock()
+
+    def start(self):
+        # Spawned, not forked: the parent runs socket and scheduler threads
+        context = multiprocessing.get_context('spawn')
+        for shard in range(self.num_shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_shard_worker, args=(child_conn,), name=f'match-shard-{shard}', daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._connections.append(parent_conn)
+            self._processes.append(process)
+        self.healthy = True
+        logging.info(f"🧩 Started {self.num_shards} matching shards")
+
+    def stop(self):
+        self.healthy = False
+        for shard, conn in enumerate(self._connections):
+            try:
+                with self._locks[shard]:
+                    conn.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+
+    def shard_for_zone(self, zone):
+        # crc32 rather than hash(): the mapping must not vary per process
+        return zlib.crc32(zone_region(zone).encode('ascii')) % self.num_shards
+
+    def _send(self, shard, message):
+        try:
+            with self._locks[shard]:
+                self._connections[shard].send(message)
+        except (OSError, ValueError) as e:
+            self._disable(f"shard {shard} unreachable: {e}")
+
+    def _disable(self, reason):
+        """Stop using the shards; their state can no longer be trusted"""
+        if self.healthy:
+            logging.error(f"❌ Matching shards disabled, falling back to in-process matching: {reason}")
+        self.healthy = False
+
+    def _fail(self, reason):
+        self._disable(reason)
+        raise ShardUnavailable(reason)
+
+    def put(self, key, route_data):
+        """Store a route in every shard covering its zones"""
+        if not self.healthy:
+            return
+        shards = frozenset(self.shard_for_zone(zone) for zone in route_placement_zones(route_data))
+        with self._placement_lock:
+            previous = self._placement.get(key, frozenset())
+            self._placement[key] = shards
+        for shard in previous - shards:
+            self._send(shard, ('remove', key))
+        for shard in shards:
+            self._send(shard, ('put', key, route_data))
+
+    def remove(self, key):
+        if not self.healthy:
+            return
+        with self._placement_lock:
+            shards = self._placement.pop(key, frozenset())
+        for shard in shards:
+            self._send(shard, ('remove', key))
+
+    def clear(self):
+        if not self.healthy:
+            return
+        with self._placement_lock:
+            self._placement.clear()
+        for shard in range(self.num_shards):
+            self._send(shard, ('clear',))
+
+    def find_matching(self, query, limit=None):
+        """Best matches for query from the shards its zones touch
+
+        Raises ShardUnavailable if any touched shard fails or times out.
+        """
+        if not self.healthy:
+            raise ShardUnavailable('shards are disabled')
+        shards = sorted({self.shard_for_zone(zone) for zone in query_zones(query)})
+        if not shards:
+            return []
+
+        replies = []
+        for shard in shards:
+            self._locks[shard].acquire()
+        try:
+            for shard in shards:
+                self._connections[shard].send(('match', query, limit))
+            for shard in shards:
+                conn = self._connections[shard]
+                if not conn.poll(self.match_timeout):
+                    # The pipe is now out of step with its replies; stop using shards
+                    self._fail(f"shard {shard} timed out")
+                replies.append(conn.recv())
+        except (OSError, EOFError, ValueError) as e:
+            self._fail(str(e))
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+
+        # A route stored in several touched shards is returned by each of them
+        top_matches = TopKMatches(limit)
+        seen = set()
+        for ok, result in replies:
+            if not ok:
+                raise ShardUnavailable(result)
+            for route_data in result:
+                key = route_data.pop('_shard_key')
+                if key not in seen:
+                    seen.add(key)
+                    top_matches.push(route_data)
+        return top_matches.results()
@@ -0,0 +1,121 @@
+"""
+Concurrency-safe containers for state shared by socket, REST and scheduler threads
+"""
+import threading
+
+DEFAULT_SHARDS = 64
+
+
+class ShardedStore:
+    """Dict-like store with per-shard write locks
+
+    Writers mutate their shard in place under its lock. Point reads are
+    single dict operations and take no lock; iteration copies one shard at
+    a time under its lock, so it never sees a dict change size.
+    """
+
+    def __init__(self, shards=DEFAULT_SHARDS):
+        self._shards = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def _slot(self, key):
+        return hash(key) % len(self._shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in list(self._shards))
+
+    def __contains__(self, key):
+        return key in self._shards[self._slot(key)]
+
+    def __getitem__(self, key):
+        return self._shards[self._slot(key)][key]
+
+    def get(self, key, default=None):
+        return self._shards[self._slot(key)].get(key, default)
+
+    def __setitem__(self, key, value):
+        slot = self._slot(key)
+        with self._locks[slot]:
+            self._shards[slot][key] = value
+
+    def __delitem__(self, key):
+        if self.pop(key, KeyError) is KeyError:
+            raise KeyError(key)
+
+    def pop(self, key, default=None):
+        slot = self._slot(key)
+        with self._locks[slot]:
+            return self._shards[slot].pop(key, default)
+
+    def update_item(self, key, update):
+        """Atomically replace the value under key with update(current)
+
+        update receives None when key is missing and should return a new
+        value rather than mutating the current one; returning None leaves
+        the store unchanged.
+        """
+        slot = self._slot(key)
+        with self._locks[slot]:
+            value = update(self._shards[slot].get(key))
+            if value is None:
+                return None
+            self._shards[slot][key] = value
+            return value
+
+    def clear(self):
+        for slot, lock in enumerate(self._locks):
+            with lock:
+                self._shards[slot] = {}
+
+    def _shard_items(self):
+        """Yield a copy of each shard's items, taken under that shard's lock"""
+        for slot, lock in enumerate(self._locks):
+            with lock:
+                items = list(self._shards[slot].items())
+            yield items
+
+    def keys(self):
+        for items in self._shard_items():
+            yield from (key for key, _ in items)
+
+    def values(self):
+        for items in self._shard_items():
+            yield from (value for _, value in items)
+
+    def items(self):
+        for items in self._shard_items():
+            yield from items
+
+    def __iter__(self):
+        return self.keys()
+
+    def snapshot(self):
+        """Return a plain dict copy of the current contents"""
+        merged = {}
+        for items in self._shard_items():
+            merged.update(items)
+        return merged
+
+
+def add_to_bucket(index, value, key):
+    """Add key to the set at index[value] (caller holds the write lock)
+
+    Buckets are mutated in place, so an add costs O(1) however many keys
+    share the bucket; readers copy buckets under the same lock.
+    """
+    bucket = index.get(value)
+    if bucket is None:
+        index[value] = bucket = set()
+    bucket.add(key)
+
+
+def discard_from_bucket(index, value, key):
+    """Remove key from index[value], dropping the bucket once empty (caller holds the write lock)"""
+    if value is None:
+        return
+    bucket = index.get(value)
+    if bucket is None:
+        return
+    bucket.discard(key)
+    if not bucket:
+        index.pop(value, None)
@@ -0,0 +1,116 @@
+"""
+In-memory static asset index with precompressed variants and ETags
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import Response
+
+# Files larger than this are left on disk and streamed by Flask
+MAX_CACHED_ASSET_BYTES = 5 * 1024 * 1024
+MIN_COMPRESS_BYTES = 256
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+DEFAULT_MAX_AGE_SECONDS = 86400
+
+
+class StaticAsset:
+    def __init__(self, data, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(data).hexdigest()[:20]
+        self.variants = {'identity': data}
+
+    def compress(self, brotli=None):
+        data = self.variants['identity']
+        if len(data) < MIN_COMPRESS_BYTES or not self.mimetype.startswith(COMPRESSIBLE_TYPES):
+            return
+        gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gzipped) < len(data):
+            self.variants['gzip'] = gzipped
+        if brotli:
+            compressed = brotli.compress(data, quality=11)
+            if len(compressed) < len(data):
+                self.variants['br'] = compressed
+
+
+def _load_brotli():
+    try:
+        import brotli
+    except ImportError:  # brotli is optional; gzip is always available
+        return None
+    return brotli
+
+
+class StaticAssetCache:
+    """Serves the frontend from memory without touching the filesystem per request"""
+
+    def __init__(self, root, index_file='consolidated-html.html', max_age=DEFAULT_MAX_AGE_SECONDS):
+        self.root = os.path.abspath(root)
+        self.index_file = index_file
+        self.max_age = max_age
+        self.assets = {}
+        self.refresh()
+
+    def refresh(self):
+        """Rebuild the index from disk; assets are served uncompressed until compress_all()"""
+        assets = {}
+        total_bytes = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                relative_path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                try:
+                    if os.path.getsize(full_path) > MAX_CACHED_ASSET_BYTES:
+                        continue
+                    with open(full_path, 'rb') as f:
+                        data = f.read()
+                except OSError as e:
+                    logging.warning(f"⚠️ Skipping static asset {relative_path}: {e}")
+                    continue
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                assets[relative_path] = StaticAsset(data, mimetype)
+                total_bytes += len(data)
+        self.assets = assets
+        logging.info(f"📦 Indexed {len(assets)} static assets ({total_bytes} bytes)")
+
+    def compress_all(self):
+        """Build the compressed variants; slow at high levels, so run off the startup path"""
+        brotli = _load_brotli()
+        for asset in list(self.assets.values()):
+            asset.compress(brotli)
+
+    def _cache_control(self, path):
+        # HTML must revalidate so a deploy is picked up; other assets are
+        # served from the browser cache and revalidated by ETag afterwards
+        if path.endswith('.html'):
+            return 'no-cache'
+        return f'public, max-age={self.max_age}'
+
+    def response(self, path, request):
+        """Return a Response for path, or None if the asset is not indexed"""
+        asset = self.assets.get(path or self.index_file)
+        if asset is None:
+            return None
+
+        accepted = request.headers.get('Accept-Encoding', '')
+        encoding = 'identity'
+        if 'br' in asset.variants and 'br' in accepted:
+            encoding = 'br'
+        elif 'gzip' in asset.variants and 'gzip' in accepted:
+            encoding = 'gzip'
+
+        # Each encoding is a distinct representation with its own ETag
+        etag = asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}'
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': self._cache_control(path or self.index_file),
+            'Vary': 'Accept-Encoding'
+        }
+        if request.if_none_match and etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
@@ -0,0 +1,75 @@
+"""
+Cached route statistics merged with in-memory counters
+"""
+import logging
+import threading
+import time
+
+STATS_TTL_SECONDS = 5
+
+
+class StatsService:
+    def __init__(self, storage_handler=None, broadcast_handler=None, ttl_seconds=STATS_TTL_SECONDS):
+        self.storage_handler = storage_handler
+        self.broadcast_handler = broadcast_handler
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # One lock per cached name, so a slow aggregation never blocks a ping
+        self._locks = {}
+        self._cache = {}
+
+    def _cached(self, name, compute):
+        """Return compute() at most once per TTL; concurrent callers share one result"""
+        entry = self._cache.get(name)
+        if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+            return entry[1]
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            entry = self._cache.get(name)
+            if entry and time.monotonic() - entry[0] < self.ttl_seconds:
+                return entry[1]
+            value = compute()
+            self._cache[name] = (time.monotonic(), value)
+            return value
+
+    def invalidate(self):
+        self._cache = {}
+
+    def database_status(self):
+        """Return (connected, message), pinging MongoDB at most once per TTL"""
+        if not self.storage_handler:
+            return False, "not_configured"
+        return self._cached('database', self.storage_handler.test_connection)
+
+    def _storage_stats(self):
+        if not self.storage_handler:
+            return None
+        success, result = self.storage_handler.get_route_stats()
+        if not success:
+            logging.warning(f"⚠️ Storage stats unavailable: {result}")
+            return None
+        return result
+
+    def get_stats(self):
+        """Aggregated storage stats plus live in-memory counters"""
+        stats = {
+            'total_routes': 0,
+            'active_routes': 0,
+            'unique_users': 0,
+            'connected_clients': 0
+        }
+
+        storage_stats = self._cached('storage', self._storage_stats)
+        if storage_stats:
+            stats.update(storage_stats)
+
+        # In-memory counters are cheap and always current
+        if self.broadcast_handler:
+            info = self.broadcast_handler.get_connected_clients_info()
+            stats.update({
+                'active_routes': info.get('active_routes', 0),
+                'unique_users': info.get('unique_users', 0),
+                'connected_clients': info.get('connected_clients', 0)
+            })
+        return stats
@@ -0,0 +1,72 @@
+"""
+Standing match queries that are evaluated once per ingested route
+"""
+import threading
+
+from matching import endpoint_key
+from state_store import add_to_bucket, discard_from_bucket
+
+
+class SubscriptionRegistry:
+    """Index of subscribed MatchQuery objects keyed by what a new route must share"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.queries = {}
+        self._entries = {}
+        self.by_path = {}
+        self.by_endpoints = {}
+        self.by_corridor_zone = {}
+        self.by_via_zone = {}
+
+    def __len__(self):
+        return len(self.queries)
+
+    def subscribe(self, sid, query):
+        """Register (or replace) the standing query for a socket"""
+        entries = []
+        if query.fingerprint.get('path_hash'):
+            entries.append((self.by_path, query.fingerprint['path_hash']))
+        endpoints = endpoint_key(query.fingerprint)
+        if endpoints:
+            entries.append((self.by_endpoints, endpoints))
+        # A corridor match needs the new route's source inside the corridor
+        for zone in query.corridor_zones():
+            entries.append((self.by_corridor_zone, zone))
+        for zone in query.all_via_zones():
+            entries.append((self.by_via_zone, zone))
+
+        with self._lock:
+            self.unsubscribe(sid)
+            for index, value in entries:
+                add_to_bucket(index, value, sid)
+            self.queries[sid] = query
+            self._entries[sid] = entries
+
+    def unsubscribe(self, sid):
+        """Drop a socket's standing query"""
+        with self._lock:
+            self.queries.pop(sid, None)
+            for index, value in self._entries.pop(sid, ()):
+                discard_from_bucket(index, value, sid)
+
+    def matches_for(self, route_data):
+        """Return (sid, match) pairs for subscribers the new route matches"""
+        fingerprint = route_data.get('fingerprint') or {}
+        # Buckets are mutated in place by subscribe, so copy them under the lock
+        with self._lock:
+            sids = set(self.by_path.get(fingerprint.get('path_hash'), ()))
+            sids.update(self.by_endpoints.get(endpoint_key(fingerprint), ()))
+            sids.update(self.by_corridor_zone.get(fingerprint.get('source_zone'), ()))
+            for zone in fingerprint.get('route_zones') or ():
+                sids.update(self.by_via_zone.get(zone, ()))
+
+        matches = []
+        for sid in sids:
+            query = self.queries.get(sid)
+            if query is None or route_data.get('socketId') == sid:
+                continue
+            match = query.evaluate(route_data)
+            if match:
+                matches.append((sid, match))
+        return matches
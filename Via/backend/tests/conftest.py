@@ -0,0 +1,7 @@
+"""
+Backend modules import each other as top-level modules, so tests run with the backend directory on sys.path
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pyarrow')
+from archive import RouteArchive, parse_range  # noqa: E402
+
+NOW = datetime(2026, 3, 10, 12, 0, 0)
+
+
+def route(i, days_ago=0, user_id=None):
+    return {
+        '_id': f'id{i}', 'routeId': f'r{i}', 'userID': user_id or f'u{i % 2}',
+        'timestamp': (NOW - timedelta(days=days_ago)).isoformat(),
+        'source': [12.9, 77.6], 'destination': {'lat': 13.0, 'lng': 77.7},
+        'path': [[12.9, 77.6], [13.0, 77.7]], 'fingerprint': {'source_zone': 'zA'}
+    }
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = RouteArchive(str(tmp_path / 'archive'))
+    archive.write([route(i, days_ago=i % 3) for i in range(9)])
+    return archive
+
+
+def test_routes_are_partitioned_by_day(archive):
+    stats = archive.stats()
+    assert sorted(stats) == ['2026-03-08', '2026-03-09', '2026-03-10']
+    assert all(day['files'] == 1 and day['bytes'] > 0 for day in stats.values())
+
+
+def test_query_filters_by_time_and_columns(archive):
+    rows = archive.query(start=NOW - timedelta(days=1), filters={'userID': 'u1'})
+    assert sorted(row['routeId'] for row in rows) == ['r1', 'r3', 'r7']
+    assert rows[0]['destination_lat'] == 13.0 and rows[0]['path_points'] == 2
+    assert archive.count(end=NOW - timedelta(days=1, hours=12)) == 3
+
+
+def test_documents_round_trip(archive):
+    row, = archive.query(filters={'routeId': 'r4'}, columns=['document'])
+    assert row['document'] == route(4, days_ago=1)
+
+
+def test_unknown_filters_and_columns_are_rejected(archive):
+    with pytest.raises(ValueError):
+        archive.query(filters={'path': 'x'})
+    with pytest.raises(ValueError):
+        archive.query(columns=['nope'])
+
+
+def test_parse_range():
+    start, end = parse_range(end='2026-03-10T00:00:00Z', days=2)
+    assert (start, end) == (datetime(2026, 3, 8), datetime(2026, 3, 10))
+    with pytest.raises(ValueError):
+        parse_range(start='yesterday')
+    for days in ('inf', 'nan', '-1', '1e12'):
+        with pytest.raises(ValueError):
+            parse_range(days=days)
+
+
+def test_limit_must_be_positive(archive):
+    for limit in (0, -1):
+        with pytest.raises(ValueError):
+            archive.query(limit=limit)
+
+
+class FakeRoutes:
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.deleted_batches = []
+        self.indexes = {}
+
+    def find(self, query, projection):
+        before = query['timestamp']['$lt']
+        return SimpleNamespace(batch_size=lambda size: [d for d in self.documents if d['timestamp'] < before])
+
+    def create_index(self, keys, **options):
+        self.indexes[str(keys)] = options
+
+    def delete_many(self, query):
+        ids = set(query['_id']['$in'])
+        self.deleted_batches.append(ids)
+        kept = [d for d in self.documents if d['_id'] not in ids]
+        deleted, self.documents = len(self.documents) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+
+def storage(archive, documents, **options):
+    pytest.importorskip('flask_pymongo')
+    import dbox
+    handler = dbox.StorageHandler(archive=archive, **options)
+    handler.mongo = SimpleNamespace(db=SimpleNamespace(routes=FakeRoutes(documents)))
+    return handler, dbox
+
+
+def test_expired_routes_are_archived_in_batches_then_deleted(tmp_path, monkeypatch):
+    archive = RouteArchive(str(tmp_path / 'archive'))
+    handler, _ = storage(archive, [route(i, days_ago=2 + i % 2) for i in range(5)] + [route(9)])
+    monkeypatch.setattr('archive.ARCHIVE_BATCH_SIZE', 2)
+    assert handler._remove_expired(NOW - timedelta(days=1)) == 5
+    assert [d['_id'] for d in handler.mongo.db.routes.documents] == ['id9']
+    assert len(handler.mongo.db.routes.deleted_batches) == 3
+    assert archive.count() == 5
+
+
+def test_failed_archive_write_keeps_routes():
+    class BrokenArchive:
+        def write(self, routes):
+            raise OSError('disk full')
+    handler, _ = storage(BrokenArchive(), [route(0, days_ago=2)])
+    with pytest.raises(OSError):
+        handler._remove_expired(NOW)
+    assert len(handler.mongo.db.routes.documents) == 1
+
+
+def test_ttl_backstop_outlasts_the_sweep_interval():
+    handler, dbox = storage(object(), [], cleanup_interval_hours=12)
+    handler.ensure_indexes()
+    grace = handler.mongo.db.routes.indexes['expires_at']['expireAfterSeconds']
+    assert grace == dbox.archive_ttl_grace_seconds(12) > 2 * 12 * 3600
+    assert dbox.archive_ttl_grace_seconds(0.5) == 2 * 3600
+
+    # Without an archive routes are dropped as soon as they expire
+    handler, _ = storage(None, [])
+    handler.ensure_indexes()
+    assert handler.mongo.db.routes.indexes['expires_at']['expireAfterSeconds'] == 0
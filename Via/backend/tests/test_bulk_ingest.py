@@ -0,0 +1,115 @@
+import pytest
+
+import validation
+from ownership import owns_route, scoped_route_id, token_owner
+from validation import MAX_BULK_ROUTES, validate_batch
+
+
+def route(i, **overrides):
+    route_data = {
+        'userID': f'u{i}',
+        'source': [12.9 + i * 1e-4, 77.6],
+        'destination': [13.0, 77.7],
+        'path': [[12.9, 77.6], [12.95, 77.65], [13.0, 77.7]] * 10,
+    }
+    route_data.update(overrides)
+    return route_data
+
+
+def batch():
+    items = [route(i) for i in range(20)]
+    items[3] = route(3, source=[95.0, 77.6])
+    items[7] = route(7, path=[[12.9, 77.6], [12.9, 181.0]])
+    items[9] = route(9, destination=[float('nan'), 77.7])
+    items[11] = {'userID': 'u11'}
+    items[12] = route(12, userID='')
+    items[14] = 'not a route'
+    return items
+
+
+EXPECTED_ERRORS = {
+    3: 'Invalid source: expected an in-range [lat, lng] point',
+    7: 'Invalid path: malformed or out-of-range point',
+    9: 'Invalid destination: expected an in-range [lat, lng] point',
+    11: 'Missing required route data',
+    12: 'Invalid userID: expected a non-empty string or number',
+    14: 'Route must be an object',
+}
+
+
+def check(valid, errors):
+    assert {error['index']: error['message'] for error in errors} == EXPECTED_ERRORS
+    assert [error['index'] for error in errors] == sorted(EXPECTED_ERRORS)
+    assert len(valid) == 20 - len(EXPECTED_ERRORS)
+    assert all(r['via'] == [] and 'fingerprint' not in r for r in valid)
+
+
+def test_columnar_batch_validation():
+    pytest.importorskip('numpy')
+    assert validation._batch_coordinates([r for r in batch() if isinstance(r, dict) and 'source' in r])[1]
+    check(*validate_batch(batch()))
+
+
+def test_per_route_fallback_gives_the_same_result(monkeypatch):
+    monkeypatch.setattr(validation, '_load_numpy', lambda: False)
+    check(*validate_batch(batch()))
+
+
+def test_dict_points_fall_back_to_per_route_checks():
+    items = [route(i, source={'lat': 12.9, 'lng': 77.6}) for i in range(10)]
+    valid, errors = validate_batch(items)
+    assert len(valid) == 10 and not errors
+
+
+def test_oversized_batches_are_rejected():
+    with pytest.raises(ValueError):
+        validate_batch([{}] * (MAX_BULK_ROUTES + 1))
+
+
+def test_route_ids_are_scoped_to_their_owner():
+    mine, theirs = token_owner('secret-a'), token_owner('secret-b')
+    route_id = scoped_route_id(mine, 'truck-7')
+    assert owns_route(mine, route_id)
+    assert not owns_route(theirs, route_id)
+    # Reusing someone else's id lands in the caller's own namespace
+    assert scoped_route_id(theirs, route_id) != route_id
+    assert owns_route(theirs, scoped_route_id(theirs, route_id))
+    assert scoped_route_id(mine, route_id) == route_id
+
+
+class DuplicatedRoutes:
+    """A collection whose routeIds are already duplicated"""
+
+    def __init__(self, existing_index):
+        self.indexes = {'routeId_1': {}} if existing_index else {}
+
+    def create_index(self, keys, **options):
+        from pymongo.errors import OperationFailure
+        name = f'{keys}_1' if isinstance(keys, str) else str(keys)
+        if options.get('unique'):
+            if name in self.indexes:
+                raise OperationFailure('index options conflict', code=86)
+            raise OperationFailure('E11000 duplicate key error', code=11000)
+        self.indexes[name] = options
+
+    def drop_index(self, name):
+        del self.indexes[name]
+
+    def aggregate(self, pipeline):
+        return [{'_id': 'r1', 'count': 2}]
+
+
+@pytest.mark.parametrize('existing_index', [True, False])
+def test_duplicate_route_ids_keep_a_plain_index(existing_index, caplog):
+    pytest.importorskip('flask_pymongo')
+    from types import SimpleNamespace
+
+    import dbox
+    handler = dbox.StorageHandler()
+    routes = DuplicatedRoutes(existing_index)
+    handler.mongo = SimpleNamespace(db=SimpleNamespace(routes=routes))
+    assert handler.ensure_indexes() == (True, 'Indexes ready')
+    assert routes.indexes['routeId_1'] == {}
+    # The indexes after routeId are still created
+    assert 'timestamp_1' in routes.indexes and 'fingerprint.route_zones_1' in routes.indexes
+    assert 'r1' in caplog.text
@@ -0,0 +1,66 @@
+import compute
+from compute import OFFLOAD_MIN_POINTS, ComputePool, _fingerprint_batch, _pack
+from fingerprint import compute_fingerprint
+
+
+def route(i, points=OFFLOAD_MIN_POINTS):
+    path = [[12.9 + j * 1e-4, 77.6 + i * 1e-3] for j in range(points)]
+    return {'userID': f'u{i}', 'source': path[0], 'destination': path[-1], 'path': path}
+
+
+def expected(route_data):
+    return compute_fingerprint(dict(route_data, fingerprint=None))
+
+
+def test_without_workers_everything_runs_inline():
+    pool = ComputePool(workers=0)
+    pool.start()
+    routes = [route(i, points=3) for i in range(3)] + [route(9)]
+    assert pool.fingerprint_routes(routes) is routes
+    assert all(r['fingerprint'] == expected(r) for r in routes)
+    single = route(5)
+    assert pool.fingerprint_route(single) == expected(single)
+    pool.stop()
+
+
+def test_shared_buffer_round_trip():
+    routes = [route(0, points=4), {'userID': 'u1', 'source': [1.0, 2.0], 'destination': [3.0, 4.0]}]
+    block, jobs = _pack(routes)
+    try:
+        assert _fingerprint_batch(block.name, jobs) == [expected(r) for r in routes]
+    finally:
+        ComputePool._release(block)
+    # Routes without paths need no buffer
+    block, jobs = _pack(routes[1:])
+    assert block is None
+    assert _fingerprint_batch(None, jobs) == [expected(routes[1])]
+
+
+def test_failed_jobs_are_recomputed_inline(monkeypatch):
+    pool = ComputePool(workers=1)
+    pool._executor = object()  # offloading is on, but every submit fails
+
+    def fail(routes):
+        raise RuntimeError('worker died')
+    monkeypatch.setattr(pool, 'submit_fingerprints', fail)
+    routes = [route(i) for i in range(3)]
+    pool.fingerprint_routes(routes)
+    assert all(r['fingerprint'] == expected(r) for r in routes)
+    single = route(7)
+    assert pool.fingerprint_route(single) == expected(single)
+
+
+def test_worker_processes_match_inline_fingerprints(monkeypatch, caplog):
+    monkeypatch.setattr(compute, 'BATCH_SIZE', 2)
+    pool = ComputePool(workers=2)
+    pool.start()
+    try:
+        routes = [route(i) for i in range(5)]
+        pool.fingerprint_routes(routes)
+        assert all(r['fingerprint'] == expected(r) for r in routes)
+        single = route(6)
+        assert pool.fingerprint_route(single) == expected(single)
+        # Computed by the workers, not by the inline fallback
+        assert 'inline' not in caplog.text
+    finally:
+        pool.stop()
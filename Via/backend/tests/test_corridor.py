@@ -0,0 +1,42 @@
+import pytest
+
+from corridor import PathProjector
+from fingerprint import apply_fingerprint
+from matching import MatchQuery, parse_match_options
+
+# Roughly 4.4 km due north
+PATH = [[12.90, 77.60], [12.92, 77.60], [12.94, 77.60]]
+
+
+def test_pickup_and_dropoff_along_the_path():
+    match = PathProjector(PATH, buffer_m=300).match({
+        'source': [12.905, 77.601], 'destination': [12.935, 77.599]
+    })
+    assert match['match_type'] == 'corridor'
+    assert match['pickup']['along_m'] < match['dropoff']['along_m']
+    assert match['shared_distance_m'] == pytest.approx(3336, rel=0.01)
+    assert match['detour_m'] > 0
+
+
+def test_reverse_direction_and_far_points_do_not_match():
+    projector = PathProjector(PATH, buffer_m=300)
+    assert projector.match({'source': [12.935, 77.60], 'destination': [12.905, 77.60]}) is None
+    assert projector.match({'source': [12.905, 77.62], 'destination': [12.935, 77.60]}) is None
+
+
+def test_corridor_query_matches_other_users_only():
+    query = MatchQuery('me', PATH[0], PATH[-1], PATH, mode='corridor', buffer_m=300)
+    rider = {'userID': 'rider', 'source': [12.905, 77.60], 'destination': [12.935, 77.60], 'path': []}
+    apply_fingerprint(rider)
+    assert query.evaluate(rider)['match_type'] == 'corridor'
+    assert query.evaluate(dict(rider, userID='me')) is None
+
+
+@pytest.mark.parametrize('options', [
+    {'buffer': 'nan'}, {'buffer': float('inf')}, {'buffer': 0},
+    {'max_distance': 'nan'}, {'max_distance': '-inf'}, {'max_distance': -1},
+    {'mode': 'fuzzy'}, {'limit': 0},
+])
+def test_invalid_match_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        parse_match_options(options)
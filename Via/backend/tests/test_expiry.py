@@ -0,0 +1,53 @@
+import threading
+import time
+
+from expiry import COMPACT_MIN_ENTRIES, COMPACT_RATIO, ExpiryScheduler
+
+
+def test_callbacks_fire_in_deadline_order():
+    scheduler = ExpiryScheduler()
+    fired = []
+    done = threading.Event()
+    scheduler.start()
+    try:
+        scheduler.schedule_in('late', 0.06, lambda: (fired.append('late'), done.set()))
+        scheduler.schedule_in('early', 0.02, lambda: fired.append('early'))
+        assert done.wait(2)
+        assert fired == ['early', 'late']
+        assert len(scheduler) == 0
+    finally:
+        scheduler.stop()
+
+
+def test_reschedule_replaces_and_cancel_prevents_firing():
+    scheduler = ExpiryScheduler()
+    fired = []
+    scheduler.start()
+    try:
+        scheduler.schedule_in('a', 0.01, lambda: fired.append('a-old'))
+        scheduler.schedule_in('a', 0.03, lambda: fired.append('a-new'))
+        scheduler.schedule_in('b', 0.01, lambda: fired.append('b'))
+        assert scheduler.cancel('b')
+        assert not scheduler.cancel('missing')
+        time.sleep(0.2)
+        assert fired == ['a-new']
+    finally:
+        scheduler.stop()
+
+
+def test_rescheduling_one_key_does_not_grow_the_heap():
+    scheduler = ExpiryScheduler()
+    for _ in range(100000):
+        scheduler.schedule_in('route', 3600, lambda: None)
+    assert len(scheduler) == 1
+    assert len(scheduler._heap) <= max(COMPACT_MIN_ENTRIES, COMPACT_RATIO * 2)
+
+
+def test_cancelled_entries_are_compacted():
+    scheduler = ExpiryScheduler()
+    for i in range(10000):
+        scheduler.schedule_in(i, 3600, lambda: None)
+    for i in range(9900):
+        scheduler.cancel(i)
+    assert len(scheduler) == 100
+    assert len(scheduler._heap) <= COMPACT_MIN_ENTRIES
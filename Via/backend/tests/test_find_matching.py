@@ -0,0 +1,97 @@
+import pytest
+
+flask = pytest.importorskip('flask')
+from match_cache import MatchCache  # noqa: E402
+from matching import merge_matches  # noqa: E402
+from trek import RouteHandler  # noqa: E402
+
+PATH = [[12.9716, 77.5946], [12.955, 77.61], [12.9352, 77.6245]]
+REQUEST = {'userID': 'alice', 'source': PATH[0], 'destination': PATH[-1], 'path': PATH}
+
+
+def match(route_id, user_id, score, timestamp='2026-01-01T00:00:00'):
+    return {'routeId': route_id, 'userID': user_id, 'match_score': score, 'timestamp': timestamp}
+
+
+class FakeBroadcast:
+    def __init__(self, routes, sharded=True):
+        self.routes = routes
+        self.active_routes = {r['routeId']: r for r in routes}
+        self.sharded = sharded
+        self.calls = 0
+
+    def shards_available(self):
+        return self.sharded
+
+    def get_fallback_matching_routes(self, user_id, source, destination, path, limit=None, query=None):
+        self.calls += 1
+        return [dict(r) for r in self.routes if r['userID'] != user_id][:limit]
+
+
+class FakeStorage:
+    def __init__(self, routes, ok=True):
+        self.routes = routes
+        self.ok = ok
+        self.calls = 0
+        self.scored = []
+
+    def find_matching_routes(self, user_id, source, destination, path, limit=None, query=None, exclude=None):
+        self.calls += 1
+        if not self.ok:
+            return False, 'down'
+        routes = [r for r in self.routes if r['userID'] != user_id and r['routeId'] not in (exclude or ())]
+        self.scored.extend(r['routeId'] for r in routes)
+        return True, [dict(r) for r in routes][:limit]
+
+
+def client(storage=None, broadcast=None, match_cache=None):
+    app = flask.Flask(__name__)
+    app.register_blueprint(RouteHandler(storage, broadcast, stats_service=object(),
+                                        match_cache=match_cache).blueprint)
+    return app.test_client()
+
+
+def find(test_client, **overrides):
+    return test_client.post('/find-matching-routes', json=dict(REQUEST, **overrides)).get_json()
+
+
+def test_merge_ranks_across_sources_and_keeps_each_route_once():
+    local = [match('a', 'u1', 80, '2026-01-02'), match('b', 'u2', 40)]
+    stored = [dict(match('a', 'u1', 80), stale=True), match('c', 'u3', 100)]
+    merged = merge_matches([local, stored], limit=2)
+    assert [r['routeId'] for r in merged] == ['c', 'a']
+    assert 'stale' not in merged[1]
+
+
+def test_sharded_and_stored_matches_are_merged():
+    broadcast = FakeBroadcast([match('local', 'bob', 80)])
+    storage = FakeStorage([match('remote', 'carol', 100), match('local', 'bob', 80)])
+    body = find(client(storage, broadcast))
+    assert [r['routeId'] for r in body['data']] == ['remote', 'local']
+    # The shards already scored this node's routes
+    assert storage.scored == ['remote']
+
+
+def test_cached_result_is_shared_and_filtered_per_requester():
+    storage = FakeStorage([match('a', 'alice', 100), match('b', 'bob', 80)])
+    test_client = client(storage, FakeBroadcast([], sharded=False), MatchCache())
+    first = find(test_client)
+    second = find(test_client, userID='bob')
+    assert storage.calls == 1 and second['cached']
+    assert [r['routeId'] for r in first['data']] == ['b']
+    assert [r['routeId'] for r in second['data']] == ['a']
+
+
+def test_requester_owning_the_shared_result_gets_a_fresh_ranking():
+    routes = [match(f'own{i}', 'alice', 100) for i in range(8)] + [match('b', 'bob', 10)]
+    storage = FakeStorage(routes)
+    body = find(client(storage, FakeBroadcast([], sharded=False), MatchCache()), limit=2)
+    assert [r['routeId'] for r in body['data']] == ['b']
+    assert storage.calls == 2
+
+
+def test_results_without_storage_are_not_cached():
+    cache = MatchCache()
+    test_client = client(FakeStorage([], ok=False), FakeBroadcast([match('a', 'bob', 80)]), cache)
+    assert [r['routeId'] for r in find(test_client)['data']] == ['a']
+    assert len(cache) == 0
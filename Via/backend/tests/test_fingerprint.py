@@ -0,0 +1,45 @@
+from fingerprint import FINGERPRINT_FIELDS, apply_fingerprint, cell_key, is_current, path_hash
+from matching import classify_match
+from route_index import RouteIndex
+
+
+def route(user, source, destination, path):
+    return {'userID': user, 'source': source, 'destination': destination, 'path': path}
+
+
+def test_cell_key_snaps_nearby_points_together():
+    assert cell_key([12.9701, 77.5901]) == cell_key({'lat': 12.9704, 'lng': 77.5909})
+    assert cell_key([12.9701, 77.5901]) != cell_key([12.9711, 77.5901])
+    assert cell_key(None) is None
+
+
+def test_path_hash_ignores_repeated_cells_and_jitter():
+    path = [[12.9701, 77.5901], [12.9702, 77.5902], [12.9801, 77.6001]]
+    jittered = [[12.9703, 77.5903], [12.9805, 77.6004]]
+    assert path_hash(path) == path_hash(jittered)
+    assert path_hash(path) != path_hash(list(reversed(path)))
+    assert path_hash([]) is None
+
+
+def test_classify_exact_path_then_endpoints():
+    a = route('a', [12.97, 77.59], [12.99, 77.61], [[12.97, 77.59], [12.98, 77.60], [12.99, 77.61]])
+    b = route('b', [12.97, 77.59], [12.99, 77.61], [[12.97, 77.59], [12.96, 77.62], [12.99, 77.61]])
+    same = dict(a, userID='c')
+    for r in (a, b, same):
+        apply_fingerprint(r)
+    assert classify_match(a['fingerprint'], same['fingerprint'])[0] == 'exact_path'
+    assert classify_match(a['fingerprint'], b['fingerprint'])[0] == 'same_endpoints'
+
+
+def test_legacy_fingerprints_are_recomputed_on_index():
+    legacy = route('a', [12.97, 77.59], [12.99, 77.61], [[12.97, 77.59], [12.99, 77.61]])
+    legacy['fingerprint'] = {'path_hash': 'stale', 'source_cell': None, 'destination_cell': None}
+    assert not is_current(legacy['fingerprint'])
+
+    index = RouteIndex()
+    index.add('a', legacy)
+    assert is_current(legacy['fingerprint'])
+    assert set(FINGERPRINT_FIELDS) <= set(index.fingerprints['a'])
+
+    query = apply_fingerprint(route('q', [12.97, 77.59], [12.99, 77.61], []))
+    assert index.candidates(query) == {'a'}
@@ -0,0 +1,34 @@
+import ast
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Loaded only by the code paths that use them
+DEFERRED_MODULES = {'sharding', 'compute', 'memory', 'archive', 'journal', 'traffic', 'replay'}
+
+
+def module_level_imports(filename):
+    with open(os.path.join(BACKEND_DIR, filename)) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            names.add(node.module)
+    return names
+
+
+def test_server_modules_defer_optional_subsystems():
+    for filename in ('main.py', 'broadcast.py', 'trek.py', 'dbox.py'):
+        assert not module_level_imports(filename) & DEFERRED_MODULES, filename
+
+
+def test_replay_helpers_import_without_the_server():
+    loaded = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, replay; print(",".join(m for m in ("main", "flask") if m in sys.modules))'],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert loaded == ''
@@ -0,0 +1,77 @@
+from match_cache import MatchCache
+from matching import MatchQuery, results_for_requester
+
+SOURCE = {'lat': 12.9716, 'lng': 77.5946}
+DESTINATION = {'lat': 12.9352, 'lng': 77.6245}
+PATH = [[12.9716, 77.5946], [12.955, 77.61], [12.9352, 77.6245]]
+
+
+def test_cache_key_is_shared_between_users():
+    first = MatchQuery('alice', SOURCE, DESTINATION, PATH)
+    second = MatchQuery('bob', SOURCE, DESTINATION, PATH)
+    assert first.cache_key(10) == second.cache_key(10)
+    assert first.cache_key(10) != first.cache_key(20)
+
+
+def test_shared_query_matches_every_user():
+    query = MatchQuery(None, SOURCE, DESTINATION, PATH)
+    route = {'userID': 'alice', 'fingerprint': query.fingerprint}
+    assert query.evaluate(route)['match_type'] == 'exact_path'
+    assert MatchQuery('alice', SOURCE, DESTINATION, PATH).evaluate(route) is None
+
+
+def test_requester_routes_are_removed_from_shared_results():
+    shared = [{'routeId': i, 'userID': 'alice' if i % 2 else 'bob'} for i in range(6)]
+    assert [r['routeId'] for r in results_for_requester(shared, 'alice', 2, 10)] == [0, 2]
+    assert [r['routeId'] for r in results_for_requester(shared, 'carol', 2, 10)] == [0, 1]
+
+
+def test_truncated_shared_results_defer_to_a_requester_query():
+    shared = [{'routeId': i, 'userID': 'alice'} for i in range(4)] + [{'routeId': 4, 'userID': 'bob'}]
+    # Cut at its limit, the shared result may hide matches ranked below it
+    assert results_for_requester(shared, 'alice', 3, 5) is None
+    # A shorter result holds every match there is
+    assert len(results_for_requester(shared, 'alice', 3, 6)) == 1
+
+
+def test_invalidation_drops_entries_in_touched_zones():
+    cache = MatchCache()
+    cache.put('near', ['r1'], {'z1', 'z2'})
+    cache.put('far', ['r2'], {'z9'})
+    cache.invalidate_route({'fingerprint': {'source_zone': 'z2'}})
+    assert cache.get('near') is None
+    assert cache.get('far') == ['r2']
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MatchCache(max_entries=2)
+    cache.put('a', [], {'z'})
+    cache.put('b', [], {'z'})
+    cache.get('a')
+    cache.put('c', [], {'z'})
+    assert cache.get('b') is None
+    assert cache.get('a') == []
+
+
+def test_expired_entries_miss():
+    cache = MatchCache(ttl_seconds=-1)
+    cache.put('a', ['r'], {'z'})
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_results_computed_before_an_invalidation_are_not_cached():
+    cache = MatchCache()
+    generation = cache.generation()
+    cache.invalidate_route({'fingerprint': {'source_zone': 'z1'}})
+    assert not cache.put('near', ['r1'], {'z1'}, generation=generation)
+    assert cache.put('far', ['r2'], {'z9'}, generation=generation)
+    assert cache.put('near', ['r1', 'r3'], {'z1'}, generation=cache.generation())
+    assert cache.get('near') == ['r1', 'r3']
+
+
+def test_clear_rejects_results_computed_before_it():
+    cache = MatchCache()
+    generation = cache.generation()
+    cache.clear()
+    assert not cache.put('a', [], {'z1'}, generation=generation)
@@ -0,0 +1,21 @@
+from matching import DEFAULT_MATCH_LIMIT, MAX_MATCH_LIMIT, TopKMatches, parse_match_options
+
+
+def test_top_k_keeps_best_scores_then_newest():
+    top = TopKMatches(limit=3)
+    for i, score in enumerate([10, 80, 40, 80, 100, 5]):
+        top.push({'routeId': i, 'match_score': score, 'timestamp': f'2026-01-01T00:00:0{i}'})
+    assert [r['routeId'] for r in top.results()] == [4, 3, 1]
+
+
+def test_top_k_without_limit_keeps_everything():
+    top = TopKMatches()
+    for i in range(5):
+        top.push({'routeId': i, 'match_score': i})
+    assert [r['routeId'] for r in top.results()] == [4, 3, 2, 1, 0]
+
+
+def test_limit_defaults_and_is_capped():
+    assert parse_match_options({})[0] == DEFAULT_MATCH_LIMIT
+    assert parse_match_options({'k': 5})[0] == 5
+    assert parse_match_options({'limit': 10 ** 6})[0] == MAX_MATCH_LIMIT
@@ -0,0 +1,83 @@
+import sys
+
+import memory
+from memory import MemoryInspector, deep_size, measure
+
+
+class Slotted:
+    __slots__ = ('payload',)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def test_deep_size_counts_shared_objects_once():
+    payload = 'x' * 1000
+    assert deep_size([payload, payload]) == sys.getsizeof([payload, payload]) + sys.getsizeof(payload)
+    assert deep_size(Slotted(payload)) >= sys.getsizeof(payload)
+    assert deep_size({'a': [1, 2]}) > deep_size({'a': []})
+
+
+def test_deep_size_skips_shared_runtime_objects():
+    assert deep_size([len, sys]) == sys.getsizeof([len, sys])
+
+
+def test_measure_lists_the_largest_entries():
+    stats = measure({'small': 'x', 'big': 'y' * 10000})
+    assert stats['entries'] == 2 and not stats['estimated']
+    assert stats['largest'][0]['key'] == 'big'
+    assert measure([1, 2, 3])['entries'] == 3
+
+
+def test_large_structures_are_sampled(monkeypatch):
+    monkeypatch.setattr(memory, 'SAMPLE_ENTRIES', 10)
+    structure = {i: f'{i:0100d}' for i in range(100)}
+    stats = measure(structure)
+    assert stats['estimated'] and stats['entries'] == 100
+    exact = sum(deep_size(k) + deep_size(v) for k, v in structure.items()) + sys.getsizeof(structure)
+    assert abs(stats['bytes'] - exact) < exact * 0.1
+
+
+def test_trend_reports_growth_per_hour(monkeypatch):
+    clock = iter([0.0, 1800.0, 3600.0])
+    monkeypatch.setattr(memory.time, 'time', lambda: next(clock))
+    monkeypatch.setattr(memory, 'current_rss_bytes', lambda: None)
+    routes = {}
+    inspector = MemoryInspector()
+    inspector.register('routes', lambda: routes)
+    inspector.register('missing', lambda: None)
+    for i in range(3):
+        routes.update({(i, j): j for j in range(10)})
+        inspector.sample()
+
+    trend = inspector.trend()
+    assert trend['samples'] == 3
+    assert trend['rss_bytes_per_hour'] == 0
+    assert trend['structures']['routes']['entries_per_hour'] == 20.0
+    assert trend['structures']['routes']['bytes_change'] > 0
+    assert 'missing' not in trend['structures']
+
+
+def test_failing_getter_is_reported_not_raised():
+    inspector = MemoryInspector()
+    inspector.register('broken', lambda: 1 / 0)
+    assert 'error' in inspector.structures()['broken']
+    assert MemoryInspector().trend() == {'samples': 0}
+
+
+class Index:
+    def __init__(self, size):
+        self.by_id = {i: f'{i:0100d}' for i in range(size)}
+        self.order = [f'{i:050d}' for i in range(size)]
+
+
+def test_large_containers_inside_objects_are_sampled(monkeypatch):
+    monkeypatch.setattr(memory, 'SAMPLE_ENTRIES', 10)
+    index = Index(100)
+    stats = measure(index)
+    assert stats['estimated'] and stats['entries'] is None
+    exact = deep_size(index)
+    assert abs(stats['bytes'] - exact) < exact * 0.1
+    # Small structures are still counted exactly
+    small = Index(5)
+    assert measure(small) == {'entries': None, 'bytes': deep_size(small), 'estimated': False, 'largest': []}
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pymongo')
+from match_cache import MatchCache  # noqa: E402
+from matching import MatchQuery  # noqa: E402
+from replica import RouteReplica  # noqa: E402
+
+PATH = [[12.9716, 77.5946], [12.955, 77.61], [12.9352, 77.6245]]
+
+
+def hours_ago(hours):
+    return (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+
+
+def route(route_id, user_id, hours=0.0):
+    return {
+        '_id': route_id, 'userID': user_id, 'timestamp': hours_ago(hours),
+        'source': PATH[0], 'destination': PATH[-1], 'path': PATH, 'expires_at': 'x'
+    }
+
+
+class FakeCollection:
+    """Just enough of a pymongo collection for the replica"""
+
+    def __init__(self, documents):
+        self.documents = {document['_id']: document for document in documents}
+
+    def find(self, query, projection):
+        since = query['timestamp']['$gte']
+        return [
+            {field: value for field, value in document.items() if projection.get(field, 1)}
+            for document in self.documents.values() if document['timestamp'] >= since
+        ]
+
+
+class FakeStream:
+    alive = True
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def try_next(self):
+        return self.changes.pop(0)
+
+
+@pytest.fixture
+def replica():
+    collection = FakeCollection([route('a', 'u1'), route('b', 'u2', hours=1), route('old', 'u3', hours=30)])
+    replica = RouteReplica(collection, {'expires_at': 0}, window_hours=24)
+    replica._bootstrap()
+    return replica
+
+
+def test_bootstrap_loads_the_window(replica):
+    assert replica.ready
+    assert set(replica.routes.keys()) == {'a', 'b'}
+    assert 'expires_at' not in replica.routes['a']
+    assert [r['_id'] for r in replica.get_routes()] == ['a', 'b']
+    assert [r['_id'] for r in replica.get_routes(user_id='u2')] == ['b']
+    assert replica.covers(24) and not replica.covers(48)
+
+
+def test_change_stream_events_are_applied(replica):
+    updated = dict(route('b', 'u2'), path=PATH[:2])
+    replica._tail(FakeStream([
+        {'operationType': 'insert', 'fullDocument': route('c', 'u4')},
+        {'operationType': 'update', 'fullDocument': updated},
+        {'operationType': 'delete', 'documentKey': {'_id': 'a'}},
+        {'operationType': 'update', 'fullDocument': None, 'documentKey': {'_id': 'c'}},
+        {'operationType': 'invalidate'},
+    ]))
+    assert set(replica.routes.keys()) == {'b'}
+    assert replica.routes['b']['path'] == PATH[:2]
+    assert 'a' not in replica.route_index.fingerprints
+
+
+def test_reconcile_drops_deleted_routes(replica):
+    del replica.collection.documents['a']
+    replica._reconcile()
+    assert set(replica.routes.keys()) == {'b'}
+
+
+def test_aged_out_routes_are_not_applied(replica):
+    replica._apply(route('a', 'u1', hours=30))
+    assert 'a' not in replica.routes
+
+
+def test_matching_skips_the_requester_and_old_routes(replica):
+    query = MatchQuery('u1', PATH[0], PATH[-1], PATH)
+    assert [r['_id'] for r in replica.find_matching(query, 'u1')] == ['b']
+    assert replica.find_matching(query, 'u1', hours_back=0.5) == []
+    # A shared query matches every user
+    shared = MatchQuery(None, PATH[0], PATH[-1], PATH)
+    assert [r['_id'] for r in replica.find_matching(shared, None)] == ['a', 'b']
+
+
+def test_applied_and_removed_routes_invalidate_cached_matches(replica):
+    replica.match_cache = cache = MatchCache()
+    query = MatchQuery(None, PATH[0], PATH[-1], PATH)
+    cache.put('query', replica.find_matching(query, None), query.invalidation_zones())
+    replica._apply(route('c', 'u4'))
+    assert cache.get('query') is None
+
+    cache.put('query', replica.find_matching(query, None), query.invalidation_zones())
+    replica._remove('c')
+    assert cache.get('query') is None
+
+
+def test_excluded_routes_are_not_scored(replica):
+    shared = MatchQuery(None, PATH[0], PATH[-1], PATH)
+    replica.routes['a']['routeId'] = 'r-a'
+    assert [r['_id'] for r in replica.find_matching(shared, None, exclude={'r-a'})] == ['b']
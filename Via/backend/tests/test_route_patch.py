@@ -0,0 +1,35 @@
+import pytest
+
+from fingerprint import compute_fingerprint
+from validation import apply_route_patch, normalize_route_patch
+
+ROUTE = {'userID': 'u', 'source': [12.9, 77.6], 'destination': [13.0, 77.7],
+         'path': [[12.9, 77.6]], 'departure': {'start': '2026-10-19T08:00:00'}}
+
+
+def test_patch_sets_unsets_and_appends():
+    fields, unset, append_path = normalize_route_patch({
+        'destination': [13.1, 77.8], 'departure': None, 'append_path': [[13.1, 77.8]]
+    })
+    assert fields == {'destination': [13.1, 77.8]} and unset == ['departure']
+    updated = apply_route_patch(ROUTE, fields, unset, append_path)
+    assert updated['path'] == [[12.9, 77.6], [13.1, 77.8]]
+    assert 'departure' not in updated
+    # The original is left untouched
+    assert ROUTE['path'] == [[12.9, 77.6]] and 'departure' in ROUTE
+
+
+def test_patched_route_gets_a_matching_fingerprint():
+    fields, unset, append_path = normalize_route_patch({'destination': [13.1, 77.8]})
+    updated = apply_route_patch(ROUTE, fields, unset, append_path)
+    assert compute_fingerprint(updated)['destination_cell'] != compute_fingerprint(ROUTE)['destination_cell']
+
+
+@pytest.mark.parametrize('patch', [
+    {}, {'userID': 'someone-else'}, {'routeId': 'x'}, {'source': None},
+    {'path': [[12.9, 77.6]], 'append_path': [[13.0, 77.7]]},
+    {'destination': [91, 0]}, {'departure': {'start': 'later'}}, {'append_path': 'x'},
+])
+def test_invalid_patches_are_rejected(patch):
+    with pytest.raises(ValueError):
+        normalize_route_patch(patch)
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from fingerprint import apply_fingerprint
+from route_index import RouteIndex
+from state_store import ShardedStore
+
+
+def popular_route(i):
+    # Every route starts in the same zone, so they all share the busiest buckets
+    route = {'userID': i, 'source': [12.971, 77.591], 'destination': [12.99 + (i % 500) * 1e-3, 77.61],
+             'path': [[12.971, 77.591], [12.98, 77.60]]}
+    apply_fingerprint(route)
+    return route
+
+
+def seconds_per_add(index, start, count):
+    routes = [popular_route(i) for i in range(start, start + count)]
+    began = time.perf_counter()
+    for i, route in enumerate(routes, start):
+        index.add(i, route)
+    return (time.perf_counter() - began) / count
+
+
+def test_index_add_cost_does_not_grow_with_bucket_size():
+    index = RouteIndex()
+    small = seconds_per_add(index, 0, 1000)
+    seconds_per_add(index, 1000, 29000)
+    large = seconds_per_add(index, 30000, 1000)
+    # Copy-on-write buckets made this ratio about 30x at this size
+    assert large < small * 4
+    assert len(index.by_source_zone[index.fingerprints[0]['source_zone']]) == 31000
+
+
+def test_index_remove_drops_empty_buckets():
+    index = RouteIndex()
+    index.add('a', popular_route(1))
+    index.remove('a')
+    assert not index.by_source_zone and not index.by_path and not index.fingerprints
+
+
+def test_sharded_store_basic_mapping():
+    store = ShardedStore(shards=4)
+    store['a'] = 1
+    store['b'] = 2
+    assert store.get('a') == 1 and 'b' in store and len(store) == 2
+    assert store.update_item('a', lambda value: value + 10) == 11
+    assert store.update_item('missing', lambda value: None) is None
+    assert store.pop('b') == 2 and store.pop('b', 'gone') == 'gone'
+    assert store.snapshot() == {'a': 11}
+
+
+def test_sharded_store_iteration_during_writes():
+    store = ShardedStore(shards=4)
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            store[i % 5000] = i
+            store.pop((i + 2500) % 5000, None)
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(200):
+            try:
+                sum(1 for _ in store.items())
+            except RuntimeError as e:
+                errors.append(e)
+    finally:
+        stop.set()
+        thread.join()
+    assert not errors
+
+
+def test_sharded_store_write_cost_does_not_grow_with_size():
+    store = ShardedStore(shards=4)
+
+    def seconds_per_write(start, count):
+        began = time.perf_counter()
+        for i in range(start, start + count):
+            store[i] = i
+        return (time.perf_counter() - began) / count
+
+    small = seconds_per_write(0, 2000)
+    seconds_per_write(2000, 198000)
+    large = seconds_per_write(200000, 2000)
+    assert large < small * 4
@@ -0,0 +1,55 @@
+import gzip
+
+import pytest
+
+pytest.importorskip('flask')
+from werkzeug.test import EnvironBuilder  # noqa: E402
+from werkzeug.wrappers import Request  # noqa: E402
+
+from static_assets import StaticAssetCache  # noqa: E402
+
+SCRIPT = b'function main() { return 42; }\n' * 40
+
+
+@pytest.fixture
+def assets(tmp_path):
+    (tmp_path / 'consolidated-html.html').write_bytes(b'<html>' + b'x' * 500 + b'</html>')
+    (tmp_path / 'scripts').mkdir()
+    (tmp_path / 'scripts' / 'app.js').write_bytes(SCRIPT)
+    cache = StaticAssetCache(str(tmp_path))
+    cache.compress_all()
+    return cache
+
+
+def get(cache, path, headers=None):
+    return cache.response(path, Request(EnvironBuilder(headers=headers or {}).get_environ()))
+
+
+def test_index_is_served_for_the_root_and_must_revalidate(assets):
+    response = get(assets, '')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_gzip_variant_is_served_when_accepted(assets):
+    response = get(assets, 'scripts/app.js', {'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.get_data()) == SCRIPT
+    assert response.headers['Cache-Control'].startswith('public, max-age=')
+
+    plain = get(assets, 'scripts/app.js')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.get_data() == SCRIPT
+    assert plain.headers['ETag'] != response.headers['ETag']
+
+
+def test_matching_etag_returns_not_modified(assets):
+    etag = get(assets, 'scripts/app.js').headers['ETag']
+    response = get(assets, 'scripts/app.js', {'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+
+def test_unknown_paths_are_not_served(assets):
+    assert get(assets, 'missing.js') is None
+    assert get(assets, '../consolidated-html.html') is None
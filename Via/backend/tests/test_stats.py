@@ -0,0 +1,45 @@
+import threading
+import time
+
+from stats import StatsService
+
+
+class SlowStorage:
+    def __init__(self):
+        self.release = threading.Event()
+        self.stats_calls = 0
+
+    def get_route_stats(self):
+        self.stats_calls += 1
+        self.release.wait(5)
+        return True, {'total_routes': 7}
+
+    def test_connection(self):
+        return True, 'ok'
+
+
+def test_slow_stats_do_not_block_other_cached_values():
+    storage = SlowStorage()
+    service = StatsService(storage)
+    thread = threading.Thread(target=service.get_stats)
+    thread.start()
+    time.sleep(0.05)
+    began = time.monotonic()
+    assert service.database_status() == (True, 'ok')
+    assert time.monotonic() - began < 1
+    storage.release.set()
+    thread.join()
+
+
+def test_concurrent_callers_share_one_computation():
+    storage = SlowStorage()
+    service = StatsService(storage)
+    threads = [threading.Thread(target=service.get_stats) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    storage.release.set()
+    for thread in threads:
+        thread.join()
+    assert storage.stats_calls == 1
+    assert service.get_stats()['total_routes'] == 7
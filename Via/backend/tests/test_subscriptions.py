@@ -0,0 +1,44 @@
+import pytest
+
+from fingerprint import apply_fingerprint
+from matching import MatchQuery
+from subscriptions import SubscriptionRegistry
+from validation import parse_payload
+
+PATH = [[12.90, 77.60], [12.92, 77.60], [12.94, 77.60]]
+
+
+def route(user, sid, source, destination, path=()):
+    route_data = {'userID': user, 'socketId': sid, 'source': source,
+                  'destination': destination, 'path': list(path)}
+    apply_fingerprint(route_data)
+    return route_data
+
+
+def test_new_route_is_pushed_to_matching_subscribers_only():
+    registry = SubscriptionRegistry()
+    registry.subscribe('exact', MatchQuery('a', PATH[0], PATH[-1], PATH))
+    registry.subscribe('corridor', MatchQuery('b', PATH[0], PATH[-1], PATH, mode='corridor', buffer_m=300))
+    registry.subscribe('elsewhere', MatchQuery('c', [13.5, 78.0], [13.6, 78.1], []))
+
+    same_path = route('d', 'sid-d', PATH[0], PATH[-1], PATH)
+    assert {sid for sid, _ in registry.matches_for(same_path)} == {'exact', 'corridor'}
+
+    along = route('e', 'sid-e', [12.905, 77.60], [12.935, 77.60])
+    assert [sid for sid, _ in registry.matches_for(along)] == ['corridor']
+
+
+def test_own_socket_and_unsubscribed_queries_are_skipped():
+    registry = SubscriptionRegistry()
+    registry.subscribe('s1', MatchQuery('a', PATH[0], PATH[-1], PATH))
+    assert registry.matches_for(route('x', 's1', PATH[0], PATH[-1], PATH)) == []
+    registry.unsubscribe('s1')
+    assert len(registry) == 0
+    assert registry.matches_for(route('x', 's2', PATH[0], PATH[-1], PATH)) == []
+
+
+def test_parse_payload_decodes_strings_and_rejects_bad_json():
+    assert parse_payload('{"userID": "a"}') == {'userID': 'a'}
+    assert parse_payload({'userID': 'a'}) == {'userID': 'a'}
+    with pytest.raises(ValueError):
+        parse_payload('{not json')
@@ -0,0 +1,64 @@
+import pytest
+
+from tiles import DensityTiles, route_tiles, tile_coords
+
+ROUTE = {'source': [12.9716, 77.5946], 'destination': [12.9352, 77.6245],
+         'path': [[12.9716, 77.5946], [12.955, 77.61], [12.9352, 77.6245]]}
+
+
+def test_tile_coords_of_the_origin():
+    assert tile_coords(0.0, 0.0, 1) == (1.0, 1.0)
+    x, y = tile_coords(90.0, -180.0, 2)
+    assert x == 0.0 and y == pytest.approx(0.0, abs=1e-6)
+
+
+def test_route_tiles_cover_every_zoom_without_gaps():
+    tiles = route_tiles(ROUTE, max_zoom=12)
+    assert (0, 0, 0) in tiles
+    for zoom in range(13):
+        columns = sorted({x for z, x, _ in tiles if z == zoom})
+        assert columns == list(range(columns[0], columns[-1] + 1))
+    # A route without a path is drawn through its endpoints
+    no_path = route_tiles({'source': ROUTE['source'], 'destination': ROUTE['destination']}, max_zoom=12)
+    assert no_path & tiles
+
+
+def test_counts_follow_adds_and_removes():
+    tiles = DensityTiles(max_zoom=10)
+    tiles.add('a', ROUTE)
+    tiles.add('b', ROUTE)
+    tiles.add('a', ROUTE)  # replacing a route does not double count it
+    assert tiles.counts[(0, 0, 0)] == 2
+    tiles.remove('a')
+    tiles.remove('b')
+    assert tiles.counts == {} and len(tiles) == 0
+
+
+def test_tile_payload_lists_child_cells():
+    tiles = DensityTiles(max_zoom=10, detail=2)
+    tiles.add('a', ROUTE)
+    etag, payload = tiles.tile(0, 0, 0)
+    assert payload['routes'] == 1
+    assert payload['cells'] and all(0 <= dx < 4 and 0 <= dy < 4 and n == 1
+                                    for dx, dy, n in payload['cells'])
+    _, empty = tiles.tile(1, 0, 0)
+    assert empty['routes'] == 0 and empty['cells'] == []
+
+
+def test_etag_changes_only_when_the_tile_changes():
+    tiles = DensityTiles(max_zoom=10)
+    far_away = {'path': [[-33.86, 151.2], [-33.87, 151.21]]}
+    tiles.add('a', ROUTE)
+    etag, _ = tiles.tile(1, 1, 0)
+    tiles.add('b', far_away)
+    assert tiles.tile(1, 1, 0)[0] == etag
+    tiles.remove('a')
+    assert tiles.tile(1, 1, 0)[0] != etag
+
+
+def test_tiles_outside_the_served_range_are_rejected():
+    tiles = DensityTiles(max_zoom=10, detail=3)
+    with pytest.raises(ValueError):
+        tiles.tile(8, 0, 0)
+    with pytest.raises(ValueError):
+        tiles.tile(1, 2, 0)
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from fingerprint import apply_fingerprint
+from matching import MatchQuery
+from route_index import RouteIndex
+from timewindow import ANY_TIME_BUCKET, normalize_window, parse_window, time_buckets, windows_overlap
+
+SOURCE, DESTINATION = [12.97, 77.59], [12.99, 77.61]
+
+
+def test_window_parsing_defaults_and_caps():
+    start, end = parse_window({'start': '2026-10-19T08:00:00Z'})
+    assert (end - start).total_seconds() == 30 * 60
+    start, end = parse_window({'start': '2026-10-19T08:00:00', 'end': '2026-10-22T08:00:00'})
+    assert (end - start).total_seconds() == 24 * 3600
+    assert parse_window({'start': '2026-10-19T08:00:00', 'end': '2026-10-19T07:00:00'}) is None
+    assert normalize_window({'start': 'soon'}) is None
+
+
+def test_time_buckets_cover_the_window():
+    window = (datetime(2026, 10, 19, 8, 30), datetime(2026, 10, 19, 10, 0))
+    assert len(time_buckets(window)) == 3
+    assert time_buckets(None) == [ANY_TIME_BUCKET]
+
+
+def test_windows_overlap():
+    a = (datetime(2026, 1, 1, 8), datetime(2026, 1, 1, 9))
+    assert windows_overlap(a, (datetime(2026, 1, 1, 9), datetime(2026, 1, 1, 10)))
+    assert not windows_overlap(a, (datetime(2026, 1, 1, 10), datetime(2026, 1, 1, 11)))
+    assert windows_overlap(a, None)
+
+
+def test_match_candidates_filter_by_departure_per_route():
+    index = RouteIndex()
+    departures = {
+        'morning': {'start': '2026-10-19T08:00:00'},
+        'evening': {'start': '2026-10-19T18:00:00'},
+        'anytime': None,
+    }
+    for key, departure in departures.items():
+        route = {'userID': key, 'source': SOURCE, 'destination': DESTINATION, 'path': []}
+        if departure:
+            route['departure'] = departure
+        apply_fingerprint(route)
+        index.add(key, route)
+
+    query = MatchQuery('me', SOURCE, DESTINATION, [], departure={'start': '2026-10-19T08:10:00'})
+    assert index.match_candidates(query) == {'morning', 'anytime'}
+    assert index.match_candidates(MatchQuery('me', SOURCE, DESTINATION, [])) == set(departures)
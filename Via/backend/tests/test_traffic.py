@@ -0,0 +1,172 @@
+import json
+
+from ownership import ROUTE_TOKEN_HEADER, token_owner
+from replay import ReplayDriver, compare, percentile
+from traffic import REDACTED, TrafficRecorder, captured_headers, issued_values, read_capture
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    recorder = TrafficRecorder(path)
+    recorder.record('socket', 'send-route', {'userID': 'u1'}, sid='s1')
+    recorder.record('rest', 'get_routes', method='GET', path='/routes?limit=5')
+    recorder.close()
+
+    # A later capture to the same file appends to it
+    recorder = TrafficRecorder(path)
+    recorder.record('socket', 'disconnect', sid='s1')
+    recorder.close()
+
+    records = list(read_capture(path))
+    assert [r['event'] for r in records] == ['send-route', 'get_routes', 'disconnect']
+    assert records[0]['data'] == {'userID': 'u1'} and records[0]['sid'] == 's1'
+    assert records[1]['method'] == 'GET' and records[1]['path'] == '/routes?limit=5'
+    assert records[0]['t'] <= records[1]['t']
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile(values, 1.0) == 100
+    assert percentile([], 0.5) == 0.0
+
+
+def test_compare_reports_percentage_change():
+    baseline = {'throughput_per_s': 100.0, 'by_event': {'rest:a': {'p50_ms': 2.0, 'p95_ms': 4.0, 'p99_ms': 0}}}
+    report = {'throughput_per_s': 150.0, 'by_event': {
+        'rest:a': {'p50_ms': 1.0, 'p95_ms': 5.0, 'p99_ms': 1.0},
+        'rest:new': {'p50_ms': 1.0, 'p95_ms': 1.0, 'p99_ms': 1.0}
+    }}
+    assert compare(report, baseline) == {
+        'throughput_per_s': 50.0,
+        'rest:a': {'p50_ms': -50.0, 'p95_ms': 25.0, 'p99_ms': None}
+    }
+
+
+def test_capture_keeps_route_headers_and_redacts_credentials():
+    headers = {ROUTE_TOKEN_HEADER: 'tok', 'Authorization': 'secret', 'Cookie': 'c'}
+    assert captured_headers(headers) == {ROUTE_TOKEN_HEADER: 'tok', 'Authorization': REDACTED}
+    assert issued_values({'data': {'routeId': 'o:1'}, 'routeToken': 'tok'}) == {'routeId': 'o:1', 'routeToken': 'tok'}
+    assert issued_values(None) == {}
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+
+    def get_json(self, silent=False):
+        return self.body
+
+
+class FakeHttp:
+    def __init__(self):
+        self.requests = []
+        self.sent = []
+
+    def open(self, path, method, data, content_type, headers=None):
+        self.requests.append((method, path))
+        self.sent.append((path, data, headers))
+        if path == '/broken':
+            return FakeResponse(500)
+        if path == '/missing':
+            return FakeResponse(404)
+        if path == '/routes' and method == 'POST':
+            return FakeResponse(201, {'data': {'routeId': f"{token_owner('new-token')}:new"},
+                                      'routeToken': 'new-token'})
+        return FakeResponse(200)
+
+
+class FakeSocket:
+    def __init__(self):
+        self.emitted = []
+        self.connected = True
+
+    def emit(self, event, data=None):
+        self.emitted.append((event, data))
+
+    def get_received(self):
+        return []
+
+    def is_connected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.clients = []
+
+    def test_client(self, app, flask_test_client=None):
+        self.clients.append(FakeSocket())
+        return self.clients[-1]
+
+
+class FakeServer:
+    def __init__(self):
+        self.http = FakeHttp()
+        self.socketio = FakeSocketIO()
+        self.app = self
+
+    def test_client(self):
+        return self.http
+
+
+def test_replay_sends_each_record_and_reports_errors():
+    server = FakeServer()
+    records = [
+        {'t': 0.0, 'kind': 'socket', 'event': 'connect', 'sid': 's1'},
+        {'t': 0.1, 'kind': 'socket', 'event': 'send-route', 'sid': 's1', 'data': {'userID': 'u1'}},
+        {'t': 0.2, 'kind': 'rest', 'event': 'get_routes', 'path': '/routes'},
+        {'t': 0.3, 'kind': 'rest', 'event': 'broken', 'path': '/broken', 'method': 'POST'},
+        {'t': 0.4, 'kind': 'socket', 'event': 'disconnect', 'sid': 's1'},
+    ]
+    report = ReplayDriver(server, speed=0).run(records)
+
+    assert report['events'] == 5
+    assert server.http.requests == [('GET', '/routes'), ('POST', '/broken')]
+    socket, = server.socketio.clients
+    assert socket.emitted == [('send-route', {'userID': 'u1'})]
+    assert not socket.connected
+    assert report['by_event']['rest:broken']['errors'] == 1
+    assert report['by_event']['rest:get_routes']['count'] == 1
+    assert report['by_event']['rest:get_routes']['errors'] == 0
+
+
+def test_replay_maps_issued_ids_and_tokens_to_the_replayed_ones():
+    server = FakeServer()
+    old_owner = token_owner('old-token')
+    records = [
+        {'t': 0.0, 'kind': 'rest', 'event': 'create_route', 'path': '/routes', 'method': 'POST',
+         'status': 201, 'issued': {'routeId': f'{old_owner}:old', 'routeToken': 'old-token'}},
+        {'t': 0.1, 'kind': 'rest', 'event': 'update_route', 'path': f'/routes/{old_owner}:old',
+         'method': 'PUT', 'status': 200, 'data': json.dumps({'routeId': f'{old_owner}:client'}),
+         'headers': {ROUTE_TOKEN_HEADER: 'old-token', 'Authorization': REDACTED}},
+    ]
+    report = ReplayDriver(server, speed=0, admin_key='key').run(records)
+
+    new_owner = token_owner('new-token')
+    path, data, headers = server.http.sent[1]
+    assert path == f'/routes/{new_owner}:new'
+    assert json.loads(data) == {'routeId': f'{new_owner}:client'}
+    assert headers == {ROUTE_TOKEN_HEADER: 'new-token', 'Authorization': 'key'}
+    assert all(stats['errors'] == 0 for stats in report['by_event'].values())
+
+
+def test_status_differing_from_the_recording_is_an_error():
+    server = FakeServer()
+    records = [
+        {'t': 0.0, 'kind': 'rest', 'event': 'missing', 'path': '/missing', 'status': 200},
+        {'t': 0.1, 'kind': 'rest', 'event': 'gone', 'path': '/missing', 'status': 404},
+        {'t': 0.2, 'kind': 'rest', 'event': 'admin', 'path': '/admin', 'status': 200,
+         'headers': {'Authorization': REDACTED}},
+    ]
+    report = ReplayDriver(server, speed=0).run(records)
+
+    assert report['by_event']['rest:missing']['errors'] == 1
+    assert report['by_event']['rest:gone']['errors'] == 0
+    # Without an admin key the redacted credential is not sent
+    assert server.http.sent[2][2] == {}
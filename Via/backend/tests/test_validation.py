@@ -0,0 +1,62 @@
+import pytest
+
+import validation
+from validation import normalize_route, normalize_route_patch, validate_batch
+
+LONG_PATH = [{'lat': str(12.9 + i * 1e-4), 'lng': 77.6 + i * 1e-4} for i in range(100)]
+
+
+def route(**overrides):
+    route_data = {
+        'userID': 'u1',
+        'source': [12.9, 77.6],
+        'destination': [13.0, 77.7],
+        'path': [{'lat': 12.9, 'lng': 77.6}, ['12.95', '77.65'], (13.0, 77.7, 5)],
+    }
+    route_data.update(overrides)
+    return route_data
+
+
+def test_route_path_is_stored_parsed():
+    route_data = route()
+    assert normalize_route(route_data) is None
+    assert route_data['path'] == [[12.9, 77.6], [12.95, 77.65], [13.0, 77.7]]
+
+
+@pytest.mark.parametrize('numpy_available', [True, False])
+def test_long_paths_are_stored_parsed(monkeypatch, numpy_available):
+    if numpy_available:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(validation, '_load_numpy', lambda: False)
+    route_data = route(path=[[float(p['lat']), p['lng']] for p in LONG_PATH])
+    assert normalize_route(route_data) is None
+    assert route_data['path'][0] == [12.9, 77.6]
+    assert all(type(value) is float for point in route_data['path'] for value in point)
+
+
+@pytest.mark.parametrize('numpy_available', [True, False])
+def test_batch_paths_are_stored_parsed(monkeypatch, numpy_available):
+    if numpy_available:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(validation, '_load_numpy', lambda: False)
+    items = [route(userID=f'u{i}', path=[[12.9 + i, 77.6, 0.0], [12.95, 77.65, 0.0]] * 20)
+             for i in range(5)]
+    valid, errors = validate_batch(items)
+    assert not errors
+    assert [r['path'][0] for r in valid] == [[12.9 + i, 77.6] for i in range(5)]
+    assert all(len(r['path']) == 40 for r in valid)
+
+
+def test_patch_paths_are_stored_parsed():
+    fields, _, append_path = normalize_route_patch({'path': [['12.9', '77.6']]})
+    assert fields['path'] == [[12.9, 77.6]]
+    _, _, append_path = normalize_route_patch({'append_path': [{'lat': 13, 'lng': 77}]})
+    assert append_path == [[13.0, 77.0]]
+
+
+def test_invalid_paths_are_rejected():
+    assert normalize_route(route(path=[[12.9, 181.0]])) == 'Invalid path: malformed or out-of-range point'
+    with pytest.raises(ValueError):
+        normalize_route_patch({'append_path': [[91.0, 0.0]]})
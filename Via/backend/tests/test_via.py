@@ -0,0 +1,34 @@
+from fingerprint import apply_fingerprint
+from matching import SHARED_VIA_SCORE, VIA_POINT_BONUS, MatchQuery
+from validation import normalize_via
+
+
+def candidate(user, via, path=()):
+    route = {'userID': user, 'source': [12.80, 77.50], 'destination': [12.99, 77.70],
+             'via': via, 'path': list(path)}
+    apply_fingerprint(route)
+    return route
+
+
+def test_shared_via_point_matches_and_scores_per_point():
+    query = MatchQuery('me', [13.10, 77.40], [13.20, 77.80], [], via=[[12.90, 77.60], [12.95, 77.65]])
+    one = query.evaluate(candidate('a', [[12.9005, 77.6005]]))
+    both = query.evaluate(candidate('b', [[12.9005, 77.6005], [12.9502, 77.6498]]))
+    assert one['match_type'] == 'shared_via' and one['via_matches'] == 1
+    assert both['match_score'] == SHARED_VIA_SCORE + 2 * VIA_POINT_BONUS
+
+
+def test_via_points_on_the_path_count_too():
+    query = MatchQuery('me', [13.10, 77.40], [13.20, 77.80], [], via=[[12.90, 77.60]])
+    match = query.evaluate(candidate('a', [], path=[[12.80, 77.50], [12.9001, 77.6001]]))
+    assert match['via_matches'] == 1
+
+
+def test_distant_via_points_do_not_match():
+    query = MatchQuery('me', [13.10, 77.40], [13.20, 77.80], [], via=[[12.90, 77.60]])
+    assert query.evaluate(candidate('a', [[12.92, 77.60]])) is None
+
+
+def test_normalize_via_drops_bad_points():
+    assert normalize_via([[12.9, 77.6], ['x', 1], [95, 10], [1]]) == [[12.9, 77.6]]
+    assert normalize_via('nope') == []
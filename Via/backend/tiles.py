@@ -0,0 +1,170 @@
+"""
+Route-density counts per web-mercator tile, maintained as routes come and go
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from geo import to_path, to_point
+
+MAX_ZOOM = 16
+# A served tile is a 2**TILE_DETAIL x 2**TILE_DETAIL grid of child-tile counts
+TILE_DETAIL = 3
+MAX_TILE_ZOOM = MAX_ZOOM - TILE_DETAIL
+# Caps the segment densification of a single very long route
+MAX_SAMPLES_PER_ROUTE = 4096
+TILE_CACHE_SIZE = 4096
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def tile_coords(lat, lng, zoom):
+    """Fractional web-mercator tile coordinates (x, y) of a point at zoom"""
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    n = 2 ** zoom
+    x = (lng + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def route_points(route_data):
+    """The route's path, or source -> via -> destination when it has none"""
+    path = to_path(route_data.get('path'))
+    if len(path) >= 2:
+        return path
+    points = [to_point(route_data.get('source'))]
+    points.extend(to_point(via_point) for via_point in route_data.get('via') or ())
+    points.append(to_point(route_data.get('destination')))
+    return [point for point in points if point is not None]
+
+
+def route_tiles(route_data, max_zoom=MAX_ZOOM):
+    """Every (z, x, y) tile from zoom 0 to max_zoom that the route passes through"""
+    n = 2 ** max_zoom
+    coords = [tile_coords(lat, lng, max_zoom) for lat, lng in route_points(route_data)]
+    cells = set()
+    budget = MAX_SAMPLES_PER_ROUTE
+    previous = None
+    for x, y in coords:
+        if previous is None:
+            cells.add((int(x), int(y)))
+        else:
+            # Step at most one max-zoom tile at a time so segments leave no gaps
+            px, py = previous
+            steps = max(1, min(budget, math.ceil(max(abs(x - px), abs(y - py)))))
+            budget -= steps
+            for step in range(1, steps + 1):
+                t = step / steps
+                cells.add((int(px + (x - px) * t), int(py + (y - py) * t)))
+        previous = (x, y)
+
+    tiles = set()
+    for cx, cy in cells:
+        cx, cy = min(max(cx, 0), n - 1), min(max(cy, 0), n - 1)
+        for zoom in range(max_zoom + 1):
+            shift = max_zoom - zoom
+            tiles.add((zoom, cx >> shift, cy >> shift))
+    return frozenset(tiles)
+
+
+class DensityTiles:
+    """Number of active routes touching each tile, updated per route add/remove
+
+    Each tile records the clock value of its last change; because a route
+    touching a child tile also touches its parent, a served tile is
+    unchanged exactly while its own version is, which keys both the
+    rendered-tile cache and the HTTP ETag.
+    """
+
+    def __init__(self, max_zoom=MAX_ZOOM, detail=TILE_DETAIL, cache_size=TILE_CACHE_SIZE):
+        self.max_zoom = max_zoom
+        self.detail = detail
+        self.cache_size = cache_size
+        # Versions restart with the process, so ETags carry the start time
+        self.epoch = int(time.time())
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._cache = OrderedDict()
+        self._reset()
+
+    def _reset(self):
+        self.counts = {}
+        self.versions = {}
+        self._route_tiles = {}
+
+    def __len__(self):
+        return len(self._route_tiles)
+
+    def add(self, key, route_data):
+        """Count a route under key, replacing any previous version of it"""
+        tiles = route_tiles(route_data, self.max_zoom)
+        with self._lock:
+            self._remove_locked(key)
+            self._clock += 1
+            for tile in tiles:
+                self.counts[tile] = self.counts.get(tile, 0) + 1
+                self.versions[tile] = self._clock
+            self._route_tiles[key] = tiles
+
+    def remove(self, key):
+        with self._lock:
+            self._remove_locked(key)
+
+    def _remove_locked(self, key):
+        tiles = self._route_tiles.pop(key, None)
+        if not tiles:
+            return
+        self._clock += 1
+        for tile in tiles:
+            count = self.counts.get(tile, 0) - 1
+            if count > 0:
+                self.counts[tile] = count
+            else:
+                self.counts.pop(tile, None)
+            self.versions[tile] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._reset()
+            self._cache.clear()
+
+    def tile(self, z, x, y):
+        """Return (etag, payload) for tile z/x/y
+
+        The payload lists non-empty child cells as [dx, dy, routes] at zoom
+        z + detail. Raises ValueError for tiles outside the served range.
+        """
+        if not 0 <= z <= self.max_zoom - self.detail or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f'Tile must be within zoom 0-{self.max_zoom - self.detail}')
+        key = (z, x, y)
+        with self._lock:
+            version = self.versions.get(key, 0)
+            etag = f'{self.epoch}-{version}'
+            cached = self._cache.get(key)
+            if cached and cached[0] == etag:
+                self._cache.move_to_end(key)
+                return cached
+
+            cells = []
+            if self.counts.get(key):
+                size = 2 ** self.detail
+                child_zoom = z + self.detail
+                for dy in range(size):
+                    for dx in range(size):
+                        count = self.counts.get((child_zoom, x * size + dx, y * size + dy))
+                        if count:
+                            cells.append([dx, dy, count])
+            payload = {
+                'z': z,
+                'x': x,
+                'y': y,
+                'routes': self.counts.get(key, 0),
+                'detail': self.detail,
+                'cells': cells
+            }
+            entry = (etag, payload)
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return entry
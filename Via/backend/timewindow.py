@@ -0,0 +1,65 @@
+"""
+Departure windows and the time buckets used to index them
+"""
+from datetime import datetime, timedelta, timezone
+
+TIME_BUCKET_MINUTES = 60
+DEFAULT_WINDOW_MINUTES = 30
+MAX_WINDOW_HOURS = 24
+# Bucket stored for routes without a departure window; they match any time
+ANY_TIME_BUCKET = -1
+
+
+def _parse_time(value):
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str) and value:
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    else:
+        return None
+    # Timestamps elsewhere in the server are naive UTC
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_window(value):
+    """Parse a {'start', 'end'} departure window into a (start, end) datetime pair"""
+    if not isinstance(value, dict):
+        return None
+    start = _parse_time(value.get('start'))
+    if start is None:
+        return None
+    end = _parse_time(value.get('end')) or start + timedelta(minutes=DEFAULT_WINDOW_MINUTES)
+    if end < start:
+        return None
+    return start, min(end, start + timedelta(hours=MAX_WINDOW_HOURS))
+
+
+def normalize_window(value):
+    """Return a departure window as ISO strings, or None if it is invalid"""
+    window = parse_window(value)
+    if window is None:
+        return None
+    return {'start': window[0].isoformat(), 'end': window[1].isoformat()}
+
+
+def time_buckets(window):
+    """Return the bucket numbers a window overlaps"""
+    if window is None:
+        return [ANY_TIME_BUCKET]
+    bucket_seconds = TIME_BUCKET_MINUTES * 60
+    epoch = datetime(1970, 1, 1)
+    first = int((window[0] - epoch).total_seconds() // bucket_seconds)
+    last = int((window[1] - epoch).total_seconds() // bucket_seconds)
+    return list(range(first, last + 1))
+
+
+def windows_overlap(a, b):
+    """Check whether two (start, end) windows overlap; missing windows always do"""
+    if a is None or b is None:
+        return True
+    return a[0] <= b[1] and b[0] <= a[1]
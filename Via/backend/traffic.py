@@ -0,0 +1,107 @@
+"""
+Opt-in capture of inbound socket events and REST calls for later replay
+"""
+import gzip
+import json
+import logging
+import queue
+import threading
+import time
+
+from ownership import ROUTE_TOKEN_HEADER
+
+# Records are dropped rather than slowing request handling when the writer falls behind
+CAPTURE_QUEUE_SIZE = 100000
+# Request headers a replay needs; credentials in REDACTED_HEADERS are replaced
+# by the replaying server's own
+CAPTURED_HEADERS = (ROUTE_TOKEN_HEADER, 'Authorization')
+REDACTED_HEADERS = ('Authorization',)
+REDACTED = '<redacted>'
+
+
+def captured_headers(headers):
+    """The request headers to keep in a capture, with credentials redacted"""
+    return {
+        name: REDACTED if name in REDACTED_HEADERS else headers[name]
+        for name in CAPTURED_HEADERS if name in headers
+    }
+
+
+def issued_values(body):
+    """Server-generated values in a response that later requests refer back to
+
+    A replayed server issues different ones, so the replay maps each
+    recorded value to the one issued in its place.
+    """
+    if not isinstance(body, dict):
+        return {}
+    values = {}
+    if body.get('routeToken'):
+        values['routeToken'] = body['routeToken']
+    data = body.get('data')
+    if isinstance(data, dict) and data.get('routeId'):
+        values['routeId'] = data['routeId']
+    return values
+
+
+class TrafficRecorder:
+    """Appends timed inbound traffic to a gzip-compressed JSON-lines log
+
+    Each record is {'t': seconds since capture start, 'kind': 'socket' or
+    'rest', 'event': ..., 'sid': ..., 'data': ...}; REST records also keep
+    the method, path, headers, response status and issued values. Handlers
+    only enqueue; a writer thread does the encoding and compression.
+    """
+
+    def __init__(self, path, queue_size=CAPTURE_QUEUE_SIZE):
+        self.path = path
+        self.recorded = 0
+        self.dropped = 0
+        self._started = time.monotonic()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._thread = threading.Thread(target=self._write_loop, name='traffic-recorder', daemon=True)
+        self._thread.start()
+        logging.info(f"🎙️ Capturing traffic to {path}")
+
+    def record(self, kind, event, data=None, sid=None, at=None, **extra):
+        """Queue a record; at is the time.monotonic() the request arrived, default now"""
+        entry = {
+            't': round((time.monotonic() if at is None else at) - self._started, 4),
+            'kind': kind,
+            'event': event,
+            'sid': sid,
+            'data': data
+        }
+        entry.update(extra)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            try:
+                self._file.write(json.dumps(entry, separators=(',', ':'), default=str))
+                self._file.write('\n')
+                self.recorded += 1
+            except Exception as e:
+                logging.error(f"❌ Error writing traffic capture: {e}")
+        self._file.close()
+
+    def close(self):
+        """Flush queued records and close the log"""
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        logging.info(f"🎙️ Traffic capture closed: {self.recorded} records, {self.dropped} dropped")
+
+
+def read_capture(path):
+    """Yield the records of a capture log in order"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
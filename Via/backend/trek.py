@@ -1,16 +1,40 @@
 import logging
+import time
+import uuid
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify
+
+from matching import (
+    SHARED_RESULT_MARGIN, MatchQuery, merge_matches, parse_match_options, results_for_requester
+)
+from ownership import ROUTE_TOKEN_HEADER, new_route_token, owns_route, scoped_route_id, token_owner
+from stats import StatsService
+from validation import normalize_route, normalize_route_patch, parse_bulk_body
+
+# Tiles change as routes come and go; clients revalidate by ETag after this
+DENSITY_TILE_MAX_AGE = 10
 
 class RouteHandler:
-    def __init__(self, storage_handler=None, broadcast_handler=None):
+    def __init__(self, storage_handler=None, broadcast_handler=None, stats_service=None,
+                 match_cache=None, recorder=None, memory_inspector=None,
+                 admin_key='admin-secret-key', compute_pool=None):
         self.storage_handler = storage_handler
         self.broadcast_handler = broadcast_handler
+        self.match_cache = match_cache
+        # Optional ComputePool for fingerprinting long query paths
+        self.compute_pool = compute_pool
+        # Optional TrafficRecorder capturing REST calls for replay
+        self.recorder = recorder
+        self.memory_inspector = memory_inspector
+        self.admin_key = admin_key
+        self.stats_service = stats_service or StatsService(storage_handler, broadcast_handler)
         self.blueprint = self.create_blueprint()
     
     def create_blueprint(self):
         """Create Flask blueprint with all route endpoints"""
         bp = Blueprint('routes', __name__)
+        bp.before_request(self._mark_request)
+        bp.after_request(self._record_request)
         
         # Register all route endpoints
         bp.add_url_rule('/find-matching-routes', 'find_matching_routes', 
@@ -23,9 +47,54 @@ class RouteHandler:
                        self.clean_routes, methods=['POST'])
         bp.add_url_rule('/health', 'health_check', 
                        self.health_check, methods=['GET'])
+        bp.add_url_rule('/routes', 'create_route', 
+                       self.create_route, methods=['POST'])
+        bp.add_url_rule('/routes/bulk', 'bulk_create_routes', 
+                       self.bulk_create_routes, methods=['POST'])
+        bp.add_url_rule('/routes/stats', 'get_route_stats', 
+                       self.get_route_stats, methods=['GET'])
+        bp.add_url_rule('/routes/archive', 'query_route_archive', 
+                       self.query_route_archive, methods=['GET'])
+        bp.add_url_rule('/routes/<route_id>', 'update_route', 
+                       self.update_route, methods=['PATCH', 'PUT'])
+        bp.add_url_rule('/routes/<route_id>', 'delete_route', 
+                       self.delete_route, methods=['DELETE'])
+        bp.add_url_rule('/tiles/density/<int:z>/<int:x>/<int:y>', 'get_density_tile', 
+                       self.get_density_tile, methods=['GET'])
+        bp.add_url_rule('/admin/memory', 'get_memory_report', 
+                       self.get_memory_report, methods=['GET'])
         
         return bp
     
+    def _mark_request(self):
+        """Note when a REST call arrived, so the capture keeps its timing"""
+        if self.recorder:
+            g.received_at = time.monotonic()
+    
+    def _record_request(self, response):
+        """Capture a REST call and its outcome when traffic recording is on"""
+        if self.recorder:
+            from traffic import captured_headers, issued_values
+            extra = {}
+            headers = captured_headers(request.headers)
+            if headers:
+                extra['headers'] = headers
+            issued = issued_values(response.get_json(silent=True)) if response.is_json else {}
+            if issued:
+                extra['issued'] = issued
+            # cache=True kept the body readable by the endpoint
+            self.recorder.record(
+                'rest', request.endpoint,
+                request.get_data(cache=True, as_text=True) or None,
+                at=g.get('received_at'),
+                method=request.method,
+                path=request.full_path if request.query_string else request.path,
+                content_type=request.content_type,
+                status=response.status_code,
+                **extra
+            )
+        return response
+    
     def find_matching_routes(self):
         """Find matching routes for a user"""
         try:
@@ -41,22 +110,48 @@ class RouteHandler:
             if not user_id or not path:
                 return jsonify({'message': '❌ Invalid request parameters'}), 400
 
-            # Try to get matching routes from storage
-            matching_routes = []
-            if self.storage_handler:
-                success, routes = self.storage_handler.find_matching_routes(
-                    user_id, source, destination, path
-                )
-                if success:
-                    matching_routes = routes
-                else:
-                    logging.warning(f"⚠️ Storage unavailable, using fallback: {routes}")
-            
-            # Fallback to in-memory routes if storage fails
-            if not matching_routes and self.broadcast_handler:
-                matching_routes = self.broadcast_handler.get_fallback_matching_routes(
-                    user_id, source, destination, path
-                )
+            try:
+                limit, match_options = parse_match_options(data)
+            except ValueError as e:
+                return jsonify({'message': f'❌ {e}'}), 400
+
+            # Nearby users asking the same question share one computed result;
+            # each requester's own routes are removed from it afterwards
+            fingerprint = None
+            if self.compute_pool:
+                fingerprint = self.compute_pool.fingerprint_route({
+                    'source': source, 'destination': destination, 'path': path
+                })
+            shared_limit = limit + SHARED_RESULT_MARGIN
+            shared_query = MatchQuery(None, source, destination, path,
+                                      fingerprint=fingerprint, **match_options)
+            cache_key = shared_query.cache_key(shared_limit)
+            if self.match_cache is not None:
+                cached_routes = self.match_cache.get(cache_key)
+                if cached_routes is not None:
+                    matching_routes = results_for_requester(cached_routes, user_id, limit, shared_limit)
+                    if matching_routes is not None:
+                        return jsonify({
+                            'message': '✅ Matching routes found' if matching_routes else '⚠️ No matching routes found',
+                            'data': matching_routes,
+                            'count': len(matching_routes),
+                            'cached': True
+                        }), 200
+
+            # Routes written while this runs invalidate the result before it is cached
+            generation = self.match_cache.generation() if self.match_cache is not None else None
+            shared_routes, cacheable = self._compute_matches(source, destination, path,
+                                                             shared_limit, shared_query)
+            if self.match_cache is not None and cacheable:
+                self.match_cache.put(cache_key, shared_routes, shared_query.invalidation_zones(),
+                                     generation=generation)
+
+            matching_routes = results_for_requester(shared_routes, user_id, limit, shared_limit)
+            if matching_routes is None:
+                # The requester owns many of the best matches; rank past them
+                query = MatchQuery(user_id, source, destination, path,
+                                   fingerprint=fingerprint, **match_options)
+                matching_routes, _ = self._compute_matches(source, destination, path, limit, query)
 
             return jsonify({
                 'message': '✅ Matching routes found' if matching_routes else '⚠️ No matching routes found',
@@ -68,6 +163,46 @@ class RouteHandler:
             logging.error(f"❌ Error in find-matching-routes: {e}")
             return jsonify({'message': 'Failed to process routes'}), 500
     
+    def _compute_matches(self, source, destination, path, limit, query):
+        """Best matches for query, and whether the result may be cached"""
+        # In sharded mode this node's routes are scored in parallel by the
+        # shard workers its path touches; storage scores only other nodes'
+        # routes, and both are ranked together
+        result_lists = []
+        local_routes = None
+        sharded = self.broadcast_handler is not None and self.broadcast_handler.shards_available()
+        if sharded:
+            local_routes = self.broadcast_handler.active_routes
+            result_lists.append(self.broadcast_handler.get_fallback_matching_routes(
+                query.user_id, source, destination, path,
+                limit=limit, query=query
+            ))
+        
+        # Try to get matching routes from storage
+        storage_ok = False
+        if self.storage_handler:
+            success, routes = self.storage_handler.find_matching_routes(
+                query.user_id, source, destination, path,
+                limit=limit, query=query, exclude=local_routes
+            )
+            if success:
+                result_lists.append(routes)
+                storage_ok = True
+            else:
+                logging.warning(f"⚠️ Storage unavailable, using fallback: {routes}")
+        
+        # Fallback to in-memory routes if storage fails or has nothing yet
+        if not any(result_lists) and self.broadcast_handler and not sharded:
+            result_lists.append(self.broadcast_handler.get_fallback_matching_routes(
+                query.user_id, source, destination, path,
+                limit=limit, query=query
+            ))
+        
+        # Without storage the result lacks other nodes' routes, so recovery
+        # must be picked up at once rather than after the cache TTL
+        cacheable = storage_ok or not self.storage_handler
+        return merge_matches(result_lists, limit), cacheable
+    
     def get_routes(self):
         """Get routes with optional filtering"""
         try:
@@ -133,13 +268,14 @@ class RouteHandler:
         """Admin endpoint to clean up old or invalid routes"""
         try:
             auth_key = request.headers.get('Authorization')
-            if auth_key != 'admin-secret-key':
+            if auth_key != self.admin_key:
                 return jsonify({'message': 'Unauthorized'}), 401
             
             # Try to clean routes from storage
             if self.storage_handler:
                 success, result = self.storage_handler.clean_invalid_routes()
                 if success:
+                    self.stats_service.invalidate()
                     return jsonify({
                         'message': '✅ Routes cleaned successfully',
                         **result
@@ -167,7 +303,7 @@ class RouteHandler:
             # Test storage connection
             db_status = "not_configured"
             if self.storage_handler:
-                connected, message = self.storage_handler.test_connection()
+                connected, message = self.stats_service.database_status()
                 if connected:
                     db_status = "connected"
                 else:
@@ -195,6 +331,28 @@ class RouteHandler:
                 'timestamp': datetime.utcnow().isoformat()
             }), 500
     
+    def _route_token(self):
+        """The caller's route token and whether it was just issued"""
+        token = request.headers.get(ROUTE_TOKEN_HEADER)
+        if token:
+            return token, False
+        return new_route_token(), True
+    
+    def _check_route_owner(self, route_id):
+        """None when the caller may change route_id, else an error response
+        
+        Only the route token the route was created with (or the admin key)
+        grants access; routes created over a socket cannot be changed here.
+        """
+        if request.headers.get('Authorization') == self.admin_key:
+            return None
+        token = request.headers.get(ROUTE_TOKEN_HEADER)
+        if not token:
+            return jsonify({'message': 'Unauthorized'}), 401
+        if not owns_route(token_owner(token), route_id):
+            return jsonify({'message': 'Forbidden'}), 403
+        return None
+    
     def create_route(self):
         """Create a new route (POST /routes)"""
         try:
@@ -206,55 +364,114 @@ class RouteHandler:
             if not all(field in data for field in required_fields):
                 return jsonify({'message': '❌ Missing required fields'}), 400
             
-            # Add timestamp
-            data['timestamp'] = datetime.utcnow().isoformat()
+            # The routeId is generated here and scoped to the caller's token,
+            # which later PATCH/DELETE calls must present
+            token, issued = self._route_token()
+            owner = token_owner(token)
+            data['routeId'] = uuid.uuid4().hex
             
-            # Save to storage if available
-            if self.storage_handler:
-                success, message = self.storage_handler.save_route(data)
+            # Activate, store and broadcast through the shared ingest path
+            if self.broadcast_handler:
+                result = self.broadcast_handler.ingest_routes([data], owner)
+                if not result['accepted']:
+                    return jsonify({'message': f"❌ {result['errors'][0]['message']}"}), 400
+            elif self.storage_handler:
+                error = normalize_route(data)
+                if error:
+                    return jsonify({'message': f'❌ {error}'}), 400
+                data['routeId'] = scoped_route_id(owner, data['routeId'])
+                data['timestamp'] = datetime.utcnow().isoformat()
+                success, message = self.storage_handler.save_routes([data])
                 if not success:
                     logging.warning(f"⚠️ Storage save failed: {message}")
             
-            # Broadcast to connected clients
-            if self.broadcast_handler:
-                self.broadcast_handler.broadcast_to_all('route-update', {'data': data}, include_self=False)
-            
-            return jsonify({
+            response = {
                 'message': '✅ Route created successfully',
                 'data': data
-            }), 201
+            }
+            if issued:
+                response['routeToken'] = token
+            return jsonify(response), 201
             
         except Exception as e:
             logging.error(f"❌ Error creating route: {e}")
             return jsonify({'message': 'Failed to create route'}), 500
     
+    def bulk_create_routes(self):
+        """Ingest many routes at once (POST /routes/bulk, JSON array or NDJSON)"""
+        try:
+            if not self.broadcast_handler:
+                return jsonify({'message': '❌ Route ingest unavailable'}), 503
+            
+            token, issued = self._route_token()
+            try:
+                items = parse_bulk_body(request.get_data(), request.content_type)
+                result = self.broadcast_handler.ingest_routes(items, token_owner(token))
+            except ValueError as e:
+                return jsonify({'message': f'❌ {e}'}), 400
+            
+            if issued:
+                # Producers resend this header to keep updating the same routes
+                result['routeToken'] = token
+            return jsonify({
+                'message': '✅ Routes ingested' if result['accepted'] else '⚠️ No valid routes in batch',
+                **result
+            }), 200 if result['accepted'] else 400
+            
+        except Exception as e:
+            logging.error(f"❌ Error in bulk route ingest: {e}")
+            return jsonify({'message': 'Failed to ingest routes'}), 500
+    
     def update_route(self, route_id):
-        """Update an existing route (PUT /routes/<id>)"""
+        """Partially update a route (PATCH/PUT /routes/<id>)
+
+        Only the fields sent are written and broadcast; 'append_path'
+        extends the stored path so a re-plan does not resend the route.
+        Requires the X-Route-Token the route was created with.
+        """
         try:
+            denied = self._check_route_owner(route_id)
+            if denied:
+                return denied
+            
             data = request.get_json()
             if not data:
                 return jsonify({'message': '❌ No data provided'}), 400
             
-            # Add update timestamp
-            data['updated_at'] = datetime.utcnow().isoformat()
+            try:
+                fields, unset, append_path = normalize_route_patch(data)
+            except ValueError as e:
+                return jsonify({'message': f'❌ {e}'}), 400
+            
+            route = None
+            if self.broadcast_handler:
+                route = self.broadcast_handler.update_route(route_id, fields, unset, append_path)
             
             # Update in storage if available
             if self.storage_handler:
-                # This would need to be implemented in storage handler
-                success, message = self.storage_handler.update_route(route_id, data)
-                if not success:
-                    return jsonify({'message': f'❌ Failed to update route: {message}'}), 400
+                success, result = self.storage_handler.update_route(route_id, fields, unset, append_path)
+                if success:
+                    route = route or result
+                elif route is None:
+                    return jsonify({'message': f'❌ Failed to update route: {result}'}), 404
+            
+            if route is None:
+                return jsonify({'message': '❌ Route not found'}), 404
+            if self.match_cache is not None:
+                self.match_cache.invalidate_route(route)
             
-            # Broadcast update to connected clients
+            # Broadcast only the delta to connected clients
             if self.broadcast_handler:
                 self.broadcast_handler.broadcast_to_all('route-updated', {
                     'route_id': route_id,
-                    'data': data
-                }, include_self=False)
+                    'changes': fields,
+                    'removed': unset,
+                    'append_path': append_path
+                })
             
             return jsonify({
                 'message': '✅ Route updated successfully',
-                'data': data
+                'data': route
             }), 200
             
         except Exception as e:
@@ -262,20 +479,31 @@ class RouteHandler:
             return jsonify({'message': 'Failed to update route'}), 500
     
     def delete_route(self, route_id):
-        """Delete a route (DELETE /routes/<id>)"""
+        """Delete a route (DELETE /routes/<id>); requires the route's X-Route-Token"""
         try:
+            denied = self._check_route_owner(route_id)
+            if denied:
+                return denied
+            
+            found = False
+            if self.broadcast_handler:
+                found = self.broadcast_handler.remove_route(route_id)
+            
             # Delete from storage if available
             if self.storage_handler:
-                # This would need to be implemented in storage handler
                 success, message = self.storage_handler.delete_route(route_id)
-                if not success:
-                    return jsonify({'message': f'❌ Failed to delete route: {message}'}), 400
+                found = found or success
+                if not success and not found:
+                    return jsonify({'message': f'❌ Failed to delete route: {message}'}), 404
+            
+            if not found:
+                return jsonify({'message': '❌ Route not found'}), 404
             
             # Broadcast deletion to connected clients
             if self.broadcast_handler:
                 self.broadcast_handler.broadcast_to_all('route-deleted', {
                     'route_id': route_id
-                }, include_self=False)
+                })
             
             return jsonify({
                 'message': '✅ Route deleted successfully'
@@ -288,27 +516,8 @@ class RouteHandler:
     def get_route_stats(self):
         """Get route statistics"""
         try:
-            stats = {
-                'total_routes': 0,
-                'active_routes': 0,
-                'unique_users': 0,
-                'connected_clients': 0
-            }
-            
-            # Get storage stats
-            if self.storage_handler:
-                success, count = self.storage_handler.get_route_count()
-                if success:
-                    stats['total_routes'] = count
-            
-            # Get broadcast stats
-            if self.broadcast_handler:
-                info = self.broadcast_handler.get_connected_clients_info()
-                stats.update({
-                    'active_routes': info.get('active_routes', 0),
-                    'unique_users': info.get('unique_users', 0),
-                    'connected_clients': info.get('connected_clients', 0)
-                })
+            # Cached for a few seconds so polling dashboards do not hit MongoDB
+            stats = self.stats_service.get_stats()
             
             return jsonify({
                 'message': '✅ Route statistics retrieved successfully',
@@ -317,4 +526,96 @@ class RouteHandler:
             
         except Exception as e:
             logging.error(f"❌ Error getting route stats: {e}")
-            return jsonify({'message': 'Failed to get route statistics'}), 500
\ No newline at end of file
+            return jsonify({'message': 'Failed to get route statistics'}), 500
+    
+    def query_route_archive(self):
+        """Admin endpoint scanning archived (expired) routes
+        
+        ?start=&end= (ISO timestamps) or ?days= bound the time range, and
+        ?userID=, ?routeId=, ?source_zone= etc. filter by equality; both are
+        pushed down to the archive files. ?columns=a,b picks the fields
+        returned ('document' is the full stored route). ?limit= caps the rows.
+        """
+        try:
+            auth_key = request.headers.get('Authorization')
+            if auth_key != self.admin_key:
+                return jsonify({'message': 'Unauthorized'}), 401
+            if not self.storage_handler:
+                return jsonify({'message': '❌ Route archive unavailable'}), 503
+            
+            from archive import FILTER_COLUMNS, parse_range
+            try:
+                start, end = parse_range(request.args.get('start'), request.args.get('end'),
+                                         request.args.get('days'))
+                columns = [c for c in request.args.get('columns', '').split(',') if c] or None
+                limit = int(request.args['limit']) if 'limit' in request.args else None
+                filters = {column: request.args[column] for column in FILTER_COLUMNS
+                           if column in request.args}
+                success, result = self.storage_handler.query_archive(start, end, filters, columns, limit)
+            except ValueError as e:
+                return jsonify({'message': f'❌ {e}'}), 400
+            
+            if not success:
+                return jsonify({'message': f'❌ {result}'}), 503
+            return jsonify({
+                'message': '✅ Archived routes retrieved successfully',
+                **result
+            }), 200
+            
+        except Exception as e:
+            logging.error(f"❌ Error querying route archive: {e}")
+            return jsonify({'message': 'Failed to query route archive'}), 500
+    
+    def get_density_tile(self, z, x, y):
+        """Route-density counts for one z/x/y tile, revalidated by ETag"""
+        try:
+            if not self.broadcast_handler:
+                return jsonify({'message': '❌ Density tiles unavailable'}), 503
+            
+            try:
+                etag, tile = self.broadcast_handler.density_tiles.tile(z, x, y)
+            except ValueError as e:
+                return jsonify({'message': f'❌ {e}'}), 400
+            
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = jsonify(tile)
+            response.set_etag(etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = DENSITY_TILE_MAX_AGE
+            return response
+            
+        except Exception as e:
+            logging.error(f"❌ Error getting density tile {z}/{x}/{y}: {e}")
+            return jsonify({'message': 'Failed to get density tile'}), 500
+    
+    def get_memory_report(self):
+        """Admin endpoint reporting memory use per in-process structure
+
+        ?tracemalloc=diff starts tracing on the first call and returns the
+        allocation changes since the previous call on later ones;
+        ?tracemalloc=stop ends tracing. ?types=1 adds live object counts by type.
+        """
+        try:
+            auth_key = request.headers.get('Authorization')
+            if auth_key != self.admin_key:
+                return jsonify({'message': 'Unauthorized'}), 401
+            if not self.memory_inspector:
+                return jsonify({'message': '❌ Memory inspection unavailable'}), 503
+            
+            report = self.memory_inspector.report(include_types=request.args.get('types') == '1')
+            tracing = request.args.get('tracemalloc')
+            if tracing == 'diff':
+                report['tracemalloc_diff'] = self.memory_inspector.tracemalloc_diff(
+                    limit=min(int(request.args.get('limit', 20)), 200)
+                )
+            elif tracing == 'stop':
+                self.memory_inspector.stop_tracing()
+                report['tracemalloc'] = False
+            
+            return jsonify(report), 200
+            
+        except Exception as e:
+            logging.error(f"❌ Error building memory report: {e}")
+            return jsonify({'message': 'Failed to build memory report'}), 500
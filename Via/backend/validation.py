@@ -0,0 +1,386 @@
+"""
+Validation and normalization of inbound route payloads
+"""
+import json
+
+from geo import to_point
+from timewindow import normalize_window
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib decoder is the fallback
+    orjson = None
+
+REQUIRED_ROUTE_FIELDS = ('userID', 'source', 'destination')
+MAX_BULK_ROUTES = 5000
+MAX_PATH_POINTS = 20000
+MAX_ROUTE_ID_LENGTH = 128
+# Below this many points the per-point loop beats building an array
+VECTORIZE_MIN_POINTS = 64
+
+_loads = orjson.loads if orjson else json.loads
+_numpy = None
+
+
+def _load_numpy():
+    """Import numpy on first use so startup and small payloads never pay for it"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:  # numpy is optional; the per-point loop is the fallback
+            _numpy = False
+    return _numpy
+
+
+def parse_payload(payload):
+    """Return payload as a Python object, decoding JSON strings or bytes"""
+    if isinstance(payload, (dict, list)):
+        return payload
+    return _loads(payload)
+
+
+def _in_bounds(lat, lng):
+    # NaN fails both comparisons, so it is rejected too
+    return -90.0 <= lat <= 90.0 and -180.0 <= lng <= 180.0
+
+
+def _parse_coordinates_vectorized(values, numpy):
+    try:
+        coords = numpy.asarray(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        # Ragged rows or {lat, lng} dicts; the per-point loop handles those
+        return None
+    if coords.ndim != 2 or coords.shape[1] < 2:
+        return None
+    coords = coords[:, :2]
+    valid = (numpy.abs(coords[:, 0]) <= 90.0) & (numpy.abs(coords[:, 1]) <= 180.0)
+    if not valid.all():
+        raise ValueError('coordinates out of range')
+    return coords.tolist()
+
+
+def parse_coordinates(values, max_points=MAX_PATH_POINTS):
+    """Parse a list of points into [lat, lng] float pairs
+
+    Raises ValueError if any point is malformed or out of range, so a bad
+    payload is rejected as a whole.
+    """
+    if not isinstance(values, (list, tuple)):
+        raise ValueError('expected an array of points')
+    if len(values) > max_points:
+        raise ValueError(f'at most {max_points} points')
+    if len(values) >= VECTORIZE_MIN_POINTS:
+        numpy = _load_numpy()
+        if numpy:
+            coords = _parse_coordinates_vectorized(values, numpy)
+            if coords is not None:
+                return coords
+
+    coords = []
+    for value in values:
+        point = to_point(value)
+        if point is None or not _in_bounds(*point):
+            raise ValueError('malformed or out-of-range point')
+        coords.append([point[0], point[1]])
+    return coords
+
+
+def normalize_via(via):
+    """Keep only via points that parse as in-range [lat, lng] float pairs"""
+    if not via or not isinstance(via, list):
+        return []
+    try:
+        return parse_coordinates(via)
+    except ValueError:
+        pass
+    # Lenient path: drop bad via points instead of rejecting the route
+    valid_via = []
+    for via_point in via[:MAX_PATH_POINTS]:
+        if isinstance(via_point, list) and len(via_point) >= 2:
+            try:
+                lat, lng = float(via_point[0]), float(via_point[1])
+            except (ValueError, TypeError):
+                continue
+            if _in_bounds(lat, lng):
+                valid_via.append([lat, lng])
+    return valid_via
+
+
+def _check_user_id(value):
+    if isinstance(value, bool) or not isinstance(value, (str, int)) or value == '':
+        return 'expected a non-empty string or number'
+    return None
+
+
+def _check_route_id(value):
+    if isinstance(value, bool) or not isinstance(value, (str, int)) or value == '':
+        return 'expected a non-empty string or number'
+    if len(str(value)) > MAX_ROUTE_ID_LENGTH:
+        return f'at most {MAX_ROUTE_ID_LENGTH} characters'
+    return None
+
+
+def _check_point(value):
+    point = to_point(value)
+    if point is None or not _in_bounds(*point):
+        return 'expected an in-range [lat, lng] point'
+    return None
+
+
+def _parse_path(value):
+    """Return (parsed [lat, lng] pairs, None), or (None, reason) if the path is invalid"""
+    try:
+        return parse_coordinates(value), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def _check_path(value):
+    return _parse_path(value)[1]
+
+
+# Field checks run in order; each returns the reason a value is invalid or None
+ROUTE_SCHEMA = (
+    ('userID', _check_user_id),
+    ('routeId', _check_route_id),
+    ('source', _check_point),
+    ('destination', _check_point),
+    ('path', _check_path),
+)
+ROUTE_CHECKS = dict(ROUTE_SCHEMA)
+# Fields stored in their parsed form, so later stages never parse them again
+ROUTE_PARSERS = {'path': _parse_path}
+# Checked column-wise across a whole batch by validate_batch
+COORDINATE_FIELDS = ('source', 'destination', 'path')
+POINT_ERROR = ROUTE_CHECKS['source']([None, None])
+PATH_ERROR = 'malformed or out-of-range point'
+
+
+def _schema_error(route_data, fields):
+    """First failing ROUTE_SCHEMA check among fields, as a client-facing message
+
+    Fields with a ROUTE_PARSERS entry are replaced by their parsed value.
+    """
+    for field in fields:
+        value = route_data.get(field)
+        if value is None:
+            continue
+        if field in ROUTE_PARSERS:
+            parsed, reason = ROUTE_PARSERS[field](value)
+            if parsed is not None:
+                route_data[field] = parsed
+        else:
+            reason = ROUTE_CHECKS[field](value)
+        if reason:
+            return f'Invalid {field}: {reason}'
+    return None
+
+
+def _structure_error(route_data, required_fields):
+    if not isinstance(route_data, dict):
+        return 'Route must be an object'
+    for field in required_fields:
+        if field not in route_data:
+            return 'Missing required route data'
+    return None
+
+
+def _finish_route(route_data):
+    """Normalize the optional fields of a route that passed validation"""
+    # Fingerprints are always computed server-side
+    route_data.pop('fingerprint', None)
+    route_data['via'] = normalize_via(route_data.get('via'))
+
+    # Keep the departure window only when it parses
+    departure = normalize_window(route_data.get('departure'))
+    if departure:
+        route_data['departure'] = departure
+    else:
+        route_data.pop('departure', None)
+
+
+def normalize_route(route_data, required_fields=REQUIRED_ROUTE_FIELDS):
+    """Validate a route dict in place, returning an error message or None
+
+    Runs before any state or broadcast work, so a rejected payload costs
+    only this check.
+    """
+    error = _structure_error(route_data, required_fields)
+    if error:
+        return error
+    error = _schema_error(route_data, [field for field, _ in ROUTE_SCHEMA])
+    if error:
+        return error
+    _finish_route(route_data)
+    return None
+
+
+def parse_bulk_body(body, content_type=''):
+    """Decode a bulk request body: a JSON array, {'routes': [...]} or NDJSON"""
+    if 'ndjson' in (content_type or ''):
+        return [_loads(line) for line in body.splitlines() if line.strip()]
+    data = parse_payload(body)
+    if isinstance(data, dict):
+        data = data.get('routes')
+    if not isinstance(data, list):
+        raise ValueError('Expected an array of routes')
+    return data
+
+
+def _batch_coordinates(routes):
+    """Check every source, destination and path point of a batch in one array pass
+
+    Returns (paths, errors): the parsed path of each route by position and
+    {position: message} for routes with bad coordinates. Returns None when
+    the batch is small, numpy is unavailable, or some point is not a plain
+    [lat, lng] pair; callers then check route by route.
+    """
+    points = []
+    counts = []
+    for route_data in routes:
+        path = route_data.get('path')
+        if path is None:
+            path = ()
+        if not isinstance(path, (list, tuple)) or len(path) > MAX_PATH_POINTS:
+            return None
+        points.append(route_data['source'])
+        points.append(route_data['destination'])
+        points.extend(path)
+        counts.append(2 + len(path))
+    if len(points) < VECTORIZE_MIN_POINTS:
+        return None
+    numpy = _load_numpy()
+    if not numpy:
+        return None
+    try:
+        coords = numpy.asarray(points, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return None
+    if coords.ndim != 2 or coords.shape[1] < 2:
+        return None
+
+    # NaN fails both comparisons, so it is rejected too
+    in_range = (numpy.abs(coords[:, 0]) <= 90.0) & (numpy.abs(coords[:, 1]) <= 180.0)
+    ends = numpy.cumsum(counts)
+    errors = {}
+    for row in numpy.flatnonzero(~in_range):
+        position = int(numpy.searchsorted(ends, row, side='right'))
+        offset = int(row - (ends[position] - counts[position]))
+        # Report the first bad field of each route, like normalize_route
+        field = COORDINATE_FIELDS[min(offset, 2)]
+        if position not in errors or offset < errors[position][0]:
+            errors[position] = (offset, field)
+    errors = {
+        position: f"Invalid {field}: {POINT_ERROR if field != 'path' else PATH_ERROR}"
+        for position, (_, field) in errors.items()
+    }
+
+    # One conversion for the whole batch, then each path is a slice of it
+    pairs = coords[:, :2].tolist()
+    paths = [pairs[end - count + 2:end] for end, count in zip(ends.tolist(), counts)]
+    return paths, errors
+
+
+def validate_batch(items):
+    """Normalize every route in a batch, returning (valid_routes, errors)
+
+    Structure and userID are checked per route; coordinates are checked for
+    the whole batch at once when numpy is available.
+    """
+    if len(items) > MAX_BULK_ROUTES:
+        raise ValueError(f'At most {MAX_BULK_ROUTES} routes per batch')
+    errors = []
+    checked = []
+    for index, route_data in enumerate(items):
+        error = _structure_error(route_data, REQUIRED_ROUTE_FIELDS) or _schema_error(route_data, ('userID', 'routeId'))
+        if error:
+            errors.append({'index': index, 'message': error})
+        else:
+            checked.append((index, route_data))
+
+    batch = _batch_coordinates([route_data for _, route_data in checked])
+    valid_routes = []
+    for position, (index, route_data) in enumerate(checked):
+        if batch is None:
+            error = _schema_error(route_data, COORDINATE_FIELDS)
+        else:
+            error = batch[1].get(position)
+        if error:
+            errors.append({'index': index, 'message': error})
+            continue
+        if batch is not None and route_data.get('path') is not None:
+            route_data['path'] = batch[0][position]
+        _finish_route(route_data)
+        valid_routes.append(route_data)
+    errors.sort(key=lambda error: error['index'])
+    return valid_routes, errors
+
+
+# Fields a client may change on an existing route
+MUTABLE_ROUTE_FIELDS = ('source', 'destination', 'path', 'via', 'departure')
+
+
+def normalize_route_patch(data):
+    """Validate a partial route update
+
+    Returns (fields_to_set, fields_to_unset, append_path). 'append_path'
+    extends the stored path instead of resending it. Raises ValueError with
+    a client-facing message on invalid input.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Update must be an object')
+
+    unknown = set(data) - set(MUTABLE_ROUTE_FIELDS) - {'append_path'}
+    if unknown:
+        raise ValueError(f"Fields cannot be updated: {', '.join(sorted(unknown))}")
+
+    fields = {}
+    unset = []
+    for field in MUTABLE_ROUTE_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == 'via':
+            fields['via'] = normalize_via(value)
+        elif field == 'departure':
+            if value is None:
+                unset.append('departure')
+                continue
+            departure = normalize_window(value)
+            if not departure:
+                raise ValueError('Invalid departure window')
+            fields['departure'] = departure
+        elif value is None:
+            raise ValueError(f'{field} cannot be removed')
+        else:
+            error = _schema_error(data, (field,))
+            if error:
+                raise ValueError(error)
+            fields[field] = data[field]
+
+    append_path = data.get('append_path')
+    if append_path is not None:
+        if not isinstance(append_path, list):
+            raise ValueError('append_path must be an array of points')
+        append_path, reason = _parse_path(append_path)
+        if reason:
+            raise ValueError(f'Invalid append_path: {reason}')
+        if 'path' in fields:
+            raise ValueError('Send either path or append_path, not both')
+
+    if not fields and not unset and not append_path:
+        raise ValueError('No changes provided')
+    return fields, unset, append_path or []
+
+
+def apply_route_patch(route_data, fields, unset, append_path):
+    """Return a copy of route_data with a validated patch applied"""
+    updated = dict(route_data)
+    updated.update(fields)
+    for field in unset:
+        updated.pop(field, None)
+    if append_path:
+        updated['path'] = list(updated.get('path') or []) + append_path
+    return updated